@@ -1,18 +1,26 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, File, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, File, UploadFile, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, EmailStr, Field, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, validator, ValidationError
 from pydantic_settings import BaseSettings
 from typing import List, Dict, Optional
 import numpy as np
-from scipy.optimize import fsolve
+from scipy.optimize import brentq
+from scipy import stats
 import warnings
 warnings.filterwarnings('ignore')
 import tempfile
+import sys
+import asyncio
+import anyio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
@@ -20,15 +28,21 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # Renderização sem pyplot (thread-safe por figura)
 from motor.motor_asyncio import AsyncIOMotorClient
 import uuid
 import hmac
 import hashlib
 import base64
 import json
+import orjson
+import gzip
+import time
+try:
+    import brotli  # Opcional: sem ele a compressão negociada fica só em gzip
+except ImportError:
+    brotli = None
 from notion_client import Client
 import anthropic
 import PyPDF2
@@ -107,6 +121,22 @@ class DetalhamentoMes(BaseModel):
     saldo_devedor: float
     eh_contemplacao: bool
 
+class DetalhamentoColunar(BaseModel):
+    """
+    Detalhamento em colunas (formato=colunar): a posição i de cada lista é o mês i+1.
+    Se só parte dos meses foi pedida (detalhe/meses), 'mes' traz o mês de cada posição.
+    """
+    mes_contemplacao: int
+    mes: Optional[List[int]] = None
+    data: List[str]
+    ano: List[int]
+    fator_correcao: List[float]
+    valor_carta_corrigido: List[float]
+    parcela_corrigida: List[float]  # Também é a parcela_antes/parcela_depois do formato em linhas
+    lance_livre: List[float]
+    fluxo_liquido: List[float]
+    saldo_devedor: List[float]
+
 class ResumoFinanceiro(BaseModel):
     base_contrato: float
     valor_lance_livre: float
@@ -135,6 +165,20 @@ class ResultadosSimulacao(BaseModel):
     convergiu: bool
     motivo_erro: Optional[str]
 
+class CETEsperadoCenario(BaseModel):
+    cet_anual_esperado: Optional[float]
+    cet_anual_p10: Optional[float]
+    cet_anual_mediana: Optional[float]
+    cet_anual_p90: Optional[float]
+    prob_cet_valido: float  # Probabilidade dos meses em que o CET é válido
+    vpl_esperado: float
+    total_pago_esperado: float  # Todas as parcelas mais o lance livre
+    mes_esperado: float
+
+class CETEsperado(BaseModel):
+    sem_lance: Optional[CETEsperadoCenario] = None
+    com_lance: Optional[CETEsperadoCenario] = None
+
 class RespostaSimulacao(BaseModel):
     erro: bool
     mensagem: Optional[str] = None
@@ -142,11 +186,70 @@ class RespostaSimulacao(BaseModel):
     resultados: Optional[ResultadosSimulacao] = None
     fluxos: List[float] = []
     detalhamento: List[DetalhamentoMes] = []
+    detalhamento_colunar: Optional[DetalhamentoColunar] = None  # Só com formato=colunar
     resumo_financeiro: Optional[ResumoFinanceiro] = None
+    cet_esperado: Optional[CETEsperado] = None  # Ponderado pela probabilidade de contemplação
+
+class RespostaSimulacaoLote(BaseModel):
+    erro: bool  # True só se todos os itens falharem
+    mensagem: Optional[str] = None
+    total: int = 0
+    total_erros: int = 0
+    resultados: List[RespostaSimulacao] = []
+
+class PontoVarreduraContemplacao(BaseModel):
+    mes_contemplacao: int
+    cet_anual: Optional[float]
+    cet_mensal: Optional[float]
+    vpl: Optional[float]
+    fluxo_contemplacao: float
+    convergiu: bool
+    motivo_erro: Optional[str]
+    iteracoes_cet: int = 0
+    motivo_convergencia: Optional[str] = None
+
+# Maior prazo de /simular-meses-contemplacao: um CET resolvido por mês (~0,2 s em 1200 meses)
+LIMITE_PRAZO_VARREDURA = 1200
+
+class RespostaVarreduraContemplacao(BaseModel):
+    erro: bool
+    mensagem: Optional[str] = None
+    parametros: Optional[ParametrosConsorcio] = None
+    taxa_desconto_vpl: Optional[float] = None
+    iteracoes_cet: int = 0  # Total de iterações do solver em todos os meses
+    pontos: List[PontoVarreduraContemplacao] = []
+
+class AlteracoesConsorcio(BaseModel):
+    """Campos de ParametrosConsorcio alterados (com os mesmos tipos); os ausentes ficam como estão."""
+    model_config = ConfigDict(extra='allow')  # Campos desconhecidos viram erro 400 em /simular-incremental
+    
+    valor_carta: Optional[float] = None
+    prazo_meses: Optional[int] = None
+    taxa_admin: Optional[float] = None
+    fundo_reserva: Optional[float] = None
+    mes_contemplacao: Optional[int] = None
+    lance_livre_perc: Optional[float] = None
+    taxa_reajuste_anual: Optional[float] = None
+
+class RequisicaoSimulacaoIncremental(BaseModel):
+    sessao_id: Optional[str] = None
+    parametros: Optional[ParametrosConsorcio] = None  # Obrigatório ao abrir uma sessão
+    alteracoes: AlteracoesConsorcio = Field(default_factory=AlteracoesConsorcio)  # Só os campos alterados desde a última simulação da sessão
+
+class RespostaSimulacaoIncremental(RespostaSimulacao):
+    sessao_id: Optional[str] = None
+    modo: Optional[str] = None  # 'incremental' ou 'completo'
+    meses_alterados: List[int] = []  # Meses do detalhamento que mudaram
+
+# Máximo de cenários aceitos por chamada de /simular-lote e maior prazo de cada um
+# (a matriz cenários × meses do lote é dimensionada pelo maior prazo)
+LIMITE_SIMULACOES_LOTE = 100
+LIMITE_PRAZO_LOTE = 1200
 
 class ParametrosProbabilidade(BaseModel):
     num_participantes: int = 430
     lance_livre_perc: float = 0.10
+    pontos_curva: Optional[int] = None  # Reduz as curvas a até N pontos (grupos grandes); None = todos os meses
 
 class CurvasProbabilidade(BaseModel):
     meses: List[int]
@@ -165,6 +268,789 @@ class RespostaProbabilidades(BaseModel):
     com_lance: Optional[CurvasProbabilidade] = None
     parametros: Optional[Dict] = None
 
+class RespostaSimulacaoCompleta(RespostaSimulacao):
+    """
+    Resposta de /simular-completo: a de /simular mais o gráfico de
+    /grafico-probabilidades e as curvas de /calcular-probabilidades do mesmo
+    grupo (participantes = 2 × prazo).
+    """
+    grafico_probabilidade: Optional[Dict] = None
+    probabilidades: Optional[RespostaProbabilidades] = None
+
+# Limites de /probabilidades-cronograma(-lote)
+LIMITE_MESES_CRONOGRAMA = 1200
+LIMITE_CRONOGRAMAS_LOTE = 100
+
+class CronogramaAssembleias(BaseModel):
+    """
+    Cronograma real de assembleias de um grupo: contagens por mês (índice 0 = mês 1).
+    
+    Os participantes ativos de cada assembleia vêm de participantes_restantes ou,
+    se omitido, de participantes_iniciais descontando contemplados (sorteios e
+    lances), desistências e somando reativações dos meses anteriores.
+    """
+    nome: Optional[str] = None  # Identificação do grupo na comparação em lote
+    sorteios: List[float]
+    lances: Optional[List[float]] = None  # None = só a curva sem lance
+    participantes_iniciais: Optional[int] = None
+    participantes_restantes: Optional[List[float]] = None
+    desistencias: Optional[List[float]] = None
+    reativacoes: Optional[List[float]] = None
+    pontos_curva: Optional[int] = None
+
+class RespostaProbabilidadesCronograma(RespostaProbabilidades):
+    nome: Optional[str] = None
+
+class RespostaProbabilidadesCronogramaLote(BaseModel):
+    erro: bool  # True só se todos os itens falharem
+    mensagem: Optional[str] = None
+    total: int = 0
+    total_erros: int = 0
+    resultados: List[RespostaProbabilidadesCronograma] = []
+
+class ParametrosDisputaLance(BaseModel):
+    """
+    Disputa de lance simulada por Monte Carlo (/probabilidade-lance). O grupo segue
+    a regra de /simular (participantes = 2 × prazo); em cada assembleia cada um dos
+    demais participantes oferta com probabilidade fracao_ofertantes um lance (fração
+    da carta) sorteado da distribuição escolhida, e os lances_por_mes maiores vencem.
+    """
+    prazo_meses: int = 120
+    lance_livre_perc: float = 0.10
+    fracao_ofertantes: float = 0.30
+    distribuicao: str = 'beta'  # 'beta' (média/desvio), 'uniforme' ou 'triangular' (moda = lance_medio), em [0, lance_maximo]
+    lance_medio: float = 0.25
+    lance_desvio: float = 0.10
+    lance_maximo: float = 0.60
+    lances_por_mes: int = 1
+    simulacoes: int = 2000  # Máximo de rodadas; o orçamento de tempo pode parar antes
+    orcamento_ms: Optional[float] = None  # None = ORCAMENTO_MONTE_CARLO_MS
+    semente: int = 0
+    pontos_curva: Optional[int] = None
+
+class RespostaDisputaLance(BaseModel):
+    erro: bool
+    mensagem: Optional[str] = None
+    meses: List[int] = []
+    probabilidade_lance: List[float] = []  # % de vencer a disputa de lance no mês, se ainda não contemplado
+    erro_padrao_lance: List[float] = []  # Erro padrão da estimativa acima, em %
+    sem_lance: Optional[CurvasProbabilidade] = None
+    com_lance: Optional[CurvasProbabilidade] = None  # Sorteio + disputa de lance simulada
+    simulacoes: int = 0  # Rodadas efetivamente feitas
+    parametros: Optional[Dict] = None
+
+# Meses em português (rótulo "set/25", "out/25", ...)
+MESES_PT = ['', 'jan', 'fev', 'mar', 'abr', 'mai', 'jun',
+            'jul', 'ago', 'set', 'out', 'nov', 'dez']
+
+def para_centavos(valores) -> np.ndarray:
+    """
+    Converte valores em reais para centavos inteiros (int64).
+    
+    Regra de arredondamento: cada valor é arredondado individualmente para o
+    centavo mais próximo, com meio centavo para longe do zero (arredondamento
+    comercial). Somas e totais são feitos depois, já em centavos, e são exatos.
+    """
+    valores = np.asarray(valores, dtype=float)
+    return (np.sign(valores) * np.floor(np.abs(valores) * 100 + 0.5)).astype(np.int64)
+
+class CronogramaConsorcio:
+    """
+    Cronograma mensal do consórcio em colunas NumPy.
+    
+    Cada coluna tem uma posição por mês (índice 0 = mês 1). As colunas em reais
+    (float) são usadas no CET/VPL; valores exibidos (detalhamento, fluxos da
+    resposta, PDF, gráficos) e totais vêm das colunas em centavos inteiros (ver
+    centavos, convertidas uma vez por cronograma). As linhas no formato de
+    DetalhamentoMes só são montadas quando algum chamador precisa delas.
+    """
+    
+    COLUNAS_MONETARIAS = ('valor_carta_corrigido', 'parcela_corrigida', 'lance_livre', 'fluxo_liquido', 'saldo_devedor')
+    
+    def __init__(self, ano, fator_correcao, valor_carta_corrigido, parcela_corrigida,
+                 lance_livre, fluxo_liquido, saldo_devedor, mes_contemplacao: int,
+                 centavos: Optional[Dict[str, np.ndarray]] = None):
+        self.ano = ano
+        self.fator_correcao = fator_correcao
+        self.valor_carta_corrigido = valor_carta_corrigido
+        self.parcela_corrigida = parcela_corrigida
+        self.lance_livre = lance_livre
+        self.fluxo_liquido = fluxo_liquido
+        self.saldo_devedor = saldo_devedor
+        self.mes_contemplacao = mes_contemplacao
+        self._centavos = centavos  # Colunas monetárias inteiras em centavos (None = converter no primeiro uso)
+    
+    @property
+    def prazo(self) -> int:
+        return len(self.fluxo_liquido)
+    
+    def fluxos(self) -> np.ndarray:
+        """Vetor de fluxos de caixa com t=0 (fluxo nulo) na primeira posição."""
+        return np.concatenate(([0.0], self.fluxo_liquido))
+    
+    def fluxos_arredondados(self) -> List[float]:
+        """Fluxos como em fluxos(), arredondados ao centavo como o detalhamento (para a resposta)."""
+        return (np.concatenate(([0], self.centavos()['fluxo_liquido'])) / 100).tolist()
+    
+    def datas(self, inicio: int = 1, fim: Optional[int] = None) -> List[str]:
+        """Datas formatadas (set/25, out/25, etc.) dos meses inicio..fim."""
+        fim = self.prazo if fim is None else fim
+        return self.datas_meses(range(inicio, fim + 1))
+    
+    @staticmethod
+    def datas_meses(meses) -> List[str]:
+        """Datas formatadas dos meses indicados."""
+        return [f"{MESES_PT[(mes - 1) % 12 + 1]}/{str(2025 + (mes - 1) // 12)[2:]}" for mes in meses]
+    
+    def _indices(self, meses: Optional[np.ndarray]):
+        """Índices das colunas para os meses indicados (todos se None)."""
+        return slice(None) if meses is None else np.asarray(meses, dtype=int) - 1
+    
+    def centavos(self, meses: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """Colunas monetárias dos meses indicados (todos se None) em centavos inteiros (int64, ver para_centavos)."""
+        if self._centavos is None:
+            self._centavos = {coluna: para_centavos(getattr(self, coluna)) for coluna in self.COLUNAS_MONETARIAS}
+        indices = self._indices(meses)
+        return {coluna: valores[indices] for coluna, valores in self._centavos.items()}
+    
+    def invalidar_centavos(self):
+        """Descarta os centavos convertidos depois de alterar as colunas em reais."""
+        self._centavos = None
+    
+    def colunas(self, meses: Optional[np.ndarray] = None) -> Dict:
+        """
+        Detalhamento em colunas (formato de DetalhamentoColunar), sem colunas repetidas.
+        Para um subconjunto de meses inclui a coluna 'mes'.
+        """
+        indices = self._indices(meses)
+        reais = {coluna: (valores / 100).tolist() for coluna, valores in self.centavos(meses).items()}
+        return {
+            'mes_contemplacao': self.mes_contemplacao,
+            'mes': None if meses is None else np.asarray(meses, dtype=int).tolist(),
+            'data': self.datas() if meses is None else self.datas_meses(meses),
+            'ano': self.ano[indices].tolist(),
+            'fator_correcao': self.fator_correcao[indices].tolist(),
+            **reais
+        }
+    
+    def detalhamento(self, inicio: int = 1, fim: Optional[int] = None) -> List[Dict]:
+        """Monta as linhas (dicts) dos meses inicio..fim, inclusive, com valores em centavos exatos."""
+        inicio = max(1, inicio)
+        fim = self.prazo if fim is None else min(fim, self.prazo)
+        return self.detalhamento_meses(np.arange(inicio, fim + 1))
+    
+    def detalhamento_meses(self, meses) -> List[Dict]:
+        """Monta as linhas (dicts) só dos meses indicados (1..prazo), na ordem dada."""
+        meses = np.asarray(meses, dtype=int)
+        if len(meses) == 0:
+            return []
+        
+        indices = meses - 1
+        reais = {coluna: (valores / 100).tolist() for coluna, valores in self.centavos(meses).items()}
+        colunas = zip(
+            meses.tolist(),
+            self.datas_meses(meses.tolist()),
+            self.ano[indices].tolist(),
+            self.fator_correcao[indices].tolist(),
+            reais['valor_carta_corrigido'],
+            reais['parcela_corrigida'],
+            reais['lance_livre'],
+            reais['fluxo_liquido'],
+            reais['saldo_devedor']
+        )
+        
+        return [
+            {
+                'mes': mes,
+                'data': data,
+                'ano': ano,
+                'fator_correcao': fator,
+                'valor_carta_corrigido': carta,
+                'parcela_corrigida': parcela,
+                'parcela_antes': parcela,  # Igual à parcela corrigida
+                'parcela_depois': parcela,  # Igual à parcela corrigida (consórcio não muda após contemplação)
+                'lance_livre': lance,
+                'fluxo_liquido': fluxo,
+                'saldo_devedor': saldo,
+                'eh_contemplacao': mes == self.mes_contemplacao
+            }
+            for mes, data, ano, fator, carta, parcela, lance, fluxo, saldo in colunas
+        ]
+
+class FluxoBlocosAnuais:
+    """
+    Fluxo de caixa do consórcio descrito por blocos anuais.
+    
+    Dentro de cada ano do contrato a parcela é constante e só muda pelo reajuste
+    anual, então o valor presente de um ano é uma série geométrica. Com isso o
+    VPL custa O(anos) em vez de O(meses). Entradas pontuais (carta recebida
+    menos lance livre na contemplação) ficam em 'eventos'.
+    
+    vpv e derivada aceitam uma taxa escalar ou um vetor de taxas.
+    """
+    
+    def __init__(self, parcela_base: float, taxa_reajuste_anual: float, prazo_meses: int,
+                 eventos: Optional[Dict[int, float]] = None):
+        anos_completos, meses_resto = divmod(prazo_meses, 12)
+        num_anos = anos_completos + (1 if meses_resto else 0)
+        
+        self.prazo = prazo_meses
+        self.anos = np.arange(num_anos, dtype=float)
+        # Fluxo de cada mês do ano y (pagamento da parcela corrigida)
+        self.fluxo_mensal_ano = -parcela_base * (1 + taxa_reajuste_anual) ** self.anos
+        self.meses_no_ano = np.full(num_anos, 12)
+        if meses_resto:
+            self.meses_no_ano[-1] = meses_resto
+        
+        eventos = eventos or {}
+        self.meses_eventos = np.array(list(eventos.keys()), dtype=float)
+        self.valores_eventos = np.array(list(eventos.values()), dtype=float)
+    
+    @staticmethod
+    def _escalar_ou_vetor(valor):
+        return float(valor) if np.ndim(valor) == 0 else valor
+    
+    def vpv(self, taxa_mensal):
+        """Valor presente dos fluxos à taxa mensal dada (t=0 sem desconto)."""
+        taxa = np.asarray(taxa_mensal, dtype=float)[..., None]
+        log_fator = np.log1p(taxa)
+        
+        # Σ_{k=1..n} (1+i)^-k = (1 - (1+i)^-n) / i, estável para i → 0 (limite n)
+        soma_ano = np.divide(
+            -np.expm1(-self.meses_no_ano * log_fator), taxa,
+            out=np.broadcast_to(self.meses_no_ano, np.broadcast_shapes(taxa.shape, self.anos.shape)).astype(float),
+            where=taxa != 0
+        )
+        # Desconto do início de cada ano: (1+i)^-(12·y)
+        desconto_ano = np.exp(-12.0 * log_fator * self.anos)
+        
+        vp_parcelas = np.sum(self.fluxo_mensal_ano * desconto_ano * soma_ano, axis=-1)
+        vp_eventos = np.sum(self.valores_eventos * np.exp(-log_fator * self.meses_eventos), axis=-1)
+        
+        return self._escalar_ou_vetor(vp_parcelas + vp_eventos)
+    
+    def derivada(self, taxa_mensal):
+        """Derivada analítica do VPV: -Σ t·cf_t·(1+i)^-(t+1), também por blocos anuais."""
+        taxa = np.asarray(taxa_mensal, dtype=float)[..., None]
+        log_fator = np.log1p(taxa)
+        
+        # Para o mês k do ano y: t = 12·y + k, logo Σ_k t·v^t = v^(12y)·(12y·Σ v^k + Σ k·v^k)
+        k = np.arange(1, 13, dtype=float)
+        potencias = np.exp(-log_fator * k)
+        soma_v = np.cumsum(potencias, axis=-1)[..., self.meses_no_ano - 1]
+        soma_kv = np.cumsum(k * potencias, axis=-1)[..., self.meses_no_ano - 1]
+        desconto_ano = np.exp(-12.0 * log_fator * self.anos)
+        
+        momento_parcelas = np.sum(self.fluxo_mensal_ano * desconto_ano * (12.0 * self.anos * soma_v + soma_kv), axis=-1)
+        momento_eventos = np.sum(self.meses_eventos * self.valores_eventos * np.exp(-log_fator * self.meses_eventos), axis=-1)
+        
+        return self._escalar_ou_vetor(-(momento_parcelas + momento_eventos) / (1 + taxa[..., 0]))
+
+
+# Taxa de desconto anual usada no VPL (10% para teste, conforme solicitado)
+TAXA_DESCONTO_VPL = 0.10
+
+# Intervalo de CET aceito: anual entre -99% e 500% (em taxa mensal equivalente)
+TAXA_MENSAL_MIN = (1 - 0.99) ** (1/12) - 1
+TAXA_MENSAL_MAX = (1 + 5.0) ** (1/12) - 1
+
+def funcoes_vpv(fluxos):
+    """Retorna (vpv, derivada) vetorizados para um vetor de fluxos com t=0 na primeira posição."""
+    fluxos = np.asarray(fluxos, dtype=float)
+    t = np.arange(len(fluxos), dtype=float)
+    
+    def vpv(taxa_mensal):
+        log_fator = np.log1p(np.asarray(taxa_mensal, dtype=float))[..., None]
+        return FluxoBlocosAnuais._escalar_ou_vetor(np.exp(-log_fator * t) @ fluxos)
+    
+    def derivada(taxa_mensal):
+        log_fator = np.log1p(np.asarray(taxa_mensal, dtype=float))[..., None]
+        return FluxoBlocosAnuais._escalar_ou_vetor(-(np.exp(-log_fator * (t + 1)) @ (t * fluxos)))
+    
+    return vpv, derivada
+
+def _grade_tir(taxa_min: float, taxa_max: float, taxa_referencia: float, pontos_grade: int) -> np.ndarray:
+    """Grade de taxas para isolar a raiz do VPV (mais densa perto de zero)."""
+    return np.unique(np.concatenate((
+        np.linspace(taxa_min, taxa_max, pontos_grade),
+        np.linspace(-0.02, 0.05, pontos_grade // 2),
+        [taxa_referencia]
+    )))
+
+def _isolar_raizes(grade: np.ndarray, valores: np.ndarray, taxa_referencia: float) -> Dict:
+    """
+    Isola uma raiz por linha de 'valores' (VPV de cada cenário nos pontos da grade).
+    
+    Havendo várias trocas de sinal, escolhe o intervalo mais próximo de
+    'taxa_referencia'. Pontos da grade com VPV exatamente zero já são a raiz.
+    
+    Returns:
+        dict com vetores por linha: 'exata', 'taxa_exata', 'com_intervalo', 'a', 'b', 'fa'
+    """
+    valores = np.atleast_2d(valores)
+    linhas = np.arange(len(valores))
+    
+    exata = valores == 0
+    com_exata = exata.any(axis=1)
+    taxa_exata = grade[np.argmin(np.where(exata, np.abs(grade - taxa_referencia), np.inf), axis=1)]
+    
+    validos = np.isfinite(valores)
+    mudancas = validos[:, :-1] & validos[:, 1:] & (np.sign(valores[:, :-1]) != np.sign(valores[:, 1:]))
+    centros = (grade[:-1] + grade[1:]) / 2
+    j = np.argmin(np.where(mudancas, np.abs(centros - taxa_referencia), np.inf), axis=1)
+    
+    return {
+        'exata': com_exata,
+        'taxa_exata': taxa_exata,
+        'com_intervalo': mudancas.any(axis=1) & ~com_exata,
+        'a': grade[j],
+        'b': grade[j + 1],
+        'fa': valores[linhas, j]
+    }
+
+def resolver_tir(vpv, derivada, taxa_min: float = TAXA_MENSAL_MIN, taxa_max: float = TAXA_MENSAL_MAX,
+                 taxa_referencia: float = 0.005, pontos_grade: int = 64, tol_vpv: float = 1e-6,
+                 xtol: float = 1e-14, max_iter: int = 60, intervalo: Optional[tuple] = None,
+                 taxa_inicial: Optional[float] = None) -> Dict:
+    """
+    Encontra a TIR mensal (raiz do VPV) com custo limitado e previsível.
+    
+    1. Isola a raiz: avalia o VPV numa grade de taxas (uma chamada vetorizada) e
+       procura mudanças de sinal. Havendo várias raízes, usa o intervalo mais
+       próximo de 'taxa_referencia' (o primeiro chute do método antigo).
+    2. Refina com Newton (derivada analítica) protegido pelo intervalo: passos
+       que saem do intervalo ou não encolhem o suficiente viram bisseção.
+    3. Se ainda não convergiu em 'max_iter' passos, recorre ao método de Brent.
+    
+    Args:
+        intervalo: (a, b, vpv(a)) já isolado pelo chamador; pula a etapa 1
+        taxa_inicial: Ponto de partida do Newton (ex.: raiz de um cenário vizinho),
+            usado se estiver dentro do intervalo
+    
+    Returns:
+        dict com 'taxa_mensal' (NaN se não encontrada), 'convergiu', 'iteracoes' e 'motivo'
+    """
+    if intervalo is None:
+        # 1. Isolamento por análise de sinais numa grade (densa perto de zero)
+        grade = _grade_tir(taxa_min, taxa_max, taxa_referencia, pontos_grade)
+        isolamento = _isolar_raizes(grade, np.asarray(vpv(grade), dtype=float), taxa_referencia)
+        
+        if isolamento['exata'][0]:
+            return {'taxa_mensal': float(isolamento['taxa_exata'][0]), 'convergiu': True, 'iteracoes': 0,
+                    'motivo': 'Raiz exata na grade'}
+        
+        if not isolamento['com_intervalo'][0]:
+            return {'taxa_mensal': np.nan, 'convergiu': False, 'iteracoes': 0,
+                    'motivo': 'Sem mudança de sinal do VPV no intervalo de CET válido'}
+        
+        intervalo = (isolamento['a'][0], isolamento['b'][0], isolamento['fa'][0])
+    
+    a, b, fa = (float(v) for v in intervalo)
+    
+    # 2. Newton protegido pelo intervalo [a, b]
+    if taxa_inicial is not None and a < taxa_inicial < b:
+        x = taxa_inicial
+    else:
+        x = taxa_referencia if a < taxa_referencia < b else (a + b) / 2
+    passo_anterior = b - a
+    for iteracao in range(1, max_iter + 1):
+        fx = vpv(x)
+        dfx = derivada(x)
+        
+        if abs(fx) < tol_vpv:
+            return {'taxa_mensal': x, 'convergiu': True, 'iteracoes': iteracao, 'motivo': 'Newton: |VPV| < tolerância'}
+        
+        # Atualizar o intervalo mantendo a troca de sinal
+        if np.sign(fx) == np.sign(fa):
+            a, fa = x, fx
+        else:
+            b = x
+        
+        if b - a <= xtol * max(1.0, abs(x)):
+            return {'taxa_mensal': x, 'convergiu': True, 'iteracoes': iteracao, 'motivo': 'Intervalo menor que a tolerância'}
+        
+        x_newton = x - fx / dfx if dfx != 0 else np.nan
+        if np.isfinite(x_newton) and a < x_newton < b and abs(x_newton - x) < 0.5 * abs(passo_anterior):
+            passo_anterior = x_newton - x
+            x = x_newton
+        else:
+            passo_anterior = (b - a) / 2
+            x = a + passo_anterior
+    
+    # 3. Recurso final: Brent no intervalo atual
+    try:
+        raiz, info = brentq(vpv, a, b, xtol=xtol, full_output=True)
+        return {'taxa_mensal': float(raiz), 'convergiu': bool(info.converged),
+                'iteracoes': max_iter + info.iterations, 'motivo': 'Brent após Newton sem convergência'}
+    except ValueError as e:
+        return {'taxa_mensal': np.nan, 'convergiu': False, 'iteracoes': max_iter,
+                'motivo': f"Brent falhou: {str(e)[:50]}"}
+
+def intervalo_em_torno(vpv, taxa_mensal: float, largura: float = 1e-9) -> Optional[tuple]:
+    """
+    Intervalo (a, b, vpv(a)) de meia-largura relativa 'largura' em torno de uma raiz
+    conhecida, para resolver_tir; None se o VPV não trocar de sinal nele.
+    """
+    delta = largura * max(1.0, abs(taxa_mensal))
+    a, b = taxa_mensal - delta, taxa_mensal + delta
+    fa, fb = np.asarray(vpv(np.array([a, b])), dtype=float)
+    if not (np.isfinite(fa) and np.isfinite(fb)) or np.sign(fa) == np.sign(fb):
+        return None
+    return (a, b, fa)
+
+def resolver_tir_lote(fluxos, taxa_min: float = TAXA_MENSAL_MIN, taxa_max: float = TAXA_MENSAL_MAX,
+                      taxa_referencia: float = 0.005, pontos_grade: int = 64, **opcoes) -> Dict:
+    """
+    Versão em lote de resolver_tir: encontra a TIR mensal de cada linha de uma matriz
+    de fluxos (cenários × meses, t=0 na primeira coluna).
+    
+    Todas as linhas avançam juntas: a grade de isolamento é um único produto de
+    matrizes e cada passo de Newton/bisseção é uma operação NumPy sobre as linhas
+    ainda ativas (ver refinar_raizes_lote). Cenários de prazos diferentes podem
+    ser completados com zeros à direita, que não alteram o VPV.
+    
+    Returns:
+        dict com vetores 'taxa_mensal', 'convergiu', 'iteracoes' e a lista 'motivo'
+    """
+    fluxos = np.atleast_2d(np.asarray(fluxos, dtype=float))
+    t = np.arange(fluxos.shape[1], dtype=float)
+    fluxos_t = fluxos * t
+    
+    # 1. Isolamento: VPV de todas as linhas em todos os pontos da grade num só produto
+    grade = _grade_tir(taxa_min, taxa_max, taxa_referencia, pontos_grade)
+    with np.errstate(over='ignore', invalid='ignore'):
+        valores = fluxos @ np.exp(-np.outer(t, np.log1p(grade)))
+    isolamento = _isolar_raizes(grade, valores, taxa_referencia)
+    
+    def avaliar(linhas, taxas):
+        log_fator = np.log1p(taxas)[:, None]
+        potencias = np.exp(-log_fator * t)
+        fx = np.sum(fluxos[linhas] * potencias, axis=1)
+        dfx = -np.sum(fluxos_t[linhas] * potencias, axis=1) / (1 + taxas)
+        return fx, dfx
+    
+    return refinar_raizes_lote(avaliar, isolamento, taxa_referencia, **opcoes)
+
+def refinar_raizes_lote(avaliar, isolamento: Dict, taxa_referencia: float = 0.005,
+                        taxa_inicial: Optional[np.ndarray] = None, tol_vpv: float = 1e-6,
+                        xtol: float = 1e-14, max_iter: int = 60, max_iter_bissecao: int = 200) -> Dict:
+    """
+    Refina, em todas as linhas ao mesmo tempo, as raízes já isoladas por _isolar_raizes.
+    
+    Newton protegido pelo intervalo, sincronizado entre as linhas ainda ativas;
+    linhas que não convergem com Newton continuam por bisseção (no lugar do
+    Brent da versão escalar).
+    
+    Args:
+        avaliar: função (linhas, taxas) -> (vpv, derivada) vetorizada nas linhas indicadas
+        taxa_inicial: Ponto de partida por linha (usado se estiver dentro do intervalo)
+    
+    Returns:
+        dict com vetores 'taxa_mensal', 'convergiu', 'iteracoes' e a lista 'motivo'
+    """
+    num_linhas = len(isolamento['a'])
+    taxa = np.full(num_linhas, np.nan)
+    convergiu = np.zeros(num_linhas, dtype=bool)
+    iteracoes = np.zeros(num_linhas, dtype=int)
+    motivo = np.full(num_linhas, 'Sem mudança de sinal do VPV no intervalo de CET válido', dtype=object)
+    
+    com_exata = isolamento['exata']
+    taxa[com_exata] = isolamento['taxa_exata'][com_exata]
+    convergiu[com_exata] = True
+    motivo[com_exata] = 'Raiz exata na grade'
+    
+    a, b, fa = isolamento['a'].copy(), isolamento['b'].copy(), isolamento['fa'].copy()
+    x = np.where((a < taxa_referencia) & (taxa_referencia < b), taxa_referencia, (a + b) / 2)
+    if taxa_inicial is not None:
+        x = np.where((a < taxa_inicial) & (taxa_inicial < b), taxa_inicial, x)
+    passo_anterior = b - a
+    
+    # Newton protegido pelo intervalo, sincronizado entre as linhas ativas
+    ativos = isolamento['com_intervalo'].copy()
+    for iteracao in range(1, max_iter + 1):
+        linhas = np.flatnonzero(ativos)
+        if len(linhas) == 0:
+            break
+        
+        xl = x[linhas]
+        fx, dfx = avaliar(linhas, xl)
+        iteracoes[linhas] = iteracao
+        
+        ok = np.abs(fx) < tol_vpv
+        taxa[linhas[ok]] = xl[ok]
+        convergiu[linhas[ok]] = True
+        motivo[linhas[ok]] = 'Newton: |VPV| < tolerância'
+        
+        # Atualizar o intervalo mantendo a troca de sinal
+        mesmo_sinal = np.sign(fx) == np.sign(fa[linhas])
+        a[linhas] = np.where(mesmo_sinal, xl, a[linhas])
+        fa[linhas] = np.where(mesmo_sinal, fx, fa[linhas])
+        b[linhas] = np.where(mesmo_sinal, b[linhas], xl)
+        
+        estreito = ~ok & (b[linhas] - a[linhas] <= xtol * np.maximum(1.0, np.abs(xl)))
+        taxa[linhas[estreito]] = xl[estreito]
+        convergiu[linhas[estreito]] = True
+        motivo[linhas[estreito]] = 'Intervalo menor que a tolerância'
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_newton = xl - fx / dfx
+        aceita = (np.isfinite(x_newton) & (a[linhas] < x_newton) & (x_newton < b[linhas])
+                  & (np.abs(x_newton - xl) < 0.5 * np.abs(passo_anterior[linhas])))
+        meio = (b[linhas] - a[linhas]) / 2
+        passo_anterior[linhas] = np.where(aceita, x_newton - xl, meio)
+        x[linhas] = np.where(aceita, x_newton, a[linhas] + meio)
+        
+        ativos[linhas[ok | estreito]] = False
+    
+    # Recurso final: bisseção no intervalo atual das linhas restantes
+    for iteracao in range(1, max_iter_bissecao + 1):
+        linhas = np.flatnonzero(ativos)
+        if len(linhas) == 0:
+            break
+        
+        meio = (a[linhas] + b[linhas]) / 2
+        fm, _ = avaliar(linhas, meio)
+        iteracoes[linhas] = max_iter + iteracao
+        
+        mesmo_sinal = np.sign(fm) == np.sign(fa[linhas])
+        a[linhas] = np.where(mesmo_sinal, meio, a[linhas])
+        fa[linhas] = np.where(mesmo_sinal, fm, fa[linhas])
+        b[linhas] = np.where(mesmo_sinal, b[linhas], meio)
+        
+        fim = (np.abs(fm) < tol_vpv) | (b[linhas] - a[linhas] <= xtol * np.maximum(1.0, np.abs(meio)))
+        taxa[linhas[fim]] = meio[fim]
+        convergiu[linhas[fim]] = True
+        motivo[linhas[fim]] = 'Bisseção após Newton sem convergência'
+        ativos[linhas[fim]] = False
+    
+    motivo[ativos] = 'Bisseção sem convergência'
+    
+    return {
+        'taxa_mensal': taxa,
+        'convergiu': convergiu,
+        'iteracoes': iteracoes,
+        'motivo': motivo.tolist()
+    }
+
+def formatar_resultado_cet(cet: float, convergiu: bool, motivo_erro: str) -> Dict:
+    """
+    Aplica as regras de validade do CET no formato de 'resultados' da simulação:
+    CET NaN ou negativo vira None e marca a simulação como não convergida.
+    """
+    # Se CET for negativo, também considerar como não convergido
+    if not np.isnan(cet) and cet < 0:
+        convergiu = False
+        if not motivo_erro:  # Só sobrescrever se não houver motivo anterior
+            motivo_erro = "CET negativo - resultado inválido"
+    
+    # Verificar se CET é válido (não NaN e não negativo)
+    cet_valido = not np.isnan(cet) and cet >= 0
+    
+    return {
+        'cet_anual': float(cet) if cet_valido else None,
+        'cet_mensal': float((1 + cet) ** (1/12) - 1) if cet_valido else None,
+        'convergiu': bool(convergiu),
+        'motivo_erro': motivo_erro
+    }
+
+def estatisticas_ponderadas(valores, pesos) -> Dict:
+    """
+    Média e percentis (10/50/90) de 'valores' ponderados por 'pesos', ignorando
+    valores NaN. 'massa' é o peso total considerado (ex.: probabilidade de CET válido).
+    """
+    valores = np.asarray(valores, dtype=float)
+    pesos = np.asarray(pesos, dtype=float)
+    validos = np.isfinite(valores) & (pesos > 0)
+    massa = float(pesos[validos].sum())
+    
+    if massa <= 0:
+        return {'media': None, 'p10': None, 'mediana': None, 'p90': None, 'massa': 0.0}
+    
+    ordem = np.argsort(valores[validos])
+    valores_ordenados = valores[validos][ordem]
+    acumulada = np.cumsum(pesos[validos][ordem]) / massa
+    indices = np.minimum(np.searchsorted(acumulada, [0.10, 0.50, 0.90]), len(acumulada) - 1)
+    p10, mediana, p90 = valores_ordenados[indices].tolist()
+    
+    return {
+        'media': float(np.dot(valores[validos], pesos[validos]) / massa),
+        'p10': p10,
+        'mediana': mediana,
+        'p90': p90,
+        'massa': massa
+    }
+
+def calcular_cet_lote(fluxos) -> List[Dict]:
+    """
+    Calcula o CET de vários cenários de uma vez (ver resolver_tir_lote).
+    
+    Args:
+        fluxos: Matriz cenários × meses ou lista de listas de fluxos (prazos
+            diferentes são completados com zeros)
+    
+    Returns:
+        Uma entrada por cenário no mesmo formato de 'resultados' de
+        simular_cenario_completo (cet_anual, cet_mensal, convergiu, motivo_erro,
+        iteracoes_cet, motivo_convergencia)
+    """
+    if not isinstance(fluxos, np.ndarray):
+        tamanho = max((len(f) for f in fluxos), default=0)
+        matriz = np.zeros((len(fluxos), tamanho))
+        for i, f in enumerate(fluxos):
+            matriz[i, :len(f)] = f
+        fluxos = matriz
+    fluxos = np.atleast_2d(np.asarray(fluxos, dtype=float))
+    
+    resultados = [None] * len(fluxos)
+    
+    # Mesmas verificações prévias de calcular_cet
+    if fluxos.shape[1] < 2:
+        for i in range(len(fluxos)):
+            resultados[i] = {**formatar_resultado_cet(np.nan, False, "Fluxos insuficientes"),
+                             'iteracoes_cet': 0, 'motivo_convergencia': ""}
+        return resultados
+    
+    com_mudanca_sinal = (fluxos > 0).any(axis=1) & (fluxos < 0).any(axis=1)
+    linhas = np.flatnonzero(com_mudanca_sinal)
+    solucao = resolver_tir_lote(fluxos[linhas])
+    
+    for i in np.flatnonzero(~com_mudanca_sinal):
+        resultados[i] = {**formatar_resultado_cet(np.nan, False, "Sem mudança de sinal nos fluxos"),
+                         'iteracoes_cet': 0, 'motivo_convergencia': ""}
+    
+    for k, i in enumerate(linhas):
+        convergiu = bool(solucao['convergiu'][k])
+        cet = (1 + solucao['taxa_mensal'][k]) ** 12 - 1 if convergiu else np.nan
+        resultados[i] = {
+            **formatar_resultado_cet(cet, convergiu, "" if convergiu else "Convergência não alcançada"),
+            'iteracoes_cet': int(solucao['iteracoes'][k]),
+            'motivo_convergencia': solucao['motivo'][k]
+        }
+    
+    return resultados
+
+class IndiceRaizesCET:
+    """
+    Índice em memória das raízes de CET resolvidas recentemente. calcular_cet
+    usa a solução de parâmetros mais próximos como ponto de partida do Newton;
+    com os mesmos parâmetros (a menos do valor da carta) a raiz é a mesma e a
+    grade de isolamento é dispensada (ver intervalo_em_torno).
+    
+    A chave é o vetor normalizado dos parâmetros (ver vetor_parametros). A busca
+    é por força bruta numa matriz de no máximo 'capacidade' linhas; quando cheia,
+    a entrada mais antiga é substituída (ordem circular). Simulações rodam em
+    threads (ver obter_resultado_simulacao), então buscar/registrar/estatisticas
+    usam uma trava.
+    
+    A semente é só uma otimização interna: as iterações gastas dependem do que o
+    processo já resolveu e por isso não aparecem na resposta de /simular (só nas
+    estatísticas deste índice); o CET em si é o mesmo com ou sem semente.
+    """
+    
+    def __init__(self, capacidade: int = 4096, distancia_maxima: float = 1.0):
+        self.trava = threading.Lock()
+        self.capacidade = capacidade
+        self.distancia_maxima = distancia_maxima
+        self.vetores = np.full((capacidade, 5), np.inf)
+        self.taxas = np.full(capacidade, np.nan)
+        self.chaves = [None] * capacidade
+        self.linhas = {}  # chave -> linha da matriz
+        self.proxima_linha = 0
+        
+        # Estatísticas
+        self.consultas = 0
+        self.acertos = 0
+        self.acertos_exatos = 0
+        self.solucoes_com_semente = 0
+        self.iteracoes_com_semente = 0
+        self.solucoes_sem_semente = 0
+        self.iteracoes_sem_semente = 0
+    
+    @staticmethod
+    def vetor_parametros(parametros: ParametrosConsorcio) -> np.ndarray:
+        """
+        Parâmetros normalizados (1 ano de prazo ou de contemplação ~ 10 p.p. de taxa).
+        O valor da carta fica de fora: todos os fluxos são proporcionais a ele,
+        então o CET não depende dele.
+        """
+        return np.array([
+            parametros.prazo_meses / 12,
+            parametros.mes_contemplacao / 12,
+            (parametros.taxa_admin + parametros.fundo_reserva) * 10,
+            parametros.lance_livre_perc * 10,
+            parametros.taxa_reajuste_anual * 10
+        ], dtype=float)
+    
+    def buscar(self, parametros: ParametrosConsorcio) -> Optional[Dict]:
+        """
+        Solução mais próxima: dict com 'taxa_mensal' e 'distancia' (0 = mesmos
+        parâmetros a menos do valor da carta), ou None se não houver nenhuma a
+        até 'distancia_maxima'.
+        """
+        with self.trava:
+            self.consultas += 1
+            if not self.linhas:
+                return None
+            
+            distancias = np.linalg.norm(self.vetores - self.vetor_parametros(parametros), axis=1)
+            linha = int(np.argmin(distancias))
+            if distancias[linha] > self.distancia_maxima:
+                return None
+            
+            self.acertos += 1
+            if distancias[linha] == 0:
+                self.acertos_exatos += 1
+            return {'taxa_mensal': float(self.taxas[linha]), 'distancia': float(distancias[linha])}
+    
+    def registrar(self, parametros: ParametrosConsorcio, solucao: Dict, com_semente: bool):
+        """Guarda a raiz e contabiliza as iterações gastas pelo solver (só soluções convergidas)."""
+        with self.trava:
+            if not solucao['convergiu'] or not np.isfinite(solucao['taxa_mensal']):
+                return
+            
+            if com_semente:
+                self.solucoes_com_semente += 1
+                self.iteracoes_com_semente += solucao['iteracoes']
+            else:
+                self.solucoes_sem_semente += 1
+                self.iteracoes_sem_semente += solucao['iteracoes']
+            
+            vetor = self.vetor_parametros(parametros)
+            chave = tuple(vetor)
+            linha = self.linhas.get(chave)
+            if linha is None:
+                linha = self.proxima_linha
+                self.proxima_linha = (linha + 1) % self.capacidade
+                if self.chaves[linha] is not None:
+                    del self.linhas[self.chaves[linha]]
+                self.chaves[linha] = chave
+                self.linhas[chave] = linha
+                self.vetores[linha] = vetor
+            
+            self.taxas[linha] = solucao['taxa_mensal']
+    
+    def estatisticas(self) -> Dict:
+        with self.trava:
+            media_com = self.iteracoes_com_semente / self.solucoes_com_semente if self.solucoes_com_semente else None
+            media_sem = self.iteracoes_sem_semente / self.solucoes_sem_semente if self.solucoes_sem_semente else None
+            
+            return {
+                'tamanho': len(self.linhas),
+                'capacidade': self.capacidade,
+                'consultas': self.consultas,
+                'acertos': self.acertos,
+                'acertos_exatos': self.acertos_exatos,  # Também dispensam a grade de isolamento
+                'taxa_acerto': self.acertos / self.consultas if self.consultas else 0.0,
+                'media_iteracoes_com_semente': media_com,
+                'media_iteracoes_sem_semente': media_sem,
+                # Estimativa: soluções semeadas × diferença das médias
+                'iteracoes_economizadas': (media_sem - media_com) * self.solucoes_com_semente
+                                          if media_com is not None and media_sem is not None else 0.0
+            }
+
+# Raízes de CET recentes (em memória, por processo)
+INDICE_RAIZES_CET = IndiceRaizesCET()
+
 class SimuladorConsorcio:
     """Simulador de consórcio baseado na metodologia fornecida."""
     
@@ -172,166 +1058,180 @@ class SimuladorConsorcio:
         self.params = parametros
         self.convergiu = True
         self.motivo_erro = ""
+        self.iteracoes_cet = 0
+        self.motivo_convergencia = ""
     
     def calcular_base_lance(self) -> float:
         """Calcula base para lance: Crédito + Taxas + Fundo."""
         return self.params.valor_carta * (1 + self.params.taxa_admin + self.params.fundo_reserva)
     
-    def gerar_fluxos_lance_livre(self) -> Dict:
-        """Gera fluxos de caixa corretos - parcela só diminui com lance embutido."""
+    def gerar_blocos_anuais(self, incluir_contemplacao: bool = True) -> FluxoBlocosAnuais:
+        """
+        Descreve os fluxos do cenário em blocos anuais (para VPL/CET analíticos).
+        
+        Com incluir_contemplacao=False retorna só as parcelas (cronograma base,
+        comum a todos os meses de contemplação).
+        """
+        base_contrato = self.calcular_base_lance()
+        prazo = self.params.prazo_meses
+        mes_contemplacao = self.params.mes_contemplacao
+        
+        eventos = {}
+        if incluir_contemplacao and 1 <= mes_contemplacao <= prazo:
+            # Na contemplação recebe a carta corrigida e paga o lance livre (além da parcela)
+            ano_contemplacao = (mes_contemplacao - 1) // 12 + 1
+            valor_carta_contemplacao = self.params.valor_carta * (1 + self.params.taxa_reajuste_anual) ** (ano_contemplacao - 1)
+            eventos[mes_contemplacao] = valor_carta_contemplacao - base_contrato * self.params.lance_livre_perc
+        
+        return FluxoBlocosAnuais(
+            parcela_base=base_contrato / prazo,
+            taxa_reajuste_anual=self.params.taxa_reajuste_anual,
+            prazo_meses=prazo,
+            eventos=eventos
+        )
+    
+    def gerar_cronograma(self) -> Dict:
+        """
+        Gera o cronograma mensal em colunas NumPy (sem loop mês a mês).
+        
+        Returns:
+            dict com 'cronograma' (CronogramaConsorcio ou None em caso de erro) e 'resumo'
+        """
         try:
             # Base de cálculo
             base_contrato = self.calcular_base_lance()
             valor_lance_livre = base_contrato * self.params.lance_livre_perc
             
-            # Cálculos do resumo da operação
-            valor_credito_taxas = base_contrato  # R$ 124.000,00
-            taxas = self.params.valor_carta * (self.params.taxa_admin + self.params.fundo_reserva)  # R$ 24.000,00
-            lance_embutido = base_contrato * 0.08  # Aproximadamente 8% (baseado no documento)
-            credito_liquido = self.params.valor_carta - (taxas + valor_lance_livre + lance_embutido - base_contrato)
-            
             # Parcela base mensal - SEMPRE A MESMA (não diminui com lance livre)
             parcela_base_mensal = base_contrato / self.params.prazo_meses
             
-            fluxos = [0]  # t=0
-            detalhamento = []
-            primeira_parcela = 0
-            primeira_parcela_pos_contemplacao = 0
-            parcela_intermediaria = 0
-            ultima_parcela = 0
-            
-            # CORREÇÃO: Saldo devedor inicial = valor da carta + taxas (lógica correta)
-            saldo_devedor_inicial = base_contrato  # R$ 100.000 + 24% = R$ 124.000
-            saldo_devedor_atual = saldo_devedor_inicial
-            
-            # Taxa de correção mensal baseada na taxa anual
-            taxa_correcao_mensal = (1 + self.params.taxa_reajuste_anual) ** (1/12) - 1
-            
-            # Meses em português
-            meses_pt = ['', 'jan', 'fev', 'mar', 'abr', 'mai', 'jun', 
-                       'jul', 'ago', 'set', 'out', 'nov', 'dez']
+            prazo = self.params.prazo_meses
+            mes_contemplacao = self.params.mes_contemplacao
             
-            # Meses em português
-            meses_pt = ['', 'jan', 'fev', 'mar', 'abr', 'mai', 'jun', 
-                       'jul', 'ago', 'set', 'out', 'nov', 'dez']
+            # 1. Ano de cada mês e fator de correção anual (uma potência por ano, não por mês)
+            meses = np.arange(1, prazo + 1)
+            anos = (meses - 1) // 12 + 1
+            num_anos = int(anos[-1]) if prazo > 0 else 0
+            fatores_ano = (1 + self.params.taxa_reajuste_anual) ** np.arange(num_anos, dtype=float)
+            fator_correcao = fatores_ano[anos - 1]
             
-            for mes in range(1, self.params.prazo_meses + 1):
-                # 1. Calcular ano atual e fator de correção
-                ano_atual = (mes - 1) // 12 + 1
-                fator_correcao = (1 + self.params.taxa_reajuste_anual) ** (ano_atual - 1)
-                
-                # 2. Corrigir o saldo devedor pela mesma lógica das parcelas (no início de cada ano)
-                if mes > 1 and ((mes - 1) % 12 == 0):  # Início de novo ano
-                    # Aplicar correção anual ao saldo devedor
-                    saldo_devedor_atual = saldo_devedor_atual * (1 + self.params.taxa_reajuste_anual)
-                
-                # Data formatada (set/25, out/25, etc.)
-                mes_calendario = ((mes - 1) % 12) + 1
-                ano_calendario = 2025 + (mes - 1) // 12
-                data_formatada = f"{meses_pt[mes_calendario]}/{str(ano_calendario)[2:]}"
-                
-                # Valores corrigidos
-                valor_carta_corrigido = self.params.valor_carta * fator_correcao
-                
-                # Parcela corrigida pela correção anual
-                parcela_corrigida = parcela_base_mensal * fator_correcao
-                
-                if mes == self.params.mes_contemplacao:
-                    # CONTEMPLAÇÃO: Recebe carta, paga parcela e lance livre
-                    fluxo = valor_carta_corrigido - parcela_corrigida - valor_lance_livre
-                    lance_mes = valor_lance_livre
-                    primeira_parcela = parcela_corrigida
-                else:
-                    # DEMAIS MESES: Só paga parcela (valor sempre igual)
-                    fluxo = -parcela_corrigida
-                    lance_mes = 0
-                    
-                    # Guardar primeira parcela pós-contemplação (igual à anterior)
-                    if mes == self.params.mes_contemplacao + 1:
-                        primeira_parcela_pos_contemplacao = parcela_corrigida
-                
-                # 3. DEPOIS: Subtrair a parcela do saldo devedor
-                saldo_devedor_atual -= parcela_corrigida
-                
-                # Garantir que saldo não fique negativo (por questões de arredondamento)
-                saldo_devedor_atual = max(0, saldo_devedor_atual)
-                
-                # Guardar parcela intermediária (meio do prazo)
-                if mes == self.params.prazo_meses // 2:
-                    parcela_intermediaria = parcela_corrigida
-                    
-                # Última parcela
-                if mes == self.params.prazo_meses:
-                    ultima_parcela = parcela_corrigida
-                
-                fluxos.append(fluxo)
-                
-                detalhamento.append({
-                    'mes': mes,
-                    'data': data_formatada,
-                    'ano': ano_atual,
-                    'fator_correcao': fator_correcao,
-                    'valor_carta_corrigido': valor_carta_corrigido,
-                    'parcela_corrigida': parcela_corrigida,
-                    'parcela_antes': parcela_corrigida,  # Igual à parcela corrigida
-                    'parcela_depois': parcela_corrigida,  # Igual à parcela corrigida (consórcio não muda após contemplação)
-                    'lance_livre': lance_mes,
-                    'fluxo_liquido': fluxo,
-                    'saldo_devedor': max(0, saldo_devedor_atual),
-                    'eh_contemplacao': mes == self.params.mes_contemplacao
-                })
+            # 2. Valores corrigidos - parcela sempre igual dentro do ano
+            valor_carta_corrigido = self.params.valor_carta * fator_correcao
+            parcela_corrigida = parcela_base_mensal * fator_correcao
             
-            # Calcular valor da carta na contemplação
-            mes_contemplacao = self.params.mes_contemplacao
-            ano_contemplacao = (mes_contemplacao - 1) // 12 + 1
-            fator_correcao_contemplacao = (1 + self.params.taxa_reajuste_anual) ** (ano_contemplacao - 1)
-            valor_carta_contemplacao = self.params.valor_carta * fator_correcao_contemplacao
+            # 3. Fluxos: só paga parcela, exceto na contemplação (recebe carta, paga parcela e lance livre)
+            eh_contemplacao = meses == mes_contemplacao
+            lance_livre = np.where(eh_contemplacao, valor_lance_livre, 0.0)
+            fluxo_liquido = np.where(
+                eh_contemplacao,
+                valor_carta_corrigido - parcela_corrigida - valor_lance_livre,
+                -parcela_corrigida
+            )
             
-            # Se não temos parcela pós-contemplação, é igual à primeira
-            if primeira_parcela_pos_contemplacao == 0:
-                primeira_parcela_pos_contemplacao = primeira_parcela
+            # 4. Saldo devedor: inicial = carta + taxas, corrigido no início de cada ano e abatido
+            # pela parcela do mês. Em forma fechada: (base - mes × parcela_base) × fator do ano.
+            # O resíduo de ponto flutuante do último mês (~1e-11) zera no arredondamento para centavos.
+            saldo_devedor = (base_contrato - meses * parcela_base_mensal) * fator_correcao
             
-            # Se não temos parcela intermediária definida, usar uma estimativa
-            if parcela_intermediaria == 0:
-                parcela_intermediaria = parcela_base_mensal * (1 + self.params.taxa_reajuste_anual) ** 4
+            cronograma = CronogramaConsorcio(
+                ano=anos,
+                fator_correcao=fator_correcao,
+                valor_carta_corrigido=valor_carta_corrigido,
+                parcela_corrigida=parcela_corrigida,
+                lance_livre=lance_livre,
+                fluxo_liquido=fluxo_liquido,
+                saldo_devedor=saldo_devedor,
+                mes_contemplacao=mes_contemplacao
+            )
             
             return {
-                'fluxos': fluxos,
-                'detalhamento': detalhamento,
-                'resumo': {
-                    'base_contrato': base_contrato,
-                    'valor_lance_livre': valor_lance_livre,
-                    'valor_carta_contemplacao': valor_carta_contemplacao,
-                    'total_parcelas': sum(d['parcela_corrigida'] for d in detalhamento if not d['eh_contemplacao']),
-                    'fluxo_contemplacao': fluxos[self.params.mes_contemplacao],
-                    'primeira_parcela': primeira_parcela,
-                    'primeira_parcela_pos_contemplacao': primeira_parcela_pos_contemplacao,
-                    'parcela_intermediaria': parcela_intermediaria,
-                    'ultima_parcela': ultima_parcela,
-                    # Resumo da Operação
-                    'valor_credito_taxas': valor_credito_taxas,
-                    'taxas': taxas,
-                    'lance_embutido': lance_embutido,
-                    'credito_liquido': credito_liquido
-                }
+                'cronograma': cronograma,
+                'resumo': self.montar_resumo_cronograma(cronograma)
             }
             
         except Exception as e:
             logger.error(f"Erro na geração de fluxos: {e}")
-            return {'fluxos': [], 'detalhamento': [], 'resumo': {}}
-            
-        except Exception as e:
-            logger.error(f"Erro na geração de fluxos: {e}")
-            return {'fluxos': [], 'detalhamento': [], 'resumo': {}}
+            return {'cronograma': None, 'resumo': {}}
     
-    def calcular_vpl(self, fluxos: List[float], taxa_desconto: float = 0.10) -> float:
-        """
-        Calcula VPL (Valor Presente Líquido) como método alternativo quando CET não converge.
+    def montar_resumo_cronograma(self, cronograma: CronogramaConsorcio) -> Dict:
+        """Resumo financeiro do cronograma (parcelas de referência, contemplação e resumo da operação)."""
+        # Base de cálculo
+        base_contrato = self.calcular_base_lance()
+        valor_lance_livre = base_contrato * self.params.lance_livre_perc
+        
+        # Cálculos do resumo da operação
+        valor_credito_taxas = base_contrato  # R$ 124.000,00
+        taxas = self.params.valor_carta * (self.params.taxa_admin + self.params.fundo_reserva)  # R$ 24.000,00
+        lance_embutido = base_contrato * 0.08  # Aproximadamente 8% (baseado no documento)
+        credito_liquido = self.params.valor_carta - (taxas + valor_lance_livre + lance_embutido - base_contrato)
+        
+        parcela_base_mensal = base_contrato / self.params.prazo_meses
+        parcela_corrigida = cronograma.parcela_corrigida
+        prazo = cronograma.prazo
+        mes_contemplacao = cronograma.mes_contemplacao
+        eh_contemplacao = np.arange(1, prazo + 1) == mes_contemplacao
+        
+        # Parcelas de referência
+        primeira_parcela = float(parcela_corrigida[mes_contemplacao - 1]) if 1 <= mes_contemplacao <= prazo else 0
+        primeira_parcela_pos_contemplacao = float(parcela_corrigida[mes_contemplacao]) if 0 <= mes_contemplacao < prazo else 0
+        parcela_intermediaria = float(parcela_corrigida[prazo // 2 - 1]) if prazo // 2 >= 1 else 0
+        ultima_parcela = float(parcela_corrigida[-1]) if prazo > 0 else 0
+        
+        # Calcular valor da carta na contemplação
+        ano_contemplacao = (mes_contemplacao - 1) // 12 + 1
+        fator_correcao_contemplacao = (1 + self.params.taxa_reajuste_anual) ** (ano_contemplacao - 1)
+        valor_carta_contemplacao = self.params.valor_carta * fator_correcao_contemplacao
+        
+        # Se não temos parcela pós-contemplação, é igual à primeira
+        if primeira_parcela_pos_contemplacao == 0:
+            primeira_parcela_pos_contemplacao = primeira_parcela
+        
+        # Se não temos parcela intermediária definida, usar uma estimativa
+        if parcela_intermediaria == 0:
+            parcela_intermediaria = parcela_base_mensal * (1 + self.params.taxa_reajuste_anual) ** 4
         
-        Args:
-            fluxos: Lista de fluxos de caixa
-            taxa_desconto: Taxa de desconto anual (default: 10%)
-            
+        return {
+            'base_contrato': base_contrato,
+            'valor_lance_livre': valor_lance_livre,
+            'valor_carta_contemplacao': valor_carta_contemplacao,
+            'total_parcelas': int(para_centavos(parcela_corrigida)[~eh_contemplacao].sum()) / 100,
+            'fluxo_contemplacao': float(cronograma.fluxos()[mes_contemplacao]),
+            'primeira_parcela': primeira_parcela,
+            'primeira_parcela_pos_contemplacao': primeira_parcela_pos_contemplacao,
+            'parcela_intermediaria': parcela_intermediaria,
+            'ultima_parcela': ultima_parcela,
+            # Resumo da Operação
+            'valor_credito_taxas': valor_credito_taxas,
+            'taxas': taxas,
+            'lance_embutido': lance_embutido,
+            'credito_liquido': credito_liquido
+        }
+    
+    def gerar_fluxos_lance_livre(self) -> Dict:
+        """Gera fluxos de caixa corretos - parcela só diminui com lance embutido."""
+        resultado = self.gerar_cronograma()
+        cronograma = resultado['cronograma']
+        
+        if cronograma is None:
+            return {'fluxos': [], 'detalhamento': [], 'resumo': {}}
+        
+        return {
+            'fluxos': cronograma.fluxos().tolist(),
+            'detalhamento': cronograma.detalhamento(),
+            'resumo': resultado['resumo']
+        }
+    
+    def calcular_vpl(self, fluxos: List[float], taxa_desconto: float = 0.10,
+                     blocos: Optional[FluxoBlocosAnuais] = None) -> float:
+        """
+        Calcula VPL (Valor Presente Líquido) como método alternativo quando CET não converge.
+        
+        Args:
+            fluxos: Lista de fluxos de caixa
+            taxa_desconto: Taxa de desconto anual (default: 10%)
+            blocos: Mesmos fluxos em blocos anuais; se fornecido, o VPL é
+                avaliado analiticamente em O(anos)
+            
         Returns:
             VPL dos fluxos de caixa
         """
@@ -343,7 +1243,10 @@ class SimuladorConsorcio:
             taxa_mensal = (1 + taxa_desconto) ** (1/12) - 1
             
             # Calcular VPL
-            vpl = sum(cf / (1 + taxa_mensal) ** i for i, cf in enumerate(fluxos))
+            if blocos is not None and taxa_mensal > -1:
+                vpl = blocos.vpv(taxa_mensal)
+            else:
+                vpl = sum(cf / (1 + taxa_mensal) ** i for i, cf in enumerate(fluxos))
             
             return vpl
             
@@ -351,11 +1254,16 @@ class SimuladorConsorcio:
             logger.error(f"Erro no cálculo do VPL: {e}")
             return np.nan
     
-    def calcular_cet(self, fluxos: List[float]) -> float:
-        """Calcula CET com método robusto."""
-        def vpv(taxa_mensal):
-            return sum(cf / (1 + taxa_mensal) ** i for i, cf in enumerate(fluxos))
+    def calcular_cet(self, fluxos: List[float], blocos: Optional[FluxoBlocosAnuais] = None,
+                     taxa_inicial: Optional[float] = None) -> float:
+        """
+        Calcula CET com método robusto (raiz isolada + Newton protegido, ver resolver_tir).
         
+        Se 'blocos' for fornecido, cada avaliação do VPL e da derivada usa a forma
+        fechada por ano (O(anos)) em vez da soma mês a mês. 'taxa_inicial' (taxa
+        mensal de uma simulação vizinha) é o ponto de partida do Newton; sem ela,
+        usa a raiz de parâmetros mais próximos em INDICE_RAIZES_CET.
+        """
         if len(fluxos) < 2:
             self.convergiu = False
             self.motivo_erro = "Fluxos insuficientes"
@@ -369,239 +1277,1778 @@ class SimuladorConsorcio:
             return np.nan
         
         try:
-            tentativas = [0.005, 0.01, 0.015, 0.02, 0.001, 0.03, -0.001, 0.0001]
+            if blocos is not None:
+                vpv, derivada = blocos.vpv, blocos.derivada
+            else:
+                vpv, derivada = funcoes_vpv(fluxos)
             
-            for taxa_inicial in tentativas:
-                try:
-                    taxa_mensal = fsolve(vpv, taxa_inicial, xtol=1e-12, maxfev=2000)[0]
-                    
-                    if abs(vpv(taxa_mensal)) < 1e-6:
-                        taxa_anual = (1 + taxa_mensal) ** 12 - 1
-                        
-                        if -0.99 <= taxa_anual <= 5.0:
-                            self.convergiu = True
-                            return taxa_anual
-                
-                except (ValueError, RuntimeWarning):
-                    continue
+            intervalo = None
+            if taxa_inicial is None:
+                vizinha = INDICE_RAIZES_CET.buscar(self.params)
+                if vizinha is not None:
+                    taxa_inicial = vizinha['taxa_mensal']
+                    if vizinha['distancia'] == 0:
+                        intervalo = intervalo_em_torno(vpv, taxa_inicial)
             
-            self.convergiu = False
-            self.motivo_erro = "Convergência não alcançada"
-            return np.nan
+            solucao = resolver_tir(vpv, derivada, intervalo=intervalo, taxa_inicial=taxa_inicial)
+            INDICE_RAIZES_CET.registrar(self.params, solucao, com_semente=taxa_inicial is not None)
+            self.iteracoes_cet = solucao['iteracoes']
+            self.motivo_convergencia = solucao['motivo']
+            
+            if not solucao['convergiu']:
+                self.convergiu = False
+                self.motivo_erro = "Convergência não alcançada"
+                return np.nan
+            
+            self.convergiu = True
+            return (1 + solucao['taxa_mensal']) ** 12 - 1
             
         except Exception as e:
             self.convergiu = False
             self.motivo_erro = f"Erro matemático: {str(e)[:50]}"
             return np.nan
     
-    def simular_cenario_completo(self) -> Dict:
-        """Simulação completa do cenário atual."""
-        resultado_fluxos = self.gerar_fluxos_lance_livre()
+    def atualizar_contemplacao(self, cronograma: CronogramaConsorcio) -> List[int]:
+        """
+        Ajusta, no próprio cronograma, o mês de contemplação e o lance livre aos
+        parâmetros atuais alterando só os meses afetados (antigo e novo mês de
+        contemplação). Só é válido se os demais parâmetros não mudaram.
         
-        if not resultado_fluxos['fluxos']:
-            return {
-                'erro': True,
-                'mensagem': 'Erro na geração de fluxos'
-            }
+        Returns:
+            Lista dos meses alterados
+        """
+        mes_contemplacao = self.params.mes_contemplacao
+        valor_lance_livre = self.calcular_base_lance() * self.params.lance_livre_perc
+        meses_alterados = sorted({cronograma.mes_contemplacao, mes_contemplacao} & set(range(1, cronograma.prazo + 1)))
+        
+        for mes in meses_alterados:
+            i = mes - 1
+            if mes == mes_contemplacao:
+                cronograma.lance_livre[i] = valor_lance_livre
+                cronograma.fluxo_liquido[i] = cronograma.valor_carta_corrigido[i] - cronograma.parcela_corrigida[i] - valor_lance_livre
+            else:
+                cronograma.lance_livre[i] = 0.0
+                cronograma.fluxo_liquido[i] = -cronograma.parcela_corrigida[i]
         
-        # Tentar calcular CET primeiro
-        cet = self.calcular_cet(resultado_fluxos['fluxos'])
+        cronograma.mes_contemplacao = mes_contemplacao
+        cronograma.invalidar_centavos()
+        return meses_alterados
+    
+    def calcular_resultados(self, fluxos: List[float], taxa_inicial: Optional[float] = None) -> tuple:
+        """CET (formatado, ver formatar_resultado_cet) e VPL dos fluxos do cenário atual."""
+        blocos = self.gerar_blocos_anuais()
         
-        # Verificar se CET é válido (não NaN e não negativo)
-        cet_valido = not np.isnan(cet) and cet >= 0
+        # Tentar calcular CET primeiro
+        cet = self.calcular_cet(fluxos, blocos, taxa_inicial)
         
-        # Se CET for negativo, também considerar como não convergido
-        if not np.isnan(cet) and cet < 0:
-            self.convergiu = False
-            if not self.motivo_erro:  # Só sobrescrever se não houver motivo anterior
-                self.motivo_erro = "CET negativo - resultado inválido"
+        # CET NaN ou negativo não é válido - nesse caso vale o VPL
+        resultado_cet = formatar_resultado_cet(cet, self.convergiu, self.motivo_erro)
+        self.convergiu = resultado_cet['convergiu']
+        self.motivo_erro = resultado_cet['motivo_erro']
         
         # Calcular VPL sempre (como alternativa ao CET)
-        taxa_desconto = 0.10  # 10% para teste, conforme solicitado
-        vpl = self.calcular_vpl(resultado_fluxos['fluxos'], taxa_desconto)
+        vpl = self.calcular_vpl(fluxos, TAXA_DESCONTO_VPL, blocos)
         
-        # Convert values for JSON serialization - usar VPL quando CET não for válido
-        if cet_valido:
-            cet_anual_json = float(cet)
-            cet_mensal_json = float((1 + cet) ** (1/12) - 1)
-        else:
-            cet_anual_json = None
-            cet_mensal_json = None
-            
+        return resultado_cet, vpl
+    
+    def simular_cenario_completo(self, incluir_detalhamento: bool = True) -> Dict:
+        """
+        Simulação completa do cenário atual.
+        
+        Args:
+            incluir_detalhamento: Se False, não monta as linhas do detalhamento
+                (o cronograma em colunas continua disponível em 'cronograma')
+        """
+        resultado_cronograma = self.gerar_cronograma()
+        cronograma = resultado_cronograma['cronograma']
+        
+        if cronograma is None:
+            return {
+                'erro': True,
+                'mensagem': 'Erro na geração de fluxos'
+            }
+        
+        fluxos = cronograma.fluxos().tolist()
+        resultado_cet, vpl = self.calcular_resultados(fluxos)
+        
+        return self.montar_resultado(resultado_cronograma, fluxos, resultado_cet, vpl, incluir_detalhamento)
+    
+    def montar_resultado(self, resultado_cronograma: Dict, fluxos: List[float], resultado_cet: Dict,
+                         vpl: float, incluir_detalhamento: bool = True) -> Dict:
+        """Monta o dicionário de resultado da simulação (formato de simular_cenario_completo)."""
+        cronograma = resultado_cronograma['cronograma']
         vpl_json = None if np.isnan(vpl) else float(vpl)
         
         return {
             'erro': False,
             'parametros': self.params.dict(),
             'resultados': {
-                'cet_anual': cet_anual_json,
-                'cet_mensal': cet_mensal_json,
+                'cet_anual': resultado_cet['cet_anual'],
+                'cet_mensal': resultado_cet['cet_mensal'],
                 'vpl': vpl_json,
-                'taxa_desconto_vpl': taxa_desconto,
-                'convergiu': self.convergiu,
-                'motivo_erro': self.motivo_erro
+                'taxa_desconto_vpl': TAXA_DESCONTO_VPL,
+                'convergiu': resultado_cet['convergiu'],
+                'motivo_erro': resultado_cet['motivo_erro']
+            },
+            'fluxos': fluxos,
+            'detalhamento': cronograma.detalhamento() if incluir_detalhamento else [],
+            'cronograma': cronograma,
+            'resumo_financeiro': resultado_cronograma['resumo']
+        }
+    
+    def _preparar_varredura(self) -> Optional[Dict]:
+        """
+        Dados comuns a todos os meses de contemplação: cronograma base em blocos
+        anuais, evento da contemplação em cada mês, VPLs e raízes isoladas.
+        
+        Entre meses de contemplação só muda a posição do evento (carta menos lance)
+        no vetor de fluxos, então o VPV de cada mês é o VPV do cronograma base
+        (calculado uma vez) mais o valor presente desse evento.
+        """
+        resultado_cronograma = self.gerar_cronograma()
+        cronograma = resultado_cronograma['cronograma']
+        if cronograma is None:
+            return None
+        
+        base = self.gerar_blocos_anuais(incluir_contemplacao=False)
+        meses = np.arange(1, cronograma.prazo + 1, dtype=float)
+        taxa_mensal_vpl = (1 + TAXA_DESCONTO_VPL) ** (1/12) - 1
+        grade = _grade_tir(TAXA_MENSAL_MIN, TAXA_MENSAL_MAX, 0.005, 64)
+        
+        # Partes que não dependem do lance: VPV do cronograma base e fatores de desconto por mês
+        comum = {
+            'cronograma': cronograma,
+            'base': base,
+            'meses': meses,
+            'grade': grade,
+            'vpv_base_grade': base.vpv(grade),
+            'desconto_grade': np.exp(-np.outer(meses, np.log1p(grade))),
+            'vpv_base_vpl': base.vpv(taxa_mensal_vpl),
+            'desconto_vpl': (1 + taxa_mensal_vpl) ** -meses
+        }
+        return self._varredura_com_lance(comum, resultado_cronograma['resumo']['valor_lance_livre'])
+    
+    @staticmethod
+    def _varredura_com_lance(varredura: Dict, valor_lance_livre: float) -> Dict:
+        """
+        Completa a varredura para um valor de lance livre. O lance não muda as
+        parcelas, só o evento da contemplação, então os cenários sem/com lance de
+        calcular_cet_esperado partem do mesmo cronograma e da mesma grade.
+        """
+        cronograma, meses = varredura['cronograma'], varredura['meses']
+        
+        # Evento da contemplação em cada mês e o fluxo líquido resultante
+        eventos = cronograma.valor_carta_corrigido - valor_lance_livre
+        fluxos_contemplacao = eventos - cronograma.parcela_corrigida
+        
+        # VPL de todos os meses: base + evento descontado
+        vpls = varredura['vpv_base_vpl'] + eventos * varredura['desconto_vpl']
+        
+        # Isolamento das raízes de todos os meses de uma vez (grade × meses)
+        valores = varredura['vpv_base_grade'] + eventos[:, None] * varredura['desconto_grade']
+        
+        return {
+            **varredura,
+            'valor_lance_livre': valor_lance_livre,
+            'eventos': eventos,
+            'fluxos_contemplacao': fluxos_contemplacao,
+            'vpls': vpls,
+            'isolamento': _isolar_raizes(varredura['grade'], valores, 0.005)
+        }
+    
+    def varrer_meses_contemplacao(self) -> Dict:
+        """
+        Calcula CET, VPL e fluxo na contemplação para todos os meses 1..prazo.
+        
+        Reaproveita o cronograma base (ver _preparar_varredura); cada Newton parte
+        da raiz do mês vizinho.
+        
+        Returns:
+            dict com 'pontos' (um por mês, no formato de 'resultados') e 'iteracoes_cet' total
+        """
+        varredura = self._preparar_varredura()
+        if varredura is None:
+            return {'erro': True, 'mensagem': 'Erro na geração de fluxos'}
+        
+        base = varredura['base']
+        meses = varredura['meses']
+        eventos = varredura['eventos']
+        fluxos_contemplacao = varredura['fluxos_contemplacao']
+        vpls = varredura['vpls']
+        isolamento = varredura['isolamento']
+        
+        pontos = []
+        iteracoes_total = 0
+        raiz_vizinha = None
+        for i, mes in enumerate(meses):
+            iteracoes = 0
+            motivo_convergencia = ""
+            
+            if fluxos_contemplacao[i] <= 0:
+                # Só há parcelas negativas: mesma verificação de calcular_cet
+                cet, convergiu, motivo_erro = np.nan, False, "Sem mudança de sinal nos fluxos"
+            elif isolamento['exata'][i]:
+                taxa, convergiu, motivo_erro = isolamento['taxa_exata'][i], True, ""
+                cet = (1 + taxa) ** 12 - 1
+                motivo_convergencia = 'Raiz exata na grade'
+            elif not isolamento['com_intervalo'][i]:
+                cet, convergiu, motivo_erro = np.nan, False, "Convergência não alcançada"
+                motivo_convergencia = 'Sem mudança de sinal do VPV no intervalo de CET válido'
+            else:
+                evento, m = eventos[i], mes
+                solucao = resolver_tir(
+                    lambda r: base.vpv(r) + evento * (1 + r) ** -m,
+                    lambda r: base.derivada(r) - m * evento * (1 + r) ** -(m + 1),
+                    intervalo=(isolamento['a'][i], isolamento['b'][i], isolamento['fa'][i]),
+                    taxa_inicial=raiz_vizinha
+                )
+                iteracoes = solucao['iteracoes']
+                motivo_convergencia = solucao['motivo']
+                convergiu = solucao['convergiu']
+                motivo_erro = "" if convergiu else "Convergência não alcançada"
+                cet = (1 + solucao['taxa_mensal']) ** 12 - 1 if convergiu else np.nan
+                if convergiu:
+                    raiz_vizinha = solucao['taxa_mensal']
+            
+            iteracoes_total += iteracoes
+            pontos.append({
+                'mes_contemplacao': int(mes),
+                **formatar_resultado_cet(cet, convergiu, motivo_erro),
+                'vpl': float(vpls[i]) if np.isfinite(vpls[i]) else None,
+                'fluxo_contemplacao': float(fluxos_contemplacao[i]),
+                'iteracoes_cet': iteracoes,
+                'motivo_convergencia': motivo_convergencia
+            })
+        
+        return {
+            'erro': False,
+            'parametros': self.params.model_dump(),
+            'taxa_desconto_vpl': TAXA_DESCONTO_VPL,
+            'iteracoes_cet': iteracoes_total,
+            'pontos': pontos
+        }
+    
+    def calcular_cet_todos_meses(self, varreduras: Optional[List[Dict]] = None) -> Optional[List[Dict]]:
+        """
+        CET, VPL e total pago para cada mês de contemplação 1..prazo numa única
+        passada vetorizada (Newton sincronizado entre os meses, sem loop).
+        
+        Args:
+            varreduras: varreduras de um mesmo cronograma (_preparar_varredura e
+                _varredura_com_lance), resolvidas juntas num único Newton em lote;
+                None usa só a deste simulador
+        
+        Returns:
+            um dict de vetores por mês para cada varredura; 'cet_anual' é NaN onde o CET não é válido
+        """
+        if varreduras is None:
+            varredura = self._preparar_varredura()
+            if varredura is None:
+                return None
+            varreduras = [varredura]
+        
+        base = varreduras[0]['base']
+        meses = varreduras[0]['meses']
+        num_meses = len(meses)
+        
+        # Linhas = varreduras × meses; o cronograma base é o mesmo, só o evento muda
+        meses_lote = np.tile(meses, len(varreduras))
+        eventos = np.concatenate([varredura['eventos'] for varredura in varreduras])
+        isolamento = {
+            chave: np.concatenate([varredura['isolamento'][chave] for varredura in varreduras])
+            for chave in varreduras[0]['isolamento']
+        }
+        
+        def avaliar(linhas, taxas):
+            m, evento = meses_lote[linhas], eventos[linhas]
+            desconto = (1 + taxas) ** -m
+            fx = base.vpv(taxas) + evento * desconto
+            dfx = base.derivada(taxas) - m * evento * desconto / (1 + taxas)
+            return fx, dfx
+        
+        solucao = refinar_raizes_lote(avaliar, isolamento)
+        
+        # Total pago: todas as parcelas (inclusive a do mês de contemplação, que o resumo
+        # desconta da carta) mais o lance livre; nenhum dos dois depende do mês
+        total_parcelas = para_centavos(varreduras[0]['cronograma'].parcela_corrigida).sum()
+        
+        resultados = []
+        for k, varredura in enumerate(varreduras):
+            taxa_mensal = solucao['taxa_mensal'][k * num_meses:(k + 1) * num_meses]
+            convergiu = solucao['convergiu'][k * num_meses:(k + 1) * num_meses]
+            
+            # Mesmas regras de validade de calcular_cet/formatar_resultado_cet
+            valido = convergiu & (varredura['fluxos_contemplacao'] > 0)
+            cet_anual = np.where(valido, (1 + taxa_mensal) ** 12 - 1, np.nan)
+            cet_anual[cet_anual < 0] = np.nan
+            
+            total_pago = total_parcelas + para_centavos(varredura['valor_lance_livre'])
+            resultados.append({
+                'meses': meses.astype(int),
+                'cet_anual': cet_anual,
+                'vpl': varredura['vpls'],
+                'total_pago': np.full(num_meses, total_pago / 100),
+                'fluxo_contemplacao': varredura['fluxos_contemplacao']
+            })
+        
+        return resultados
+    
+    def calcular_cet_esperado(self) -> Optional[Dict]:
+        """
+        CET, VPL e total pago esperados, ponderados pela distribuição do mês de
+        contemplação f_t (curvas_from_hazard), nos cenários sem lance e com lance.
+        
+        Usa a mesma regra de grupo de /simular (participantes = 2 × prazo). No
+        cenário sem lance o cronograma não tem lance livre. Se o lance livre for
+        zero, só o cenário sem lance é retornado. Os dois cenários partem de uma
+        única varredura (ver _varredura_com_lance), pois só o evento da
+        contemplação muda, e seus CETs saem do mesmo Newton em lote.
+        """
+        prazo = self.params.prazo_meses
+        hazards = TABELAS_SOBREVIVENCIA.obter(prazo * 2, prazo)
+        
+        varredura = self._preparar_varredura()
+        if varredura is None:
+            return None
+        
+        # Varreduras e hazards de cada cenário; os CETs de todos saem de um único Newton em lote
+        cenarios = {'sem_lance': (self._varredura_com_lance(varredura, 0.0), hazards['h_sem'])}
+        if self.params.lance_livre_perc > 0:
+            cenarios['com_lance'] = (varredura, hazards['h_com'])
+        
+        cets_por_mes = self.calcular_cet_todos_meses([varredura_cenario for varredura_cenario, _ in cenarios.values()])
+        
+        resultado = {'sem_lance': None, 'com_lance': None}
+        for (nome, (_, h)), por_mes in zip(cenarios.items(), cets_por_mes):
+            curvas = curvas_from_hazard(h)
+            f = np.asarray(curvas['probabilidade_mes'])
+            estatisticas_cet = estatisticas_ponderadas(por_mes['cet_anual'], f)
+            
+            resultado[nome] = {
+                'cet_anual_esperado': estatisticas_cet['media'],
+                'cet_anual_p10': estatisticas_cet['p10'],
+                'cet_anual_mediana': estatisticas_cet['mediana'],
+                'cet_anual_p90': estatisticas_cet['p90'],
+                'prob_cet_valido': estatisticas_cet['massa'],
+                'vpl_esperado': float(np.dot(f, por_mes['vpl'])),
+                'total_pago_esperado': float(np.dot(f, por_mes['total_pago'])),
+                'mes_esperado': curvas['esperanca_meses']
+            }
+        
+        return resultado
+    
+    @staticmethod
+    def simular_lote(lista_parametros: List[ParametrosConsorcio], incluir_detalhamento: bool = True) -> List[Dict]:
+        """
+        Simula vários cenários numa única passada vetorizada.
+        
+        Os cronogramas de cada cenário já são gerados em colunas; CET e VPL de
+        todos os cenários são resolvidos juntos sobre a matriz cenários × meses
+        (calcular_cet_lote e um único produto para o VPL), em vez de N chamadas a
+        simular_cenario_completo.
+        
+        Returns:
+            Uma entrada por cenário, no formato de simular_cenario_completo
+        """
+        simuladores = [SimuladorConsorcio(parametros) for parametros in lista_parametros]
+        cronogramas = [simulador.gerar_cronograma() for simulador in simuladores]
+        
+        resultados = [{'erro': True, 'mensagem': 'Erro na geração de fluxos'}] * len(simuladores)
+        validos = [i for i, r in enumerate(cronogramas) if r['cronograma'] is not None]
+        if not validos:
+            return resultados
+        
+        # Matriz cenários × meses (prazos menores completados com zeros, que não alteram VPL/CET)
+        tamanho = max(cronogramas[i]['cronograma'].prazo for i in validos) + 1
+        matriz_fluxos = np.zeros((len(validos), tamanho))
+        for linha, i in enumerate(validos):
+            fluxos = cronogramas[i]['cronograma'].fluxos()
+            matriz_fluxos[linha, :len(fluxos)] = fluxos
+        
+        resultados_cet = calcular_cet_lote(matriz_fluxos)
+        
+        taxa_mensal = (1 + TAXA_DESCONTO_VPL) ** (1/12) - 1
+        vpls = matriz_fluxos @ (1 + taxa_mensal) ** -np.arange(tamanho, dtype=float)
+        
+        for linha, i in enumerate(validos):
+            fluxos = matriz_fluxos[linha, :cronogramas[i]['cronograma'].prazo + 1].tolist()
+            resultados[i] = simuladores[i].montar_resultado(
+                cronogramas[i], fluxos, resultados_cet[linha], float(vpls[linha]), incluir_detalhamento
+            )
+        
+        return resultados
+
+class SessaoSimulacao:
+    """
+    Última simulação de um cliente, para re-simulação incremental (ex.: controle
+    deslizante de mês de contemplação ou lance livre).
+    
+    Se só mudarem mes_contemplacao e/ou lance_livre_perc, atualizar() corrige
+    apenas os meses afetados do cronograma e do detalhamento e parte o Newton do
+    CET da raiz anterior. Qualquer outra mudança refaz a simulação completa.
+    """
+    
+    CAMPOS_INCREMENTAIS = {'mes_contemplacao', 'lance_livre_perc'}
+    
+    def __init__(self, parametros: ParametrosConsorcio, sessao_id: Optional[str] = None):
+        self.id = sessao_id or str(uuid.uuid4())
+        self.trava = asyncio.Lock()  # atualizar() roda em thread: uma atualização por vez
+        self.simular_completo(parametros)
+    
+    def simular_completo(self, parametros: ParametrosConsorcio) -> str:
+        self.atualizado_em = datetime.now(timezone.utc)
+        self.simulador = SimuladorConsorcio(parametros)
+        self.resultado = self.simulador.simular_cenario_completo()
+        self.detalhamento = [DetalhamentoMes(**item) for item in self.resultado.get('detalhamento', [])]
+        self.cet_esperado = None if self.resultado['erro'] else self.simulador.calcular_cet_esperado()
+        self.meses_alterados = list(range(1, parametros.prazo_meses + 1))
+        return 'completo'
+    
+    def atualizar(self, parametros: ParametrosConsorcio) -> str:
+        """Aplica os novos parâmetros à sessão. Retorna o modo usado: 'incremental' ou 'completo'."""
+        anterior = self.simulador.params
+        alterados = {campo for campo, valor in parametros.model_dump().items() if getattr(anterior, campo) != valor}
+        
+        if (self.resultado['erro'] or not alterados <= self.CAMPOS_INCREMENTAIS
+                or not 1 <= parametros.mes_contemplacao <= parametros.prazo_meses):
+            return self.simular_completo(parametros)
+        
+        self.atualizado_em = datetime.now(timezone.utc)
+        simulador = SimuladorConsorcio(parametros)
+        cronograma = self.resultado['cronograma']
+        self.meses_alterados = simulador.atualizar_contemplacao(cronograma)
+        
+        fluxos = self.resultado['fluxos']
+        for mes in self.meses_alterados:
+            fluxos[mes] = float(cronograma.fluxo_liquido[mes - 1])
+            self.detalhamento[mes - 1] = DetalhamentoMes(**cronograma.detalhamento(mes, mes)[0])
+        
+        # Newton do CET a partir da raiz da simulação anterior
+        resultado_cet, vpl = simulador.calcular_resultados(fluxos, self.resultado['resultados']['cet_mensal'])
+        resultado_cronograma = {'cronograma': cronograma, 'resumo': simulador.montar_resumo_cronograma(cronograma)}
+        self.resultado = simulador.montar_resultado(resultado_cronograma, fluxos, resultado_cet, vpl, incluir_detalhamento=False)
+        
+        # O CET esperado não depende do mês de contemplação escolhido
+        if alterados - {'mes_contemplacao'}:
+            self.cet_esperado = simulador.calcular_cet_esperado()
+        
+        self.simulador = simulador
+        return 'incremental'
+
+# Sessões de simulação incremental: o estado completo fica em memória, por processo; os
+# parâmetros da última simulação também vão para a coleção 'simulation_sessions' do Mongo,
+# para que outro worker reabra a sessão (com uma simulação completa) em vez de perdê-la
+SESSOES_SIMULACAO: Dict[str, SessaoSimulacao] = {}
+LIMITE_SESSOES_SIMULACAO = 1000
+VALIDADE_SESSAO_SIMULACAO = timedelta(minutes=30)
+
+def obter_sessao_simulacao(sessao_id: Optional[str]) -> Optional[SessaoSimulacao]:
+    """Retorna a sessão se existir e não estiver expirada."""
+    sessao = SESSOES_SIMULACAO.get(sessao_id) if sessao_id else None
+    if sessao and datetime.now(timezone.utc) - sessao.atualizado_em > VALIDADE_SESSAO_SIMULACAO:
+        del SESSOES_SIMULACAO[sessao_id]
+        return None
+    return sessao
+
+def registrar_sessao_simulacao(sessao: SessaoSimulacao):
+    """Guarda a sessão, descartando as expiradas e, acima do limite, as mais antigas."""
+    agora = datetime.now(timezone.utc)
+    for sessao_id in [i for i, s in SESSOES_SIMULACAO.items() if agora - s.atualizado_em > VALIDADE_SESSAO_SIMULACAO]:
+        del SESSOES_SIMULACAO[sessao_id]
+    
+    while len(SESSOES_SIMULACAO) >= LIMITE_SESSOES_SIMULACAO:
+        del SESSOES_SIMULACAO[min(SESSOES_SIMULACAO, key=lambda i: SESSOES_SIMULACAO[i].atualizado_em)]
+    
+    SESSOES_SIMULACAO[sessao.id] = sessao
+
+async def salvar_sessao_simulacao_mongo(sessao_id: str, parametros: ParametrosConsorcio, atualizado_em: datetime):
+    """Grava os parâmetros da sessão no Mongo (falhas só vão para o log)."""
+    try:
+        await db.simulation_sessions.replace_one({'_id': sessao_id}, {
+            '_id': sessao_id,
+            'parametros': parametros.model_dump(),
+            'atualizado_em': atualizado_em
+        }, upsert=True)
+    except Exception as e:
+        logger.error(f"❌ Erro ao salvar sessão de simulação no Mongo: {e}")
+
+async def reabrir_sessao_simulacao(sessao_id: Optional[str]) -> Optional[SessaoSimulacao]:
+    """
+    Sessão em memória ou, se este processo não a conhece (outro worker a abriu ou o
+    processo reiniciou), reaberta a partir dos parâmetros gravados no Mongo.
+    """
+    sessao = obter_sessao_simulacao(sessao_id)
+    if sessao is not None or not sessao_id:
+        return sessao
+    
+    try:
+        documento = await db.simulation_sessions.find_one({'_id': sessao_id})
+    except Exception as e:
+        logger.error(f"❌ Erro ao buscar sessão de simulação no Mongo: {e}")
+        return None
+    
+    if documento is None:
+        return None
+    atualizado_em = documento['atualizado_em']
+    if atualizado_em.tzinfo is None:  # O Mongo devolve datas sem fuso (UTC)
+        atualizado_em = atualizado_em.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - atualizado_em > VALIDADE_SESSAO_SIMULACAO:
+        return None
+    
+    sessao = await asyncio.to_thread(SessaoSimulacao, ParametrosConsorcio(**documento['parametros']), sessao_id)
+    registrar_sessao_simulacao(sessao)
+    logger.info(f"♻️ Sessão de simulação {sessao_id} reaberta a partir do Mongo")
+    return sessao
+
+# Versão do motor de cálculo: faz parte da chave do cache de resultados.
+# Incrementar sempre que uma mudança alterar os resultados de simular_cenario_completo.
+VERSAO_MOTOR_SIMULACAO = 4
+
+class CacheResultadosSimulacao:
+    """
+    Cache LRU + TTL em memória dos resultados de simular_cenario_completo,
+    compartilhado por /simular, /gerar-relatorio-pdf e /admin/saldo-devedor-detalhes
+    (primeira camada de obter_resultado_simulacao).
+    
+    A simulação é determinística, então a chave é só a versão do motor mais os
+    parâmetros canônicos. O limite é pelo tamanho estimado em bytes: ao passar
+    dele, saem as entradas usadas há mais tempo.
+    """
+    
+    def __init__(self, limite_bytes: int = 64 * 1024 * 1024, validade: timedelta = timedelta(minutes=30)):
+        self.limite_bytes = limite_bytes
+        self.validade = validade
+        self.itens = OrderedDict()  # chave -> {'resultado', 'cet_esperado', 'tamanho', 'criado_em'}
+        self.bytes = 0
+        
+        # Estatísticas
+        self.acertos = 0
+        self.faltas = 0
+        self.remocoes = 0
+        self.expirados = 0
+    
+    @staticmethod
+    def chave(parametros: ParametrosConsorcio) -> tuple:
+        """Versão do motor + parâmetros em ordem fixa (floats normalizados, -0.0 vira 0.0)."""
+        valores = tuple(
+            (campo, float(valor) + 0.0 if isinstance(valor, float) else valor)
+            for campo, valor in sorted(parametros.dict().items())
+        )
+        return (VERSAO_MOTOR_SIMULACAO, valores)
+    
+    @staticmethod
+    def tamanho_estimado(resultado: Dict) -> int:
+        """Estimativa em bytes: colunas do cronograma, fluxos e linhas do detalhamento."""
+        tamanho = sys.getsizeof(resultado['fluxos']) + 24 * len(resultado['fluxos'])
+        cronograma = resultado['cronograma']
+        tamanho += sum(getattr(cronograma, coluna).nbytes for coluna in
+                       CronogramaConsorcio.COLUNAS_MONETARIAS + ('ano', 'fator_correcao'))
+        tamanho += sum(getattr(cronograma, coluna).nbytes for coluna in CronogramaConsorcio.COLUNAS_MONETARIAS)  # Centavos
+        
+        detalhamento = resultado['detalhamento']
+        if detalhamento:
+            linha = detalhamento[0]
+            tamanho += len(detalhamento) * (sys.getsizeof(linha) + sum(sys.getsizeof(v) for v in linha.values()))
+        return tamanho
+    
+    def _remover(self, chave):
+        item = self.itens.pop(chave)
+        self.bytes -= item['tamanho']
+    
+    def buscar(self, parametros: ParametrosConsorcio) -> Optional[Dict]:
+        """Entrada válida para os parâmetros (passa a ser a mais recente) ou None."""
+        chave = self.chave(parametros)
+        item = self.itens.get(chave)
+        
+        if item is not None and datetime.now(timezone.utc) - item['criado_em'] > self.validade:
+            self._remover(chave)
+            self.expirados += 1
+            item = None
+        
+        if item is None:
+            self.faltas += 1
+            return None
+        
+        self.acertos += 1
+        self.itens.move_to_end(chave)
+        return item
+    
+    def guardar(self, parametros: ParametrosConsorcio, resultado: Dict,
+                cet_esperado: Optional[Dict] = None) -> Dict:
+        """Guarda o resultado e remove as entradas usadas há mais tempo até caber no limite."""
+        chave = self.chave(parametros)
+        if chave in self.itens:
+            self._remover(chave)
+        
+        item = {'resultado': resultado, 'cet_esperado': cet_esperado,
+                'tamanho': self.tamanho_estimado(resultado), 'criado_em': datetime.now(timezone.utc)}
+        self.itens[chave] = item
+        self.bytes += item['tamanho']
+        
+        # Mantém sempre a entrada nova
+        while self.bytes > self.limite_bytes and len(self.itens) > 1:
+            self._remover(next(iter(self.itens)))
+            self.remocoes += 1
+        
+        return item
+    
+    @staticmethod
+    def copia(item: Dict, incluir_cet_esperado: bool = False) -> tuple:
+        """(resultado, cet_esperado) da entrada; cópia rasa, o resumo pode ser alterado pelo chamador."""
+        resultado = item['resultado']
+        copia = dict(resultado, resumo_financeiro=dict(resultado['resumo_financeiro']))
+        return copia, item['cet_esperado'] if incluir_cet_esperado else None
+    
+    def estatisticas(self) -> Dict:
+        consultas = self.acertos + self.faltas
+        return {
+            'versao_motor': VERSAO_MOTOR_SIMULACAO,
+            'entradas': len(self.itens),
+            'bytes': self.bytes,
+            'limite_bytes': self.limite_bytes,
+            'validade_segundos': self.validade.total_seconds(),
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+            'remocoes': self.remocoes,
+            'expirados': self.expirados
+        }
+
+class CacheSimulacaoMongo:
+    """
+    Segunda camada do cache de resultados: coleção 'simulation_cache' do Mongo,
+    compartilhada entre workers e preservada entre deploys.
+    
+    O _id é a impressão digital (SHA-256) da chave canônica do cache em memória,
+    que já inclui a versão do motor. Os documentos expiram pelo índice TTL em
+    'criado_em'. As colunas do cronograma são gravadas como bytes: as monetárias em
+    centavos inteiros (int64, as mesmas de CronogramaConsorcio.centavos), 'ano' em
+    int64 e 'fator_correcao' em float64. Na leitura os centavos vão direto para o
+    cronograma, sem converter de novo; as colunas em reais são centavos / 100. CET e
+    VPL vêm gravados em 'resultados', e os fluxos da resposta são os arredondados ao
+    centavo nos dois caminhos (ver fluxos_arredondados), então a resposta é a mesma
+    com ou sem o cache.
+    """
+    
+    def __init__(self, validade: timedelta = timedelta(days=7), tempo_limite: float = 0.5):
+        self.validade = validade
+        self.tempo_limite = tempo_limite  # Segundos; acima disso a leitura conta como falta
+        self.tarefas = set()  # Gravações em segundo plano pendentes
+        
+        # Estatísticas
+        self.acertos = 0
+        self.faltas = 0
+        self.gravacoes = 0
+        self.erros = 0
+    
+    @staticmethod
+    def impressao_digital(parametros: ParametrosConsorcio) -> str:
+        chave = json.dumps(CacheResultadosSimulacao.chave(parametros))
+        return hashlib.sha256(chave.encode()).hexdigest()
+    
+    @staticmethod
+    def para_documento(parametros: ParametrosConsorcio, item: Dict) -> Dict:
+        resultado = item['resultado']
+        cronograma = resultado['cronograma']
+        colunas = {
+            **cronograma.centavos(),
+            'ano': np.asarray(cronograma.ano, dtype=np.int64),
+            'fator_correcao': np.asarray(cronograma.fator_correcao, dtype=float)
+        }
+        
+        return {
+            '_id': CacheSimulacaoMongo.impressao_digital(parametros),
+            'versao_motor': VERSAO_MOTOR_SIMULACAO,
+            'criado_em': datetime.now(timezone.utc),
+            'parametros': resultado['parametros'],
+            'resultados': resultado['resultados'],
+            'resumo_financeiro': resultado['resumo_financeiro'],
+            'cronograma': {
+                'mes_contemplacao': cronograma.mes_contemplacao,
+                'colunas': {coluna: np.ascontiguousarray(valores).tobytes() for coluna, valores in colunas.items()}
             },
-            'fluxos': resultado_fluxos['fluxos'],
-            'detalhamento': resultado_fluxos['detalhamento'],
-            'resumo_financeiro': resultado_fluxos['resumo']
+            'cet_esperado': item['cet_esperado']
+        }
+    
+    @staticmethod
+    def de_documento(documento: Dict) -> tuple:
+        """Remonta (resultado no formato de simular_cenario_completo, cet_esperado)."""
+        colunas = {
+            coluna: np.frombuffer(valores, dtype=float if coluna == 'fator_correcao' else np.int64).copy()
+            for coluna, valores in documento['cronograma']['colunas'].items()
+        }
+        centavos = {coluna: colunas.pop(coluna) for coluna in CronogramaConsorcio.COLUNAS_MONETARIAS}
+        cronograma = CronogramaConsorcio(
+            mes_contemplacao=documento['cronograma']['mes_contemplacao'],
+            centavos=centavos,
+            **colunas,
+            **{coluna: valores / 100 for coluna, valores in centavos.items()}
+        )
+        
+        resultado = {
+            'erro': False,
+            'parametros': documento['parametros'],
+            'resultados': documento['resultados'],
+            'fluxos': cronograma.fluxos().tolist(),
+            'detalhamento': [],
+            'cronograma': cronograma,
+            'resumo_financeiro': documento['resumo_financeiro']
+        }
+        return resultado, documento.get('cet_esperado')
+    
+    async def criar_indices(self):
+        await db.simulation_cache.create_index('criado_em', expireAfterSeconds=int(self.validade.total_seconds()))
+    
+    async def buscar(self, parametros: ParametrosConsorcio) -> Optional[tuple]:
+        """(resultado, cet_esperado) gravados para os parâmetros, ou None (também em erro ou demora do Mongo)."""
+        try:
+            documento = await asyncio.wait_for(
+                db.simulation_cache.find_one({'_id': self.impressao_digital(parametros)}),
+                timeout=self.tempo_limite
+            )
+        except Exception as e:
+            self.erros += 1
+            logger.warning(f"⚠️ Cache de simulação no Mongo indisponível: {e}")
+            return None
+        
+        if documento is None:
+            self.faltas += 1
+            return None
+        
+        self.acertos += 1
+        return self.de_documento(documento)
+    
+    async def salvar(self, parametros: ParametrosConsorcio, item: Dict):
+        try:
+            documento = self.para_documento(parametros, item)
+            await db.simulation_cache.replace_one({'_id': documento['_id']}, documento, upsert=True)
+            self.gravacoes += 1
+        except Exception as e:
+            self.erros += 1
+            logger.error(f"❌ Erro ao gravar cache de simulação no Mongo: {e}")
+    
+    def salvar_em_segundo_plano(self, parametros: ParametrosConsorcio, item: Dict):
+        tarefa = asyncio.create_task(self.salvar(parametros, item))
+        self.tarefas.add(tarefa)
+        tarefa.add_done_callback(self.tarefas.discard)
+    
+    def estatisticas(self) -> Dict:
+        consultas = self.acertos + self.faltas
+        return {
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+            'gravacoes': self.gravacoes,
+            'gravacoes_pendentes': len(self.tarefas),
+            'erros': self.erros,
+            'validade_segundos': self.validade.total_seconds()
+        }
+
+# Resultados de simulação recentes: memória do processo e Mongo (compartilhado)
+CACHE_RESULTADOS_SIMULACAO = CacheResultadosSimulacao()
+CACHE_SIMULACAO_MONGO = CacheSimulacaoMongo()
+
+class CoalescedorChamadas:
+    """
+    Single-flight: chamadas concorrentes com a mesma chave compartilham um único
+    cálculo. A primeira dispara a tarefa; as que chegam enquanto ela roda aguardam
+    a mesma tarefa (resultado ou exceção). Nada fica guardado depois que ela termina
+    (isso é papel dos caches).
+    
+    A tarefa não é cancelada se quem a disparou desistir (cliente desconectou):
+    as demais continuam esperando por ela.
+    """
+    
+    def __init__(self):
+        self.em_andamento = {}  # chave -> asyncio.Task
+        self.contadores = {}  # grupo (chave[0]) -> execuções, coalescidas, erros
+    
+    async def executar(self, chave: tuple, funcao, *args):
+        """Resultado de 'await funcao(*args)', compartilhado por chave. chave[0] é o grupo nas estatísticas."""
+        contadores = self.contadores.setdefault(chave[0], {'execucoes': 0, 'coalescidas': 0, 'erros': 0})
+        tarefa = self.em_andamento.get(chave)
+        
+        if tarefa is None:
+            contadores['execucoes'] += 1
+            tarefa = asyncio.ensure_future(funcao(*args))
+            self.em_andamento[chave] = tarefa
+            tarefa.add_done_callback(lambda t: self._concluir(chave, t))
+        else:
+            contadores['coalescidas'] += 1
+        
+        return await asyncio.shield(tarefa)
+    
+    def _concluir(self, chave: tuple, tarefa: asyncio.Task):
+        self.em_andamento.pop(chave, None)
+        if tarefa.cancelled() or tarefa.exception() is not None:
+            self.contadores[chave[0]]['erros'] += 1
+    
+    def estatisticas(self) -> Dict:
+        return {
+            'em_andamento': len(self.em_andamento),
+            # Cada chamada coalescida é um cálculo que deixou de ser feito
+            'calculos_economizados': sum(c['coalescidas'] for c in self.contadores.values()),
+            'grupos': {grupo: dict(c) for grupo, c in self.contadores.items()}
+        }
+
+# Global (lido por /admin/coalescencia)
+COALESCEDOR_CHAMADAS = CoalescedorChamadas()
+
+# PDFs fora do loop de eventos; os gráficos usam Figure/FigureCanvasAgg (sem o estado global
+# do pyplot), então vários PDFs podem ser gerados ao mesmo tempo
+EXECUTOR_PDF = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="pdf")
+
+async def carregar_simulacao(parametros: ParametrosConsorcio) -> tuple:
+    """
+    Falta na memória: busca no Mongo ou calcula (numa thread, sem travar o loop).
+    O calculado é gravado no Mongo em segundo plano.
+    
+    Returns:
+        (item do cache, None) ou (None, resultado com erro)
+    """
+    gravado = await CACHE_SIMULACAO_MONGO.buscar(parametros)
+    if gravado is not None:
+        return CACHE_RESULTADOS_SIMULACAO.guardar(parametros, *gravado), None
+    
+    # Sem linhas do detalhamento: cada resposta monta só as que usa
+    resultado = await asyncio.to_thread(SimuladorConsorcio(parametros).simular_cenario_completo, False)
+    if resultado['erro']:
+        return None, resultado
+    
+    item = CACHE_RESULTADOS_SIMULACAO.guardar(parametros, resultado)
+    CACHE_SIMULACAO_MONGO.salvar_em_segundo_plano(parametros, item)
+    return item, None
+
+async def completar_cet_esperado(parametros: ParametrosConsorcio, item: Dict):
+    """Calcula o CET esperado do item do cache (numa thread) e regrava o item no Mongo."""
+    item['cet_esperado'] = await asyncio.to_thread(SimuladorConsorcio(parametros).calcular_cet_esperado)
+    CACHE_SIMULACAO_MONGO.salvar_em_segundo_plano(parametros, item)
+
+async def obter_resultado_simulacao(parametros: ParametrosConsorcio, incluir_cet_esperado: bool = False) -> tuple:
+    """
+    Resultado da simulação pelo cache em duas camadas: memória do processo, depois
+    Mongo, depois cálculo. O que vem do Mongo ou é calculado entra na memória; o
+    que é calculado é gravado no Mongo em segundo plano. Requisições simultâneas
+    com os mesmos parâmetros esperam um único cálculo (COALESCEDOR_CHAMADAS).
+    
+    Com incluir_cet_esperado, o CET esperado sai da mesma consulta ao cache; uma
+    falha nele não interrompe a simulação (cet_esperado None).
+    
+    Returns:
+        (resultado no formato de simular_cenario_completo, cet_esperado ou None)
+    """
+    chave = CacheResultadosSimulacao.chave(parametros)
+    item = CACHE_RESULTADOS_SIMULACAO.buscar(parametros)
+    
+    if item is None:
+        item, resultado_erro = await COALESCEDOR_CHAMADAS.executar(('simulacao', chave), carregar_simulacao, parametros)
+        if item is None:
+            return resultado_erro, None
+    
+    if incluir_cet_esperado and item['cet_esperado'] is None:
+        try:
+            await COALESCEDOR_CHAMADAS.executar(('cet_esperado', chave), completar_cet_esperado, parametros, item)
+        except Exception as e:
+            logger.error(f"Erro ao calcular CET esperado: {e}")
+    
+    return CACHE_RESULTADOS_SIMULACAO.copia(item, incluir_cet_esperado)
+
+@app.on_event("startup")
+async def criar_indices_cache_simulacao():
+    try:
+        await CACHE_SIMULACAO_MONGO.criar_indices()
+        await db.simulation_sessions.create_index('atualizado_em', expireAfterSeconds=int(VALIDADE_SESSAO_SIMULACAO.total_seconds()))
+    except Exception as e:
+        logger.error(f"❌ Erro ao criar índice TTL do cache de simulação: {e}")
+
+class RespostaJSONRapida(Response):
+    """
+    Resposta JSON serializada direto com orjson, sem passar pelo response_model.
+    
+    Para endpoints cujo conteúdo já sai no esquema do modelo (ver dados_no_formato).
+    NaN e ±inf viram null; arrays e escalares NumPy são aceitos.
+    """
+    media_type = "application/json"
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """Codificação para a resposta pelo Accept-Encoding do cliente: 'br' (se disponível), 'gzip' ou None."""
+    aceitas = {}
+    for item in accept_encoding.split(','):
+        nome, _, parametro = item.partition(';')
+        parametro = parametro.strip()
+        try:
+            q = float(parametro[2:]) if parametro.startswith('q=') else 1.0
+        except ValueError:
+            q = 0.0
+        aceitas[nome.strip().lower()] = q
+    
+    for codificacao in ('br', 'gzip'):
+        if codificacao == 'br' and brotli is None:
+            continue
+        if aceitas.get(codificacao, aceitas.get('*', 0.0)) > 0:
+            return codificacao
+    return None
+
+class EstatisticasCompressao:
+    """Contadores da compressão de respostas: bytes, razão e tempo de CPU por codificação."""
+    
+    def __init__(self):
+        self.codificacoes = {}
+        self.abaixo_do_minimo = 0
+        self.nao_comprimidas = 0  # Cliente sem br/gzip, tipo não comprimível ou já codificado
+        self.em_thread = 0  # Comprimidas fora do loop de eventos (acima de minimo_bytes_thread)
+    
+    def registrar(self, codificacao: str, bytes_originais: int, bytes_comprimidos: int, segundos_cpu: float):
+        item = self.codificacoes.setdefault(codificacao, {
+            'respostas': 0, 'bytes_originais': 0, 'bytes_comprimidos': 0, 'segundos_cpu': 0.0
+        })
+        item['respostas'] += 1
+        item['bytes_originais'] += bytes_originais
+        item['bytes_comprimidos'] += bytes_comprimidos
+        item['segundos_cpu'] += segundos_cpu
+    
+    def estatisticas(self) -> Dict:
+        return {
+            'brotli_disponivel': brotli is not None,
+            'abaixo_do_minimo': self.abaixo_do_minimo,
+            'nao_comprimidas': self.nao_comprimidas,
+            'em_thread': self.em_thread,
+            'codificacoes': {
+                codificacao: {
+                    'respostas': item['respostas'],
+                    'bytes_originais': item['bytes_originais'],
+                    'bytes_comprimidos': item['bytes_comprimidos'],
+                    # Comprimido / original (menor é melhor)
+                    'razao': item['bytes_comprimidos'] / item['bytes_originais'],
+                    'tempo_cpu_ms': item['segundos_cpu'] * 1000,
+                    'tempo_cpu_medio_ms': item['segundos_cpu'] * 1000 / item['respostas']
+                }
+                for codificacao, item in self.codificacoes.items()
+            }
         }
 
+class MiddlewareCompressao:
+    """
+    Compressão negociada (br/gzip) das respostas da API.
+    
+    O corpo é acumulado e comprimido de uma vez. Passam intactas as respostas
+    abaixo de 'minimo_bytes', as já codificadas, as de tipo não textual e as
+    rotas em 'rotas_excluidas' (ex.: o PDF servido por FileResponse, que nem é
+    acumulado). Corpos a partir de 'minimo_bytes_thread' são comprimidos numa
+    thread (anyio.to_thread), para não segurar o loop de eventos; os menores
+    custam menos que a troca de thread e são comprimidos ali mesmo.
+    """
+    TIPOS_COMPRIMIVEIS = ('application/json', 'text/')
+    
+    def __init__(self, app, estatisticas: EstatisticasCompressao, minimo_bytes: int = 1024,
+                 rotas_excluidas=(), nivel_gzip: int = 6, qualidade_brotli: int = 5,
+                 minimo_bytes_thread: int = 64 * 1024):
+        self.app = app
+        self.estatisticas = estatisticas
+        self.minimo_bytes = minimo_bytes
+        self.minimo_bytes_thread = minimo_bytes_thread
+        self.rotas_excluidas = set(rotas_excluidas)
+        self.nivel_gzip = nivel_gzip
+        self.qualidade_brotli = qualidade_brotli
+    
+    def comprimir(self, corpo: bytes, codificacao: str) -> bytes:
+        if codificacao == 'br':
+            return brotli.compress(corpo, quality=self.qualidade_brotli)
+        return gzip.compress(corpo, compresslevel=self.nivel_gzip)
+    
+    def comprimir_medindo(self, corpo: bytes, codificacao: str) -> tuple:
+        """(comprimido, segundos de CPU), medidos na thread que comprime."""
+        cpu_inicio = time.thread_time()
+        comprimido = self.comprimir(corpo, codificacao)
+        return comprimido, time.thread_time() - cpu_inicio
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.rotas_excluidas:
+            await self.app(scope, receive, send)
+            return
+        
+        codificacao = escolher_codificacao(Headers(scope=scope).get('accept-encoding', ''))
+        inicio = None
+        partes = None  # None: repassando sem comprimir
+        
+        async def enviar(mensagem):
+            nonlocal inicio, partes
+            if mensagem['type'] == 'http.response.start':
+                headers = Headers(raw=mensagem['headers'])
+                if (codificacao is not None and 'content-encoding' not in headers
+                        and headers.get('content-type', '').startswith(self.TIPOS_COMPRIMIVEIS)):
+                    inicio = mensagem
+                    partes = []
+                else:
+                    self.estatisticas.nao_comprimidas += 1
+                    await send(mensagem)
+                return
+            
+            if partes is None or mensagem['type'] != 'http.response.body':
+                await send(mensagem)
+                return
+            
+            partes.append(mensagem.get('body', b''))
+            if mensagem.get('more_body', False):
+                return
+            
+            corpo = b''.join(partes)
+            if len(corpo) < self.minimo_bytes:
+                self.estatisticas.abaixo_do_minimo += 1
+                await send(inicio)
+                await send({'type': 'http.response.body', 'body': corpo})
+                return
+            
+            if len(corpo) >= self.minimo_bytes_thread:
+                self.estatisticas.em_thread += 1
+                comprimido, segundos_cpu = await anyio.to_thread.run_sync(self.comprimir_medindo, corpo, codificacao)
+            else:
+                comprimido, segundos_cpu = self.comprimir_medindo(corpo, codificacao)
+            self.estatisticas.registrar(codificacao, len(corpo), len(comprimido), segundos_cpu)
+            
+            headers = MutableHeaders(raw=inicio['headers'])
+            etag = headers.get('etag')
+            if etag and not etag.startswith('W/'):
+                # Outra representação, outro ETag forte (ver etag_corresponde)
+                headers['ETag'] = f'{etag[:-1]}-{codificacao}"'
+            headers['Content-Encoding'] = codificacao
+            headers['Content-Length'] = str(len(comprimido))
+            headers.add_vary_header('Accept-Encoding')
+            await send(inicio)
+            await send({'type': 'http.response.body', 'body': comprimido})
+        
+        await self.app(scope, receive, enviar)
+
+# Global (lido por /admin/compressao)
+ESTATISTICAS_COMPRESSAO = EstatisticasCompressao()
+
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "Simulador de Consórcio API - Ativo"}
 
+def validar_parametros_simulacao(parametros: ParametrosConsorcio) -> Optional[str]:
+    """Validações básicas da simulação. Retorna a mensagem de erro ou None se válido."""
+    if parametros.valor_carta <= 0:
+        return "Valor da carta deve ser positivo"
+    
+    if parametros.prazo_meses <= 0:
+        return "Prazo deve ser positivo"
+    
+    if parametros.mes_contemplacao > parametros.prazo_meses:
+        return "Mês de contemplação não pode ser maior que o prazo"
+    
+    if parametros.mes_contemplacao <= 0:
+        return "Mês de contemplação deve ser positivo"
+    
+    return None
+
+async def identificar_lead_simulacao(request) -> tuple:
+    """
+    Extrai o access_token do header Authorization e busca o lead.
+    Retorna (lead_id, access_token_usado).
+    
+    Só no WebSocket (o navegador não envia headers no handshake) o token também
+    é aceito no parâmetro 'token' da query; em rotas HTTP ele iria parar em URLs,
+    logs de acesso e chaves de cache. O token nunca é escrito no log.
+    """
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header and isinstance(request, WebSocket):
+        auth_header = request.query_params.get("token", "")
+    
+    # 🔧 CORREÇÃO: Extração mais robusta do token
+    access_token = ""
+    if auth_header:
+        if auth_header.startswith("Bearer "):
+            access_token = auth_header[7:]  # Remove "Bearer "
+        elif auth_header.startswith("bearer "):
+            access_token = auth_header[7:]  # Remove "bearer "
+        else:
+            access_token = auth_header  # Usar como está se não tem Bearer
+    
+    lead_id = None
+    access_token_usado = access_token if access_token else None  # Salvar token usado
+    
+    if access_token:
+        lead = await db.leads.find_one({"access_token": access_token})
+        if lead:
+            lead_id = lead["id"]
+            logger.info(f"✅ Lead encontrado! ID: {lead_id}, Nome: {lead.get('name')}, Email: {lead.get('email')}")
+        else:
+            logger.error("❌ Lead NÃO encontrado para o access_token informado")
+    else:
+        logger.warning("⚠️ Nenhum access_token fornecido na simulação")
+    
+    return lead_id, access_token_usado
+
+def criar_simulation_input(parametros: ParametrosConsorcio, request: Request,
+                           lead_id: Optional[str], access_token_usado: Optional[str]) -> SimulationInput:
+    """Monta o registro de input da simulação para salvar no banco."""
+    return SimulationInput(
+        lead_id=lead_id,
+        access_token_usado=access_token_usado,  # 🔧 ADICIONAR: Salvar token usado para debug
+        valor_carta=parametros.valor_carta,
+        prazo_meses=parametros.prazo_meses,
+        taxa_admin=parametros.taxa_admin,
+        fundo_reserva=parametros.fundo_reserva,
+        mes_contemplacao=parametros.mes_contemplacao,
+        lance_livre_perc=parametros.lance_livre_perc,
+        taxa_reajuste_anual=parametros.taxa_reajuste_anual,
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent")
+    )
+
+def adicionar_probabilidades_resumo(resumo_financeiro: Dict, parametros: ParametrosConsorcio) -> None:
+    """Adiciona ao resumo financeiro as probabilidades do mês de contemplação escolhido."""
+    # Calcular probabilidades específicas do mês de contemplação escolhido
+    # NOVA LÓGICA: participantes = 2 × prazo_meses (1 sorteio + 1 lance sempre)
+    num_participantes_padrao = parametros.prazo_meses * 2
+    contemplados_por_mes_padrao = 2  # Sempre 2 (1 sorteio + 1 lance)
+    
+    # 🎯 CORREÇÃO: Ajustar contemplados_por_mes baseado no lance_livre_perc
+    if parametros.lance_livre_perc == 0:
+        # Cliente NÃO dará lance - apenas 1 contemplado por mês (só sorteio)
+        contemplados_mes_ajustado = 1
+        logger.info(f"🎯 CORREÇÃO: lance_livre_perc=0, usando contemplados_por_mes=1 (só sorteio)")
+    else:
+        # Cliente DARÁ lance - 2 contemplados por mês (sorteio + lance)
+        contemplados_mes_ajustado = contemplados_por_mes_padrao
+        logger.info(f"🎯 CORREÇÃO: lance_livre_perc={parametros.lance_livre_perc}, usando contemplados_por_mes=2 (sorteio+lance)")
+        
+    prob_mes = calcular_probabilidade_mes_especifico(
+        mes_contemplacao=parametros.mes_contemplacao,
+        lance_livre_perc=parametros.lance_livre_perc,
+        num_participantes=num_participantes_padrao,
+        contemplados_por_mes=contemplados_mes_ajustado  # ← Usa valor ajustado
+    )
+    
+    # Adicionar probabilidades ao resumo financeiro
+    if prob_mes:
+        # Verificar se os valores são válidos (não NaN ou infinito)
+        prob_no_mes = prob_mes['prob_no_mes']
+        prob_ate_mes = prob_mes['prob_ate_mes']
+        participantes_restantes = prob_mes['participantes_restantes']
+        
+        # Sanitizar valores
+        if not np.isfinite(prob_no_mes):
+            prob_no_mes = 0.0
+        if not np.isfinite(prob_ate_mes):
+            prob_ate_mes = 0.0
+            
+        resumo_financeiro['prob_contemplacao_no_mes'] = float(prob_no_mes)
+        resumo_financeiro['prob_contemplacao_ate_mes'] = float(prob_ate_mes)
+        resumo_financeiro['participantes_restantes_mes'] = int(participantes_restantes)
+    else:
+        resumo_financeiro['prob_contemplacao_no_mes'] = 0.0
+        resumo_financeiro['prob_contemplacao_ate_mes'] = 0.0
+        resumo_financeiro['participantes_restantes_mes'] = 0
+
+def interpretar_intervalo_meses(texto: Optional[str]) -> Optional[tuple]:
+    """Converte 'a-b' (ou 'a') em (a, b). Levanta ValueError se inválido."""
+    if not texto:
+        return None
+    
+    partes = texto.split('-')
+    if len(partes) > 2 or not all(p.strip().isdigit() for p in partes):
+        raise ValueError("Intervalo de meses deve estar no formato 'a-b' (ex.: 1-24)")
+    
+    inicio, fim = int(partes[0]), int(partes[-1])
+    if inicio < 1 or fim < inicio:
+        raise ValueError("Intervalo de meses inválido: é preciso 1 <= a <= b")
+    return inicio, fim
+
+def meses_detalhamento(prazo: int, mes_contemplacao: int, detalhe: str = 'completo',
+                       intervalo: Optional[tuple] = None) -> Optional[np.ndarray]:
+    """
+    Meses (1..prazo) cujas linhas entram na resposta; None quer dizer todos.
+    
+    - resumo: nenhum
+    - anual: último mês de cada ano e o mês de contemplação
+    - completo: todos
+    'intervalo' (a, b) restringe a seleção aos meses a..b.
+    """
+    if detalhe == 'completo' and intervalo is None:
+        return None
+    
+    meses = np.arange(1, prazo + 1)
+    if detalhe == 'resumo':
+        meses = meses[:0]
+    elif detalhe == 'anual':
+        meses = meses[(meses % 12 == 0) | (meses == prazo) | (meses == mes_contemplacao)]
+    
+    if intervalo is not None:
+        meses = meses[(meses >= intervalo[0]) & (meses <= intervalo[1])]
+    return meses
+
+def linhas_detalhamento(resultado: Dict, meses=None) -> List:
+    """
+    Linhas do detalhamento dos meses indicados (todos se None): as que já vieram
+    no resultado ou, se ele não tem detalhamento, montadas só agora do cronograma.
+    """
+    if resultado['detalhamento']:
+        return resultado['detalhamento'] if meses is None else [resultado['detalhamento'][mes - 1] for mes in meses]
+    
+    cronograma = resultado['cronograma']
+    return cronograma.detalhamento() if meses is None else cronograma.detalhamento_meses(meses)
+
+def dados_no_formato(modelo: type, dados: Dict) -> Dict:
+    """
+    Dict com exatamente os campos de 'modelo' (ausentes recebem o default dele),
+    sem instanciar nem validar o modelo.
+    """
+    return {
+        campo: dados[campo] if campo in dados else info.get_default(call_default_factory=True)
+        for campo, info in modelo.model_fields.items()
+    }
+
+def montar_dados_resposta_simulacao(resultado: Dict, parametros: ParametrosConsorcio, formato: str = 'linhas',
+                                    detalhe: str = 'completo', intervalo: Optional[tuple] = None) -> Dict:
+    """
+    Conteúdo de RespostaSimulacao como dicts simples, direto da saída do simulador
+    (com probabilidades do mês). Usado sem validação pelo caminho rápido de
+    /simular (RespostaJSONRapida); montar_resposta_simulacao valida o mesmo conteúdo.
+    
+    Com formato='colunar' o detalhamento vai em 'detalhamento_colunar' (uma lista
+    por coluna, montada direto do cronograma) e 'detalhamento' fica vazio.
+    'detalhe' e 'intervalo' escolhem as linhas (ver meses_detalhamento); as
+    demais nunca são montadas. 'fluxos' só vem com detalhe completo sem intervalo.
+    """
+    if resultado['erro']:
+        return dados_no_formato(RespostaSimulacao, {
+            'erro': True,
+            'mensagem': resultado.get('mensagem', 'Erro desconhecido na simulação')
+        })
+    
+    adicionar_probabilidades_resumo(resultado['resumo_financeiro'], parametros)
+    
+    meses = meses_detalhamento(parametros.prazo_meses, parametros.mes_contemplacao, detalhe, intervalo)
+    
+    detalhamento = []
+    detalhamento_colunar = None
+    if formato == 'colunar':
+        if meses is None or len(meses):
+            detalhamento_colunar = resultado['cronograma'].colunas(meses)
+    else:
+        detalhamento = linhas_detalhamento(resultado, meses)
+    
+    return dados_no_formato(RespostaSimulacao, {
+        'erro': False,
+        'parametros': resultado['parametros'],
+        'resultados': dados_no_formato(ResultadosSimulacao, resultado['resultados']),
+        'fluxos': resultado['cronograma'].fluxos_arredondados() if meses is None else [],
+        'detalhamento': detalhamento,
+        'detalhamento_colunar': detalhamento_colunar,
+        'resumo_financeiro': dados_no_formato(ResumoFinanceiro, resultado['resumo_financeiro'])
+    })
+
+def montar_resposta_simulacao(resultado: Dict, parametros: ParametrosConsorcio, formato: str = 'linhas',
+                              detalhe: str = 'completo', intervalo: Optional[tuple] = None) -> RespostaSimulacao:
+    """Converte o resultado do simulador em RespostaSimulacao (ver montar_dados_resposta_simulacao)."""
+    return RespostaSimulacao(**montar_dados_resposta_simulacao(resultado, parametros, formato, detalhe, intervalo))
+
+def validar_consulta_simulacao(parametros: ParametrosConsorcio, formato: str, detalhe: str,
+                               meses: Optional[str]) -> Optional[tuple]:
+    """Valida parâmetros e opções de /simular (HTTPException 400 se inválidos). Retorna o intervalo de meses."""
+    if formato not in ("linhas", "colunar"):
+        raise HTTPException(status_code=400, detail="Formato deve ser 'linhas' ou 'colunar'")
+    
+    if detalhe not in ("resumo", "anual", "completo"):
+        raise HTTPException(status_code=400, detail="Detalhe deve ser 'resumo', 'anual' ou 'completo'")
+    
+    try:
+        intervalo = interpretar_intervalo_meses(meses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    erro_validacao = validar_parametros_simulacao(parametros)
+    if erro_validacao:
+        raise HTTPException(status_code=400, detail=erro_validacao)
+    
+    return intervalo
+
+async def registrar_entrada_simulacao(parametros: ParametrosConsorcio, request, lead: Optional[tuple] = None):
+    """
+    Salva o input da simulação (simulation_inputs) com o lead do token; erros só vão para o log.
+    'lead' é o (lead_id, access_token_usado) já identificado, se houver (canal ao vivo).
+    """
+    try:
+        lead_id, access_token_usado = lead if lead is not None else await identificar_lead_simulacao(request)
+        simulation_input = criar_simulation_input(parametros, request, lead_id, access_token_usado)
+        
+        # 🔧 DEBUG: Log antes de salvar
+        logger.info(f"📝 Dados da simulação ANTES de salvar:")
+        logger.info(f"   - ID: {simulation_input.id}")
+        logger.info(f"   - Lead_ID: {lead_id}")
+        logger.info(f"   - Access_token informado: {'sim' if access_token_usado else 'não'}")
+        
+        await db.simulation_inputs.insert_one(simulation_input.dict())
+        logger.info(f"💾 Simulação salva COM SUCESSO: ID={simulation_input.id}, Lead_ID={lead_id}")
+        
+    except Exception as e:
+        logger.error(f"❌ Erro ao salvar simulação: {e}")
+        import traceback
+        logger.error(f"📋 Traceback completo: {traceback.format_exc()}")
+        # Não interrompe a simulação se houver erro no salvamento
+
+async def dados_simulacao(parametros: ParametrosConsorcio, formato: str, detalhe: str,
+                          intervalo: Optional[tuple]) -> Dict:
+    """Resposta de /simular (esquema de RespostaSimulacao, com CET esperado) como dicts simples."""
+    # Executar simulação (ou reaproveitar do cache) com o CET esperado pela distribuição
+    # do mês de contemplação, numa única consulta ao cache
+    resultado, cet_esperado = await obter_resultado_simulacao(parametros, incluir_cet_esperado=True)
+    dados = montar_dados_resposta_simulacao(resultado, parametros, formato, detalhe, intervalo)
+    
+    if not dados['erro'] and cet_esperado:
+        dados['cet_esperado'] = dados_no_formato(CETEsperado, cet_esperado)
+    
+    return dados
+
+# Cache-Control do GET /simular: sem token, um dia fresco e depois revalida pelo ETag (que muda
+# com VERSAO_MOTOR_SIMULACAO); com token, só o navegador guarda e revalida a cada uso
+CACHE_CONTROL_SIMULACAO = "public, max-age=86400, stale-while-revalidate=604800"
+CACHE_CONTROL_SIMULACAO_COM_TOKEN = "private, no-cache"
+
+def consulta_canonica_simulacao(parametros: ParametrosConsorcio, formato: str = 'linhas',
+                                detalhe: str = 'completo', intervalo: Optional[tuple] = None) -> str:
+    """
+    Query string canônica do GET /simular: todos os parâmetros na ordem do modelo,
+    números normalizados e opções só quando diferentes do padrão.
+    """
+    itens = [
+        # Pelo tipo do campo: o default valor_carta=100_000 e o 100000.0 vindo do JSON ficam iguais
+        (campo, repr(float(valor) + 0.0) if ParametrosConsorcio.model_fields[campo].annotation is float else str(valor))
+        for campo, valor in parametros.dict().items()
+    ]
+    if formato != 'linhas':
+        itens.append(('formato', formato))
+    if detalhe != 'completo':
+        itens.append(('detalhe', detalhe))
+    if intervalo is not None:
+        itens.append(('meses', f"{intervalo[0]}-{intervalo[1]}"))
+    return '&'.join(f"{campo}={valor}" for campo, valor in itens)
+
+def etag_simulacao(parametros: ParametrosConsorcio, formato: str = 'linhas',
+                   detalhe: str = 'completo', intervalo: Optional[tuple] = None) -> str:
+    """
+    ETag forte da resposta de /simular: hash da versão do motor e da consulta canônica.
+    
+    Forte porque o corpo é idêntico byte a byte entre execuções (a semente de
+    INDICE_RAIZES_CET não muda o resultado, e seus diagnósticos ficam fora da resposta).
+    """
+    chave = json.dumps([VERSAO_MOTOR_SIMULACAO, consulta_canonica_simulacao(parametros, formato, detalhe, intervalo)])
+    return f'"{hashlib.sha256(chave.encode()).hexdigest()[:32]}"'
+
+def etag_corresponde(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match casa com 'etag'? Comparação fraca (RFC 9110), aceitando também a
+    variante com sufixo de codificação ('"...-gzip"') gerada pelo MiddlewareCompressao.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    
+    for candidato in if_none_match.split(','):
+        candidato = candidato.strip().removeprefix('W/')
+        for codificacao in ('br', 'gzip'):
+            sufixo = f'-{codificacao}"'
+            if candidato.endswith(sufixo):
+                candidato = candidato[:-len(sufixo)] + '"'
+        if candidato == etag:
+            return True
+    return False
+
 @api_router.post("/simular", response_model=RespostaSimulacao)
-async def simular_consorcio(parametros: ParametrosConsorcio, request: Request):
-    """Simula um consórcio com os parâmetros fornecidos."""
+async def simular_consorcio(parametros: ParametrosConsorcio, request: Request, formato: str = "linhas",
+                            detalhe: str = "completo", meses: Optional[str] = None):
+    """
+    Simula um consórcio com os parâmetros fornecidos.
+    
+    formato=colunar retorna o detalhamento em colunas (detalhamento_colunar),
+    bem menor para prazos longos. detalhe=resumo|anual|completo e meses=a-b
+    escolhem as linhas do detalhamento (ex.: resumo para a primeira tela e a
+    tabela depois, página a página).
+    """
     try:
         # Validações básicas
-        if parametros.valor_carta <= 0:
-            raise HTTPException(status_code=400, detail="Valor da carta deve ser positivo")
+        intervalo = validar_consulta_simulacao(parametros, formato, detalhe, meses)
         
-        if parametros.prazo_meses <= 0:
-            raise HTTPException(status_code=400, detail="Prazo deve ser positivo")
+        # Salvar input da simulação no banco de dados
+        await registrar_entrada_simulacao(parametros, request)
         
-        if parametros.mes_contemplacao > parametros.prazo_meses:
-            raise HTTPException(status_code=400, detail="Mês de contemplação não pode ser maior que o prazo")
+        dados = await dados_simulacao(parametros, formato, detalhe, intervalo)
+        
+        # Caminho rápido: mesmo esquema de RespostaSimulacao, sem validar linha a linha
+        return RespostaJSONRapida(dados, headers={
+            'Content-Location': f"/api/simular?{consulta_canonica_simulacao(parametros, formato, detalhe, intervalo)}"
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na simulação: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+@api_router.get("/simular", response_model=RespostaSimulacao)
+async def simular_consorcio_get(request: Request, background_tasks: BackgroundTasks,
+                                parametros: ParametrosConsorcio = Depends(), formato: str = "linhas",
+                                detalhe: str = "completo", meses: Optional[str] = None):
+    """
+    Versão GET de /simular (mesmos parâmetros na query string e mesma resposta),
+    cacheável por navegador e proxy reverso.
+    
+    O resultado só depende dos parâmetros e da versão do motor: vai com ETag forte
+    e Cache-Control longo, e um If-None-Match igual devolve 304 sem simular. Com
+    Authorization (a rota registra o lead do token) a resposta é privada e revalida
+    a cada uso; Vary: Authorization separa as duas no cache. O registro do input
+    roda em segundo plano, depois da resposta (também nas revalidações). O POST
+    devolve em Content-Location a URL canônica deste GET (para links compartilháveis).
+    """
+    try:
+        intervalo = validar_consulta_simulacao(parametros, formato, detalhe, meses)
+        
+        etag = etag_simulacao(parametros, formato, detalhe, intervalo)
+        com_token = bool(request.headers.get('authorization'))
+        cabecalhos = {
+            'ETag': etag,
+            'Cache-Control': CACHE_CONTROL_SIMULACAO_COM_TOKEN if com_token else CACHE_CONTROL_SIMULACAO,
+            'Vary': 'Authorization',
+            'Content-Location': f"/api/simular?{consulta_canonica_simulacao(parametros, formato, detalhe, intervalo)}"
+        }
+        
+        # Registro do input fora do caminho da resposta (também nas revalidações)
+        background_tasks.add_task(registrar_entrada_simulacao, parametros, request)
+        
+        if etag_corresponde(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=cabecalhos)
+        
+        dados = await dados_simulacao(parametros, formato, detalhe, intervalo)
+        return RespostaJSONRapida(dados, headers=cabecalhos)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na simulação: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+@api_router.post("/simular-completo", response_model=RespostaSimulacaoCompleta)
+async def simular_consorcio_completo(parametros: ParametrosConsorcio, request: Request, formato: str = "linhas",
+                                     detalhe: str = "completo", meses: Optional[str] = None):
+    """
+    /simular, /grafico-probabilidades/{prazo} e /calcular-probabilidades (com
+    participantes = 2 × prazo) numa única chamada.
+    
+    Os hazards sem/com lance do grupo vêm de uma única tabela (TABELAS_SOBREVIVENCIA),
+    compartilhada pelas probabilidades do mês escolhido, pelo gráfico e pelas curvas.
+    O grupo segue o limite de /calcular-probabilidades (prazo até
+    LIMITE_PARTICIPANTES_PROBABILIDADE / 2) e as curvas são calculadas numa thread.
+    """
+    try:
+        intervalo = validar_consulta_simulacao(parametros, formato, detalhe, meses)
         
-        if parametros.mes_contemplacao <= 0:
-            raise HTTPException(status_code=400, detail="Mês de contemplação deve ser positivo")
+        prazo = parametros.prazo_meses
+        if prazo * 2 > LIMITE_PARTICIPANTES_PROBABILIDADE:
+            raise HTTPException(status_code=400, detail=f"Prazo deve ser no máximo {LIMITE_PARTICIPANTES_PROBABILIDADE // 2} meses")
         
         # Salvar input da simulação no banco de dados
-        try:
-            auth_header = request.headers.get("Authorization", "")
-            logger.info(f"🔑 AUTHORIZATION HEADER: '{auth_header}'")
-            
-            # 🔧 CORREÇÃO: Extração mais robusta do token
-            access_token = ""
-            if auth_header:
-                if auth_header.startswith("Bearer "):
-                    access_token = auth_header[7:]  # Remove "Bearer "
-                elif auth_header.startswith("bearer "):
-                    access_token = auth_header[7:]  # Remove "bearer "
-                else:
-                    access_token = auth_header  # Usar como está se não tem Bearer
-                
-            logger.info(f"🎯 ACCESS_TOKEN EXTRAÍDO: '{access_token}'")
-            
-            lead_id = None
-            access_token_usado = access_token if access_token else None  # Salvar token usado
+        await registrar_entrada_simulacao(parametros, request)
+        
+        def probabilidades_do_grupo():
+            hazards = TABELAS_SOBREVIVENCIA.obter(prazo * 2, prazo)
+            return (
+                gerar_dados_grafico_probabilidade(prazo, parametros.lance_livre_perc, hazards),
+                dados_resposta_probabilidades(
+                    calcular_probabilidades_contemplacao_corrigido(prazo * 2, parametros.lance_livre_perc, hazards),
+                    parametros.lance_livre_perc
+                )
+            )
+        
+        dados = await dados_simulacao(parametros, formato, detalhe, intervalo)
+        if not dados['erro']:
+            dados['grafico_probabilidade'], dados['probabilidades'] = await asyncio.to_thread(probabilidades_do_grupo)
+        
+        return RespostaJSONRapida(dados_no_formato(RespostaSimulacaoCompleta, dados))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na simulação completa: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+# Espera (s) depois de uma mensagem do canal ao vivo antes de calcular: mudanças de slider em rajada viram um cálculo só
+ESPERA_CANAL_SIMULACAO = 0.05
+
+# Contadores do canal ao vivo (lidos por /admin/canal-simulacao)
+ESTATISTICAS_CANAL_SIMULACAO = {'conexoes': 0, 'mensagens': 0, 'calculadas': 0, 'descartadas': 0, 'erros': 0}
+
+async def responder_mensagem_canal(texto: str) -> tuple:
+    """
+    Processa uma mensagem do canal ao vivo: {"id", "parametros", "formato"?, "detalhe"?, "meses"?}.
+    Retorna (parametros ou None se inválida, resposta a enviar).
+    """
+    id_mensagem = None
+    try:
+        mensagem = json.loads(texto)
+        id_mensagem = mensagem.get('id')
+        parametros = ParametrosConsorcio(**mensagem.get('parametros', {}))
+        formato, detalhe = mensagem.get('formato', 'linhas'), mensagem.get('detalhe', 'completo')
+        intervalo = validar_consulta_simulacao(parametros, formato, detalhe, mensagem.get('meses'))
+    except HTTPException as e:
+        return None, {'id': id_mensagem, 'tipo': 'erro', 'detail': e.detail}
+    except (ValueError, TypeError, AttributeError, ValidationError) as e:
+        return None, {'id': id_mensagem, 'tipo': 'erro', 'detail': f"Mensagem inválida: {str(e)}"}
+    
+    dados = await dados_simulacao(parametros, formato, detalhe, intervalo)
+    return parametros, {'id': id_mensagem, 'tipo': 'resultado', 'dados': dados}
+
+@api_router.websocket("/ws/simular")
+async def canal_simulacao_ao_vivo(websocket: WebSocket):
+    """
+    Canal de simulação ao vivo para telas com sliders.
+    
+    O cliente envia {"id", "parametros", "formato"?, "detalhe"?, "meses"?} a cada
+    mudança e recebe {"id", "tipo": "resultado", "dados"} (dados no esquema de
+    RespostaSimulacao) ou {"id", "tipo": "erro", "detail"}.
+    
+    Só os parâmetros mais recentes são calculados: mensagens que chegam durante a
+    espera (ESPERA_CANAL_SIMULACAO) ou durante um cálculo substituem as anteriores
+    ainda não calculadas. Todo resultado terminado é enviado com o id da sua
+    mensagem, mesmo que já haja outra na fila (num arraste contínuo a tela segue
+    sendo atualizada). O lead é identificado uma vez na conexão (header
+    Authorization ou ?token=); o input é salvo para cada simulação enviada.
+    Frames binários fecham o canal com o código 1003.
+    """
+    await websocket.accept()
+    ESTATISTICAS_CANAL_SIMULACAO['conexoes'] += 1
+    pendente = {'texto': None}
+    nova = asyncio.Event()
+    
+    async def receber():
+        while True:
+            mensagem = await websocket.receive()
+            if mensagem['type'] == 'websocket.disconnect':
+                return
+            if mensagem.get('text') is None:
+                await websocket.close(code=1003)  # Só aceita JSON em frames de texto
+                return
             
-            if access_token:
-                logger.info(f"🔍 Buscando lead com token: '{access_token}'")
-                lead = await db.leads.find_one({"access_token": access_token})
-                if lead:
-                    lead_id = lead["id"]
-                    logger.info(f"✅ Lead encontrado! ID: {lead_id}, Nome: {lead.get('name')}, Email: {lead.get('email')}")
-                else:
-                    logger.error(f"❌ Lead NÃO encontrado com token: '{access_token}'")
-                    # Debug: listar tokens disponíveis
-                    all_leads = await db.leads.find({}, {"access_token": 1, "name": 1, "email": 1}).limit(3).to_list(None)
-                    logger.info(f"🔍 Tokens disponíveis: {[{'token': l.get('access_token'), 'name': l.get('name')} for l in all_leads]}")
-            else:
-                logger.warning("⚠️ Nenhum access_token fornecido na simulação")
+            ESTATISTICAS_CANAL_SIMULACAO['mensagens'] += 1
+            if pendente['texto'] is not None:
+                # Substituída antes de ser calculada
+                ESTATISTICAS_CANAL_SIMULACAO['descartadas'] += 1
+            pendente['texto'] = mensagem['text']
+            nova.set()
+    
+    receptor = asyncio.create_task(receber())
+    try:
+        lead = await identificar_lead_simulacao(websocket)
+        
+        while True:
+            espera = asyncio.create_task(nova.wait())
+            await asyncio.wait({espera, receptor}, return_when=asyncio.FIRST_COMPLETED)
+            if receptor.done():
+                espera.cancel()
+                break  # Cliente desconectou (ou o canal foi fechado)
             
-            simulation_input = SimulationInput(
-                lead_id=lead_id,
-                access_token_usado=access_token_usado,  # 🔧 ADICIONAR: Salvar token usado para debug
-                valor_carta=parametros.valor_carta,
-                prazo_meses=parametros.prazo_meses,
-                taxa_admin=parametros.taxa_admin,
-                fundo_reserva=parametros.fundo_reserva,
-                mes_contemplacao=parametros.mes_contemplacao,
-                lance_livre_perc=parametros.lance_livre_perc,
-                taxa_reajuste_anual=parametros.taxa_reajuste_anual,
-                ip_address=request.client.host if request.client else None,
-                user_agent=request.headers.get("user-agent")
-            )
+            await asyncio.sleep(ESPERA_CANAL_SIMULACAO)
+            nova.clear()
+            texto, pendente['texto'] = pendente['texto'], None
             
-            # 🔧 DEBUG: Log antes de salvar
-            logger.info(f"📝 Dados da simulação ANTES de salvar:")
-            logger.info(f"   - ID: {simulation_input.id}")
-            logger.info(f"   - Lead_ID: {lead_id}")
-            logger.info(f"   - Access_token_usado: {access_token_usado}")
+            try:
+                parametros, resposta = await responder_mensagem_canal(texto)
+            except Exception as e:
+                logger.error(f"Erro no canal de simulação ao vivo: {e}")
+                ESTATISTICAS_CANAL_SIMULACAO['erros'] += 1
+                parametros, resposta = None, {'id': None, 'tipo': 'erro', 'detail': f"Erro interno do servidor: {str(e)}"}
             
-            await db.simulation_inputs.insert_one(simulation_input.dict())
-            logger.info(f"💾 Simulação salva COM SUCESSO: ID={simulation_input.id}, Lead_ID={lead_id}, Token={access_token}")
+            if receptor.done():
+                break
             
+            await websocket.send_text(orjson.dumps(resposta, option=orjson.OPT_SERIALIZE_NUMPY).decode())
+            if parametros is not None:
+                ESTATISTICAS_CANAL_SIMULACAO['calculadas'] += 1
+                await registrar_entrada_simulacao(parametros, websocket, lead)
+        
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receptor.cancel()
+
+@api_router.post("/simular-lote", response_model=RespostaSimulacaoLote)
+async def simular_consorcio_lote(lista_parametros: List[ParametrosConsorcio], request: Request):
+    """
+    Simula vários cenários (ex.: ofertas de administradoras diferentes) numa única chamada.
+    
+    Retorna um resultado no formato de /simular para cada item, na mesma ordem.
+    Itens inválidos (inclusive com prazo acima de LIMITE_PRAZO_LOTE) recebem
+    erro=True com a mensagem, sem interromper o lote. O cálculo roda numa thread.
+    """
+    try:
+        if not lista_parametros:
+            raise HTTPException(status_code=400, detail="Lote vazio")
+        
+        if len(lista_parametros) > LIMITE_SIMULACOES_LOTE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Lote excede o limite de {LIMITE_SIMULACOES_LOTE} simulações"
+            )
+        
+        erros_validacao = [
+            f"Prazo deve ser no máximo {LIMITE_PRAZO_LOTE} meses" if parametros.prazo_meses > LIMITE_PRAZO_LOTE
+            else validar_parametros_simulacao(parametros)
+            for parametros in lista_parametros
+        ]
+        validos = [i for i, erro in enumerate(erros_validacao) if erro is None]
+        
+        # Salvar inputs do lote no banco de dados (uma única escrita)
+        try:
+            if validos:
+                lead_id, access_token_usado = await identificar_lead_simulacao(request)
+                simulation_inputs = [
+                    criar_simulation_input(lista_parametros[i], request, lead_id, access_token_usado).dict()
+                    for i in validos
+                ]
+                await db.simulation_inputs.insert_many(simulation_inputs)
+                logger.info(f"💾 Lote de {len(simulation_inputs)} simulações salvo COM SUCESSO: Lead_ID={lead_id}")
         except Exception as e:
-            logger.error(f"❌ Erro ao salvar simulação: {e}")
-            import traceback
-            logger.error(f"📋 Traceback completo: {traceback.format_exc()}")
+            logger.error(f"❌ Erro ao salvar lote de simulações: {e}")
             # Não interrompe a simulação se houver erro no salvamento
         
-        # Criar simulador e executar
-        simulador = SimuladorConsorcio(parametros)
-        resultado = simulador.simular_cenario_completo()
+        resultados_validos = await asyncio.to_thread(
+            SimuladorConsorcio.simular_lote, [lista_parametros[i] for i in validos], incluir_detalhamento=False
+        )
+        
+        respostas = [RespostaSimulacao(erro=True, mensagem=erro) for erro in erros_validacao]
+        for i, resultado in zip(validos, resultados_validos):
+            try:
+                respostas[i] = montar_resposta_simulacao(resultado, lista_parametros[i])
+            except Exception as e:
+                logger.error(f"Erro na simulação {i} do lote: {e}")
+                respostas[i] = RespostaSimulacao(erro=True, mensagem=f"Erro interno na simulação: {str(e)}")
+        
+        total_erros = sum(1 for resposta in respostas if resposta.erro)
+        
+        return RespostaSimulacaoLote(
+            erro=total_erros == len(respostas),
+            total=len(respostas),
+            total_erros=total_erros,
+            resultados=respostas
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na simulação em lote: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+@api_router.post("/simular-meses-contemplacao", response_model=RespostaVarreduraContemplacao)
+async def simular_meses_contemplacao(parametros: ParametrosConsorcio):
+    """
+    Retorna CET, VPL e fluxo na contemplação para cada mês de contemplação possível
+    (1..prazo) numa única chamada - curva "CET x mês de contemplação".
+    O campo mes_contemplacao dos parâmetros é ignorado. Prazo até
+    LIMITE_PRAZO_VARREDURA; a varredura roda numa thread.
+    """
+    try:
+        if parametros.valor_carta <= 0:
+            raise HTTPException(status_code=400, detail="Valor da carta deve ser positivo")
+        
+        if parametros.prazo_meses <= 0:
+            raise HTTPException(status_code=400, detail="Prazo deve ser positivo")
+        
+        if parametros.prazo_meses > LIMITE_PRAZO_VARREDURA:
+            raise HTTPException(status_code=400, detail=f"Prazo deve ser no máximo {LIMITE_PRAZO_VARREDURA} meses")
+        
+        # mes_contemplacao é ignorado, mas o cronograma base o usa: qualquer valor válido serve
+        simulador = SimuladorConsorcio(parametros.model_copy(update={'mes_contemplacao': 1}))
+        resultado = await asyncio.to_thread(simulador.varrer_meses_contemplacao)
+        
+        if resultado['erro']:
+            return RespostaVarreduraContemplacao(
+                erro=True,
+                mensagem=resultado.get('mensagem', 'Erro desconhecido na simulação')
+            )
+        
+        return RespostaVarreduraContemplacao(**{**resultado, 'parametros': parametros})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na varredura de meses de contemplação: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+@api_router.post("/simular-incremental", response_model=RespostaSimulacaoIncremental)
+async def simular_consorcio_incremental(requisicao: RequisicaoSimulacaoIncremental, request: Request,
+                                        background_tasks: BackgroundTasks):
+    """
+    Simulação com sessão, para ajustes interativos (mesma resposta de /simular).
+    
+    Sem sessao_id (ou com sessão expirada) abre uma sessão a partir de 'parametros'.
+    Com sessão, aplica 'parametros' e/ou 'alteracoes' sobre a última simulação:
+    mudanças só em mes_contemplacao/lance_livre_perc são aplicadas de forma
+    incremental (ver SessaoSimulacao). O input é salvo no banco só quando a
+    simulação completa é refeita.
+    
+    Com vários workers, uma sessão aberta em outro processo é reaberta a partir
+    dos parâmetros gravados no Mongo (ver reabrir_sessao_simulacao): a primeira
+    chamada nesse worker refaz a simulação completa, as seguintes são incrementais.
+    Os parâmetros vão para o Mongo em segundo plano, só quando a sessão é aberta
+    ou eles mudam.
+    """
+    try:
+        sessao = await reabrir_sessao_simulacao(requisicao.sessao_id)
+        
+        if sessao is None and requisicao.parametros is None:
+            raise HTTPException(status_code=404, detail="Sessão de simulação não encontrada ou expirada")
+        
+        campos_invalidos = set(requisicao.alteracoes.model_extra or {})
+        if campos_invalidos:
+            raise HTTPException(status_code=400, detail=f"Campos desconhecidos em alteracoes: {', '.join(sorted(campos_invalidos))}")
         
-        if resultado['erro']:
-            return RespostaSimulacao(
-                erro=True,
-                mensagem=resultado.get('mensagem', 'Erro desconhecido na simulação')
-            )
+        parametros_base = requisicao.parametros or sessao.simulador.params
+        alteracoes = requisicao.alteracoes.model_dump(exclude_unset=True, exclude_none=True)
+        parametros = parametros_base.model_copy(update=alteracoes)
         
-        # Calcular probabilidades específicas do mês de contemplação escolhido
-        # NOVA LÓGICA: participantes = 2 × prazo_meses (1 sorteio + 1 lance sempre)
-        num_participantes_padrao = parametros.prazo_meses * 2
-        contemplados_por_mes_padrao = 2  # Sempre 2 (1 sorteio + 1 lance)
+        erro_validacao = validar_parametros_simulacao(parametros)
+        if erro_validacao:
+            raise HTTPException(status_code=400, detail=erro_validacao)
         
-        # 🎯 CORREÇÃO: Ajustar contemplados_por_mes baseado no lance_livre_perc
-        if parametros.lance_livre_perc == 0:
-            # Cliente NÃO dará lance - apenas 1 contemplado por mês (só sorteio)
-            contemplados_mes_ajustado = 1
-            logger.info(f"🎯 CORREÇÃO: lance_livre_perc=0, usando contemplados_por_mes=1 (só sorteio)")
-        else:
-            # Cliente DARÁ lance - 2 contemplados por mês (sorteio + lance)
-            contemplados_mes_ajustado = contemplados_por_mes_padrao
-            logger.info(f"🎯 CORREÇÃO: lance_livre_perc={parametros.lance_livre_perc}, usando contemplados_por_mes=2 (sorteio+lance)")
-            
-        prob_mes = calcular_probabilidade_mes_especifico(
-            mes_contemplacao=parametros.mes_contemplacao,
-            lance_livre_perc=parametros.lance_livre_perc,
-            num_participantes=num_participantes_padrao,
-            contemplados_por_mes=contemplados_mes_ajustado  # ← Usa valor ajustado
-        )
+        nova = sessao is None
+        if nova:
+            sessao = await asyncio.to_thread(SessaoSimulacao, parametros)
+            registrar_sessao_simulacao(sessao)
         
-        # Adicionar probabilidades ao resumo financeiro
-        if prob_mes:
-            # Verificar se os valores são válidos (não NaN ou infinito)
-            prob_no_mes = prob_mes['prob_no_mes']
-            prob_ate_mes = prob_mes['prob_ate_mes']
-            participantes_restantes = prob_mes['participantes_restantes']
+        # Simulação em thread; a trava impede duas atualizações da mesma sessão ao mesmo tempo
+        async with sessao.trava:
+            mudou = nova or parametros != sessao.simulador.params
+            modo = 'completo' if nova else await asyncio.to_thread(sessao.atualizar, parametros)
             
-            # Sanitizar valores
-            if not np.isfinite(prob_no_mes):
-                prob_no_mes = 0.0
-            if not np.isfinite(prob_ate_mes):
-                prob_ate_mes = 0.0
-                
-            resultado['resumo_financeiro']['prob_contemplacao_no_mes'] = float(prob_no_mes)
-            resultado['resumo_financeiro']['prob_contemplacao_ate_mes'] = float(prob_ate_mes)
-            resultado['resumo_financeiro']['participantes_restantes_mes'] = int(participantes_restantes)
-        else:
-            resultado['resumo_financeiro']['prob_contemplacao_no_mes'] = 0.0
-            resultado['resumo_financeiro']['prob_contemplacao_ate_mes'] = 0.0
-            resultado['resumo_financeiro']['participantes_restantes_mes'] = 0
-        
-        # Converter detalhamento para o modelo Pydantic
-        detalhamento_convertido = []
-        for item in resultado['detalhamento']:
-            detalhamento_convertido.append(DetalhamentoMes(**item))
-        
-        return RespostaSimulacao(
-            erro=False,
-            parametros=ParametrosConsorcio(**resultado['parametros']),
-            resultados=ResultadosSimulacao(**resultado['resultados']),
-            fluxos=resultado['fluxos'],
-            detalhamento=detalhamento_convertido,
-            resumo_financeiro=ResumoFinanceiro(**resultado['resumo_financeiro'])
+            resultado = dict(sessao.resultado, detalhamento=sessao.detalhamento)
+            resposta = montar_resposta_simulacao(resultado, parametros)
+            if not resposta.erro and sessao.cet_esperado:
+                resposta.cet_esperado = CETEsperado(**sessao.cet_esperado)
+            meses_alterados = sessao.meses_alterados
+        
+        # Mongo e registro do input fora do caminho da resposta
+        if mudou:
+            background_tasks.add_task(salvar_sessao_simulacao_mongo, sessao.id, parametros, sessao.atualizado_em)
+        if modo == 'completo':
+            background_tasks.add_task(registrar_entrada_simulacao, parametros, request)
+        
+        return RespostaSimulacaoIncremental(
+            **dict(resposta),
+            sessao_id=sessao.id,
+            modo=modo,
+            meses_alterados=meses_alterados
         )
-        
+    
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erro na simulação: {e}")
+        logger.error(f"Erro na simulação incremental: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
 @api_router.post("/save-lead")
@@ -934,22 +3381,21 @@ async def get_saldo_devedor_detalhes():
             taxa_reajuste_anual=0.05
         )
         
-        simulador = SimuladorConsorcio(parametros)
-        resultado = simulador.simular_cenario_completo()
+        resultado, _ = await obter_resultado_simulacao(parametros)
         
         if resultado['erro']:
             return {"erro": True, "mensagem": resultado.get('mensagem', 'Erro na simulação')}
         
-        # Extrair informações específicas do saldo devedor
-        detalhamento = resultado['detalhamento']
+        # Extrair informações específicas do saldo devedor (só as linhas usadas)
+        cronograma = resultado['cronograma']
         
         # Pontos chave para análise
         pontos_chave = []
         meses_importantes = [1, 12, 13, 24, 25, 36, 37, 60, 119, 120]
         
         for mes in meses_importantes:
-            if mes <= len(detalhamento):
-                item = detalhamento[mes-1]
+            if mes <= cronograma.prazo:
+                item = cronograma.detalhamento(mes, mes)[0]
                 ponto = {
                     "mes": mes,
                     "ano": item['ano'],
@@ -985,7 +3431,7 @@ async def get_saldo_devedor_detalhes():
                 "saldo_inicial_teorico": base_contrato,
                 "saldo_inicial_pos_primeira_parcela": pontos_chave[0]["saldo_devedor"] if pontos_chave else 0,
                 "saldo_final": pontos_chave[-1]["saldo_devedor"] if pontos_chave else 0,
-                "total_meses": len(detalhamento)
+                "total_meses": cronograma.prazo
             }
         }
         
@@ -1013,6 +3459,36 @@ async def get_simulations():
         logger.error(f"Erro ao buscar simulações: {e}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
+@api_router.get("/admin/cache-simulacao")
+async def get_cache_simulacao():
+    """Estatísticas do cache de resultados de simulação (acertos, faltas, remoções) (admin)"""
+    return {
+        **CACHE_RESULTADOS_SIMULACAO.estatisticas(),
+        'mongo': CACHE_SIMULACAO_MONGO.estatisticas(),
+        'tabelas_sobrevivencia': TABELAS_SOBREVIVENCIA.estatisticas(),
+        'disputa_lance': CACHE_DISPUTA_LANCE.estatisticas()
+    }
+
+@api_router.get("/admin/canal-simulacao")
+async def get_canal_simulacao():
+    """Contadores do canal de simulação ao vivo (mensagens, calculadas, descartadas) (admin)"""
+    return ESTATISTICAS_CANAL_SIMULACAO
+
+@api_router.get("/admin/coalescencia")
+async def get_coalescencia():
+    """Estatísticas da coalescência de chamadas simultâneas (cálculos economizados por grupo) (admin)"""
+    return COALESCEDOR_CHAMADAS.estatisticas()
+
+@api_router.get("/admin/compressao")
+async def get_compressao():
+    """Estatísticas da compressão de respostas (razão e tempo de CPU por codificação) (admin)"""
+    return ESTATISTICAS_COMPRESSAO.estatisticas()
+
+@api_router.get("/admin/indice-cet")
+async def get_indice_cet():
+    """Estatísticas do índice de raízes de CET (acertos e iterações economizadas) (admin)"""
+    return INDICE_RAIZES_CET.estatisticas()
+
 @api_router.get("/parametros-padrao")
 async def get_parametros_padrao():
     """Retorna os parâmetros padrão para simulação."""
@@ -1030,7 +3506,7 @@ async def get_grafico_probabilidades(prazo_meses: int, lance_livre_perc: float =
         if dados_grafico is None:
             raise HTTPException(status_code=500, detail="Erro ao gerar dados do gráfico")
         
-        return dados_grafico
+        return RespostaJSONRapida(dados_grafico)
         
     except HTTPException:
         raise
@@ -1038,6 +3514,30 @@ async def get_grafico_probabilidades(prazo_meses: int, lance_livre_perc: float =
         logger.error(f"Erro no endpoint de gráfico de probabilidades: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+def dados_resposta_probabilidades(resultado: Optional[Dict], lance_livre_perc: float) -> Dict:
+    """Resposta de /calcular-probabilidades (esquema de RespostaProbabilidades) como dicts simples."""
+    if resultado is None:
+        return dados_no_formato(RespostaProbabilidades, {
+            'erro': True,
+            'mensagem': "Erro no cálculo de probabilidades"
+        })
+    
+    # 🎯 CORREÇÃO: Retornar apenas curva apropriada baseada no lance_livre_perc
+    if lance_livre_perc == 0:
+        # Cliente NÃO dará lance - mostrar apenas probabilidades "sem lance"
+        logger.info(f"🎯 CORREÇÃO APLICADA: lance_livre_perc=0, retornando apenas curva 'sem_lance'")
+        com_lance = None  # ← NÃO retorna curva "com lance"
+    else:
+        # Cliente DARÁ lance - mostrar ambas as curvas para comparação
+        com_lance = dados_no_formato(CurvasProbabilidade, resultado["com_lance"])
+    
+    return dados_no_formato(RespostaProbabilidades, {
+        'erro': False,
+        'sem_lance': dados_no_formato(CurvasProbabilidade, resultado["sem_lance"]),
+        'com_lance': com_lance,
+        'parametros': resultado["parametros"]
+    })
+
 @api_router.post("/calcular-probabilidades", response_model=RespostaProbabilidades)
 async def calcular_probabilidades(parametros: ParametrosProbabilidade):
     """Calcula probabilidades de contemplação para o consórcio."""
@@ -1046,96 +3546,130 @@ async def calcular_probabilidades(parametros: ParametrosProbabilidade):
         if parametros.num_participantes <= 0:
             raise HTTPException(status_code=400, detail="Número de participantes deve ser positivo")
         
+        if parametros.num_participantes > LIMITE_PARTICIPANTES_PROBABILIDADE:
+            raise HTTPException(status_code=400, detail=f"Número de participantes deve ser no máximo {LIMITE_PARTICIPANTES_PROBABILIDADE}")
+        
         if parametros.lance_livre_perc < 0:
             raise HTTPException(status_code=400, detail="Lance livre deve ser >= 0")
         
-        # Calcular probabilidades
-        resultado = calcular_probabilidades_contemplacao_corrigido(
-            num_participantes=parametros.num_participantes,
-            lance_livre_perc=parametros.lance_livre_perc
+        if parametros.pontos_curva is not None and parametros.pontos_curva < 2:
+            raise HTTPException(status_code=400, detail="Pontos da curva deve ser >= 2")
+        
+        # Calcular probabilidades (numa thread; chamadas simultâneas iguais esperam um único cálculo)
+        resultado = await COALESCEDOR_CHAMADAS.executar(
+            ('probabilidades', parametros.num_participantes, parametros.lance_livre_perc, parametros.pontos_curva),
+            asyncio.to_thread, calcular_probabilidades_contemplacao_corrigido,
+            parametros.num_participantes, parametros.lance_livre_perc, None, parametros.pontos_curva
         )
         
-        if resultado is None:
-            return RespostaProbabilidades(
-                erro=True,
-                mensagem="Erro no cálculo de probabilidades"
-            )
+        # Caminho rápido: mesmo esquema de RespostaProbabilidades, sem validação
+        return RespostaJSONRapida(dados_resposta_probabilidades(resultado, parametros.lance_livre_perc))
         
-        # 🎯 CORREÇÃO: Retornar apenas curva apropriada baseada no lance_livre_perc
-        if parametros.lance_livre_perc == 0:
-            # Cliente NÃO dará lance - mostrar apenas probabilidades "sem lance"
-            logger.info(f"🎯 CORREÇÃO APLICADA: lance_livre_perc=0, retornando apenas curva 'sem_lance'")
-            return RespostaProbabilidades(
-                erro=False,
-                sem_lance=CurvasProbabilidade(**resultado["sem_lance"]),
-                com_lance=None,  # ← NÃO retorna curva "com lance"
-                parametros=resultado["parametros"]
-            )
-        else:
-            # Cliente DARÁ lance - mostrar ambas as curvas para comparação
-            return RespostaProbabilidades(
-                erro=False,
-                sem_lance=CurvasProbabilidade(**resultado["sem_lance"]),
-                com_lance=CurvasProbabilidade(**resultado["com_lance"]),
-                parametros=resultado["parametros"]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no endpoint de probabilidades: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+
+@api_router.post("/probabilidade-lance", response_model=RespostaDisputaLance)
+async def calcular_probabilidade_lance(parametros: ParametrosDisputaLance):
+    """
+    Probabilidade de o lance_livre_perc vencer a disputa de lance em cada mês, com os
+    lances dos concorrentes simulados por Monte Carlo (ver simular_disputa_lance),
+    e as curvas de contemplação sem lance / com lance resultantes.
+    """
+    try:
+        erro = validar_disputa_lance(parametros)
+        if erro:
+            raise HTTPException(status_code=400, detail=erro)
+        
+        # Numa thread; chamadas simultâneas iguais esperam uma única simulação
+        resultado = await COALESCEDOR_CHAMADAS.executar(
+            ('disputa_lance', CacheDisputaLance.chave(parametros), parametros.pontos_curva),
+            asyncio.to_thread, calcular_probabilidades_disputa_lance, parametros
+        )
+        
+        return RespostaJSONRapida(dados_no_formato(RespostaDisputaLance, resultado))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no endpoint de probabilidade de lance: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+
+@api_router.post("/probabilidades-cronograma", response_model=RespostaProbabilidadesCronograma)
+async def calcular_probabilidades_cronograma(cronograma: CronogramaAssembleias):
+    """
+    Probabilidades de contemplação de um grupo com cronograma real de assembleias
+    (sorteios e lances variáveis por mês, desistências e reativações), em vez de
+    2 contemplações fixas por mês. A curva com lance só vem se 'lances' for informado.
+    """
+    try:
+        resultado = (await asyncio.to_thread(calcular_probabilidades_cronogramas, [cronograma]))[0]
+        if resultado['erro']:
+            raise HTTPException(status_code=400, detail=resultado['mensagem'])
+        
+        return RespostaJSONRapida(dados_no_formato(RespostaProbabilidadesCronograma, resultado))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no endpoint de probabilidades por cronograma: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+
+@api_router.post("/probabilidades-cronograma-lote", response_model=RespostaProbabilidadesCronogramaLote)
+async def calcular_probabilidades_cronograma_lote(cronogramas: List[CronogramaAssembleias]):
+    """
+    Compara vários grupos (ex.: administradoras diferentes) numa única passada vetorizada.
+    
+    Retorna um resultado no formato de /probabilidades-cronograma para cada item, na
+    mesma ordem. Itens inválidos recebem erro=True com a mensagem, sem interromper o lote.
+    """
+    try:
+        if not cronogramas:
+            raise HTTPException(status_code=400, detail="Lote vazio")
+        
+        if len(cronogramas) > LIMITE_CRONOGRAMAS_LOTE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Lote excede o limite de {LIMITE_CRONOGRAMAS_LOTE} cronogramas"
             )
         
+        resultados = await asyncio.to_thread(calcular_probabilidades_cronogramas, cronogramas)
+        total_erros = sum(1 for resultado in resultados if resultado['erro'])
+        
+        return RespostaJSONRapida(dados_no_formato(RespostaProbabilidadesCronogramaLote, {
+            'erro': total_erros == len(resultados),
+            'total': len(resultados),
+            'total_erros': total_erros,
+            'resultados': [dados_no_formato(RespostaProbabilidadesCronograma, resultado) for resultado in resultados]
+        }))
+        
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erro no endpoint de probabilidades: {e}")
+        logger.error(f"Erro no endpoint de probabilidades por cronograma em lote: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
 
 def criar_grafico_probabilidades(num_participantes: int, lance_livre_perc: float, temp_dir: str) -> str:
     """Cria gráfico de probabilidades de contemplação."""
     try:
-        # Calcular probabilidades usando a lógica corrigida da planilha
+        # Calcular probabilidades usando a lógica corrigida da planilha (ver hazards_contemplacao):
+        # sem lance 1/(N - 2t + 1) - só compete no sorteio; com lance 2/(N - 2(t-1)) - sorteio E lance
         N0 = num_participantes
         
-        meses_total = int(np.ceil(N0 / 2))
-        
-        # Listas para dados
-        meses = []
-        hazard_sem = []
-        hazard_com = []
-        prob_acum_sem = []
-        prob_acum_com = []
+        meses_total = int(np.ceil(N0 / 2))  # TODOS os meses até o final
+        hazards = hazards_contemplacao(N0, meses_total)
         
-        # Inicializar - ambos os cenários usam a mesma redução (2 por mês)
-        n_atual = N0
-        S_sem = 1.0  # Sobrevivência sem lance
-        S_com = 1.0  # Sobrevivência com lance
-        
-        for mes in range(1, meses_total + 1):  # TODOS os meses até o final
-            meses.append(mes)
-            
-            if n_atual > 0:
-                # LÓGICA CORRIGIDA baseada na planilha:
-                # Hazard sem lance: 1/(N-1) - só compete no sorteio
-                h_sem = 1.0 / max(1, n_atual - 1)
-                
-                # Hazard com lance: 2/N - compete no sorteio E no lance
-                h_com = min(2.0 / n_atual, 1.0)
-            else:
-                h_sem = 0
-                h_com = 0
-            
-            hazard_sem.append(h_sem * 100)  # Em %
-            hazard_com.append(h_com * 100)  # Em %
-            
-            # Atualizar sobrevivência e probabilidade acumulada
-            S_sem *= (1 - h_sem)
-            S_com *= (1 - h_com)
-            
-            prob_acum_sem.append((1 - S_sem) * 100)  # F_t em %
-            prob_acum_com.append((1 - S_com) * 100)  # F_t em %
-            
-            # Reduzir participantes (sempre 2: 1 sorteio + 1 lance)
-            n_atual = max(0, n_atual - 2)
+        meses = list(range(1, meses_total + 1))
+        hazard_sem = (hazards['h_sem'] * 100).tolist()  # Em %
+        hazard_com = (hazards['h_com'] * 100).tolist()  # Em %
         
-        # Criar gráfico
-        fig, ax1 = plt.subplots(figsize=(12, 6))
+        # Criar gráfico (figura própria, sem pyplot: seguro em várias threads)
+        fig = Figure(figsize=(12, 6))
+        FigureCanvasAgg(fig)
+        ax1 = fig.add_subplot()
         
         # Apenas Hazard (probabilidade do mês) - sem linhas tracejadas
         ax1.plot(meses, hazard_com, label="Com Lance — hazard", lw=2, color='#BC8159')
@@ -1148,12 +3682,11 @@ def criar_grafico_probabilidades(num_participantes: int, lance_livre_perc: float
         # Apenas uma legenda para as linhas de hazard
         ax1.legend(loc='upper left')
         
-        plt.title(f"Probabilidade de Contemplação — {N0} Participantes\n(hazard do mês)")
-        plt.tight_layout()
+        ax1.set_title(f"Probabilidade de Contemplação — {N0} Participantes\n(hazard do mês)")
+        fig.tight_layout()
         
         grafico_path = os.path.join(temp_dir, 'grafico_probabilidades.png')
-        plt.savefig(grafico_path, dpi=300, bbox_inches='tight')
-        plt.close()
+        fig.savefig(grafico_path, dpi=300, bbox_inches='tight')
         
         return grafico_path
     except Exception as e:
@@ -1161,7 +3694,7 @@ def criar_grafico_probabilidades(num_participantes: int, lance_livre_perc: float
         return None
 
 def gerar_dados_grafico_fluxo_caixa(detalhamento: List[Dict]) -> Dict:
-    """Gera dados do gráfico de fluxo de caixa para o frontend."""
+    """Gera dados do gráfico de fluxo de caixa para o frontend (valores do detalhamento já em centavos exatos)."""
     try:
         # Usar os primeiros 24 meses para o gráfico
         meses_grafico = min(24, len(detalhamento))
@@ -1174,9 +3707,9 @@ def gerar_dados_grafico_fluxo_caixa(detalhamento: List[Dict]) -> Dict:
         for i in range(meses_grafico):
             mes_data = detalhamento[i]
             labels.append(f"Mês {mes_data['mes']}")
-            parcelas_antes.append(round(mes_data['parcela_antes'], 2))
-            parcelas_depois.append(round(mes_data['parcela_depois'], 2))
-            saldo_devedor.append(round(mes_data['saldo_devedor'], 2))
+            parcelas_antes.append(mes_data['parcela_antes'])
+            parcelas_depois.append(mes_data['parcela_depois'])
+            saldo_devedor.append(mes_data['saldo_devedor'])
         
         return {
             "labels": labels,
@@ -1205,7 +3738,7 @@ def gerar_dados_grafico_fluxo_caixa(detalhamento: List[Dict]) -> Dict:
         return None
 
 def gerar_dados_grafico_saldo_devedor(detalhamento: List[Dict]) -> Dict:
-    """Gera dados do gráfico de saldo devedor para o frontend."""
+    """Gera dados do gráfico de saldo devedor para o frontend (valores do detalhamento já em centavos exatos)."""
     try:
         # Usar todos os meses mas limitar visual a 60 para performance
         meses_grafico = min(60, len(detalhamento))
@@ -1216,7 +3749,7 @@ def gerar_dados_grafico_saldo_devedor(detalhamento: List[Dict]) -> Dict:
         for i in range(meses_grafico):
             mes_data = detalhamento[i]
             labels.append(f"Mês {mes_data['mes']}")
-            saldo_valores.append(round(mes_data['saldo_devedor'], 2))
+            saldo_valores.append(mes_data['saldo_devedor'])
         
         return {
             "labels": labels,
@@ -1236,48 +3769,27 @@ def gerar_dados_grafico_saldo_devedor(detalhamento: List[Dict]) -> Dict:
         logger.error(f"Erro ao gerar dados do gráfico de saldo devedor: {e}")
         return None
 
-def gerar_dados_grafico_probabilidade(prazo_meses: int, lance_livre_perc: float) -> Dict:
-    """Gera dados do gráfico de probabilidade para o frontend."""
+def gerar_dados_grafico_probabilidade(prazo_meses: int, lance_livre_perc: float,
+                                      hazards: Optional[Dict] = None) -> Dict:
+    """
+    Gera dados do gráfico de probabilidade para o frontend.
+    
+    'hazards' são os de TABELAS_SOBREVIVENCIA.obter(2 × prazo, prazo), se já obtidos.
+    """
     try:
-        # Usar lógica similar ao PDF - participantes = 2 × prazo
-        num_participantes = prazo_meses * 2
-        N0 = num_participantes
-        
-        # Usar o prazo completo para o gráfico (até 120 meses conforme solicitado)
-        meses_total = min(prazo_meses, int(np.ceil(N0 / 2)))
-        
-        # Listas para dados
-        meses = []
-        hazard_sem = []
-        hazard_com = []
+        # Usar lógica similar ao PDF - participantes = 2 × prazo, prazo completo no gráfico
+        if hazards is None:
+            hazards = TABELAS_SOBREVIVENCIA.obter(prazo_meses * 2, prazo_meses)
         
-        # Inicializar
-        n_atual = N0
+        # Labels só com números (não "Mês 1, Mês 2...")
+        meses = list(range(1, prazo_meses + 1))
         
-        for mes in range(1, meses_total + 1):
-            # Labels só com números (não "Mês 1, Mês 2...")
-            meses.append(mes)
-            
-            if n_atual > 0:
-                # Hazard sem lance: 1/(N-1) - só compete no sorteio
-                h_sem = 1.0 / max(1, n_atual - 1)
-                
-                # Hazard com lance: depende do percentual de lance livre
-                if lance_livre_perc > 0:
-                    # Se há lance livre, 2/N - compete no sorteio E no lance
-                    h_com = min(2.0 / n_atual, 1.0)
-                else:
-                    # Se não há lance livre (0%), é igual ao sem lance
-                    h_com = h_sem
-            else:
-                h_sem = 0
-                h_com = 0
-            
-            hazard_sem.append(round(h_sem * 100, 2))  # Em %
-            hazard_com.append(round(h_com * 100, 2))  # Em %
-            
-            # Reduzir participantes (2 por mês)
-            n_atual = max(0, n_atual - 2)
+        # Hazard sem lance: 1/(N - 2t + 1) - só compete no sorteio
+        # Hazard com lance: 2/(N - 2(t-1)) - compete no sorteio E no lance;
+        # se não há lance livre (0%), é igual ao sem lance
+        h_com = hazards['h_com'] if lance_livre_perc > 0 else hazards['h_sem']
+        hazard_sem = [round(h * 100, 2) for h in hazards['h_sem'].tolist()]  # Em %
+        hazard_com = [round(h * 100, 2) for h in h_com.tolist()]  # Em %
         
         # Retornar formato compatível com Chart.js
         return {
@@ -1423,20 +3935,16 @@ def gerar_relatorio_pdf(dados_simulacao: Dict, temp_dir: str) -> str:
         
         tabela_data = [['Mês', 'Data', 'Parcela', 'Valor da Carta', 'Fluxo de Caixa', 'Saldo Devedor']]
         
-        # Criar lista filtrada: primeiros 24 + anuais
-        detalhamento_filtrado = []
-        detalhamento_completo = dados_simulacao['detalhamento']
+        # Criar lista filtrada: primeiros 24 + anuais (só essas linhas são montadas)
+        prazo = dados_simulacao['parametros']['prazo_meses']
         
         # Primeiros 24 meses
-        for i in range(min(24, len(detalhamento_completo))):
-            detalhamento_filtrado.append(detalhamento_completo[i])
+        meses_filtrados = list(range(1, min(24, prazo) + 1))
         
         # Meses anuais (36, 48, 60, 72, etc.)
-        if len(detalhamento_completo) > 24:
-            for mes in range(36, len(detalhamento_completo) + 1, 12):
-                index = mes - 1  # Convert to 0-based index
-                if index < len(detalhamento_completo):
-                    detalhamento_filtrado.append(detalhamento_completo[index])
+        meses_filtrados += list(range(36, prazo + 1, 12))
+        
+        detalhamento_filtrado = linhas_detalhamento(dados_simulacao, meses_filtrados)
         
         for item in detalhamento_filtrado:
             mes = str(item['mes'])
@@ -1490,22 +3998,26 @@ def gerar_relatorio_pdf(dados_simulacao: Dict, temp_dir: str) -> str:
         logger.error(f"Erro ao gerar PDF: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório PDF: {str(e)}")
 
+async def gerar_relatorio_pdf_em_segundo_plano(resultado: Dict) -> str:
+    """gerar_relatorio_pdf num diretório temporário novo, no EXECUTOR_PDF. Retorna o caminho do arquivo."""
+    # Criar diretório temporário
+    temp_dir = tempfile.mkdtemp()
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR_PDF, gerar_relatorio_pdf, resultado, temp_dir)
+
 @api_router.post("/gerar-relatorio-pdf")
 async def gerar_relatorio_pdf_endpoint(parametros: ParametrosConsorcio):
     """Gera e retorna relatório PDF da simulação."""
     try:
-        # Executar simulação
-        simulador = SimuladorConsorcio(parametros)
-        resultado = simulador.simular_cenario_completo()
+        # Executar simulação (em geral já está no cache pela chamada de /simular)
+        resultado, _ = await obter_resultado_simulacao(parametros)
         
         if resultado['erro']:
             raise HTTPException(status_code=400, detail=resultado.get('mensagem', 'Erro na simulação'))
         
-        # Criar diretório temporário
-        temp_dir = tempfile.mkdtemp()
-        
-        # Gerar PDF
-        pdf_path = gerar_relatorio_pdf(resultado, temp_dir)
+        # Gerar PDF (pedidos simultâneos com os mesmos parâmetros recebem o mesmo arquivo)
+        pdf_path = await COALESCEDOR_CHAMADAS.executar(
+            ('pdf', CacheResultadosSimulacao.chave(parametros)), gerar_relatorio_pdf_em_segundo_plano, resultado
+        )
         
         if not os.path.exists(pdf_path):
             raise HTTPException(status_code=500, detail="Erro ao gerar arquivo PDF")
@@ -1526,6 +4038,15 @@ async def gerar_relatorio_pdf_endpoint(parametros: ParametrosConsorcio):
         logger.error(f"Erro no endpoint de PDF: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+# Compressão das respostas grandes (cronogramas, curvas); o PDF já é comprimido e sai por FileResponse
+app.add_middleware(
+    MiddlewareCompressao,
+    estatisticas=ESTATISTICAS_COMPRESSAO,
+    minimo_bytes=int(os.environ.get('COMPRESSAO_MINIMO_BYTES', '1024')),
+    minimo_bytes_thread=int(os.environ.get('COMPRESSAO_MINIMO_BYTES_THREAD', str(64 * 1024))),
+    rotas_excluidas={'/api/gerar-relatorio-pdf'},
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2012,17 +4533,19 @@ async def login(credentials: dict, request: Request):
 
 def _as_float_array(x):
     """Converte para array numpy float."""
-    a = np.asarray(list(x), dtype=float)
+    a = np.asarray(x if isinstance(x, np.ndarray) else list(x), dtype=float)
     if a.ndim != 1:
         raise ValueError("Forneça vetores 1D.")
     return a
 
+# Folga de arredondamento na busca de percentis: limiares exatos (ex.: F = 0,5 no mês N/4)
+# não devem escorregar um mês por causa do último bit da soma em espaço log.
+TOLERANCIA_PERCENTIL = 1e-9
+
 def _percentile_month(F, p):
-    """Primeiro mês (1-index) em que F_t ≥ p. Retorna None se não atingir."""
-    idx = np.argmax(F >= p)
-    if F[-1] < p:
-        return None
-    return int(np.where(F >= p)[0][0] + 1)
+    """Primeiro mês (1-index) em que F_t ≥ p, com F não decrescente. Retorna None se não atingir."""
+    indice = int(np.searchsorted(F, p - TOLERANCIA_PERCENTIL, side='left'))
+    return indice + 1 if indice < len(F) else None
 
 def hazards_from_counts(participantes_restantes, sorteio, lance=None):
     """Calcula hazards (prob. condicionais) a partir de CONTAGENS mensais."""
@@ -2041,36 +4564,313 @@ def hazards_from_counts(participantes_restantes, sorteio, lance=None):
 
     return {"h_sem": h_sem, "h_com": h_com}
 
+def hazards_contemplacao(num_participantes: int, meses_total: int) -> Dict:
+    """
+    Hazards mensais sem/com lance (mesmas fórmulas de calcular_probabilidades_contemplacao_corrigido)
+    em forma vetorial:
+    - SEM LANCE: h_t = 1/(N - 2*t + 1)
+    - COM LANCE: h_t = 2/(N - 2*(t-1))
+    """
+    N = num_participantes
+    t = np.arange(1, meses_total + 1, dtype=float)
+    
+    S_t = N - 2*t + 1
+    h_sem = np.divide(1.0, S_t, out=np.ones_like(t), where=S_t > 0)
+    
+    N_t = N - 2*(t - 1)
+    h_com = np.minimum(np.divide(2.0, N_t, out=np.ones_like(t), where=N_t > 0), 1.0)
+    
+    return {"h_sem": h_sem, "h_com": h_com}
+
+class TabelasSobrevivencia:
+    """
+    Tabelas por número de participantes com os hazards de hazards_contemplacao e
+    as probabilidades acumuladas F_t = 1 - Π(1 - h), num LRU limitado. Com elas
+    a probabilidade no mês / até o mês de qualquer mês é uma consulta direta, sem
+    refazer o produtório a cada requisição, e os hazards de um mesmo grupo são
+    calculados uma vez para todos os endpoints.
+    
+    Cada tabela cobre pelo menos N/2 meses (a duração do grupo) e é recalculada
+    mais longa se pedirem além disso. Os arrays são somente leitura. O limite é
+    em bytes: um grupo de 100 mil participantes ocupa ~1,6 MB.
+    """
+    
+    def __init__(self, limite_bytes: int = 32 * 1024 * 1024):
+        self.limite_bytes = limite_bytes
+        self.bytes = 0
+        self.tabelas = OrderedDict()  # num_participantes -> {'h_sem', 'h_com', 'F_sem', 'F_com'}
+        self.trava = threading.Lock()  # Também usada pelas threads de /calcular-probabilidades
+        self.acertos = 0
+        self.faltas = 0
+    
+    @staticmethod
+    def calcular(num_participantes: int, meses_total: int) -> Dict:
+        tabela = hazards_contemplacao(num_participantes, meses_total)
+        tabela['F_sem'] = -np.expm1(log_sobrevivencia(tabela['h_sem']))
+        tabela['F_com'] = -np.expm1(log_sobrevivencia(tabela['h_com']))
+        for coluna in tabela.values():
+            coluna.flags.writeable = False
+        return tabela
+    
+    @staticmethod
+    def tamanho(tabela: Dict) -> int:
+        return sum(coluna.nbytes for coluna in tabela.values())
+    
+    def obter(self, num_participantes: int, meses_total: int) -> Dict:
+        """h_sem, h_com, F_sem e F_com dos meses 1..meses_total (visões da tabela em cache)."""
+        meses_total = max(int(meses_total), 0)
+        with self.trava:
+            tabela = self.tabelas.get(num_participantes)
+            if tabela is None or len(tabela['h_sem']) < meses_total:
+                self.faltas += 1
+                if tabela is not None:
+                    self.bytes -= self.tamanho(tabela)
+                tabela = self.calcular(num_participantes, max(meses_total, int(np.ceil(num_participantes / 2))))
+                self.tabelas[num_participantes] = tabela
+                self.bytes += self.tamanho(tabela)
+            else:
+                self.acertos += 1
+            self.tabelas.move_to_end(num_participantes)
+            
+            # Remove as menos usadas até caber no limite (a recém-usada fica)
+            while self.bytes > self.limite_bytes and len(self.tabelas) > 1:
+                _, removida = self.tabelas.popitem(last=False)
+                self.bytes -= self.tamanho(removida)
+        
+        return {nome: coluna[:meses_total] for nome, coluna in tabela.items()}
+    
+    def estatisticas(self) -> Dict:
+        consultas = self.acertos + self.faltas
+        return {
+            'tabelas': len(self.tabelas),
+            'bytes': self.bytes,
+            'limite_bytes': self.limite_bytes,
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0
+        }
+
+# Global (por processo)
+TABELAS_SOBREVIVENCIA = TabelasSobrevivencia()
+
+def hazards_planilha(num_participantes: int, contemplados_por_mes: int, meses_total: int) -> Dict:
+    """
+    Hazards mensais da lógica da planilha (calcular_probabilidades_contemplacao):
+    com R_t = N - c*(t-1) participantes restantes, h_sem = 1/R_t e h_com = 2/R_t
+    (zero quando não resta ninguém; h_com não é limitado a 1, como na planilha).
+    """
+    t = np.arange(1, meses_total + 1, dtype=float)
+    R_t = np.maximum(num_participantes - contemplados_por_mes * (t - 1), 0.0)
+    
+    h_sem = np.divide(1.0, R_t, out=np.zeros_like(t), where=R_t > 0)
+    h_com = np.divide(2.0, R_t, out=np.zeros_like(t), where=R_t > 0)
+    
+    return {"h_sem": h_sem, "h_com": h_com}
+
+def metricas_pesos_normalizados(pesos, F=None) -> tuple:
+    """
+    (esperança, mediana, p10, p90) das curvas legadas: esperança dos meses com os
+    'pesos' mensais normalizados para somar 1; percentis pela acumulada F ou, se
+    None, pela soma acumulada dos pesos normalizados.
+    
+    As somas são sequenciais (np.cumsum), na mesma ordem da versão em laço.
+    """
+    pesos = np.asarray(pesos, dtype=float)
+    total = np.cumsum(pesos)[-1] if len(pesos) else 0.0
+    if total <= 0:
+        return 0, None, None, None
+    
+    normalizados = pesos / total
+    meses = np.arange(1, len(pesos) + 1)
+    esperanca = float(np.cumsum(meses * normalizados)[-1])
+    
+    if F is None:
+        F = np.cumsum(normalizados)
+    return esperanca, _percentile_month(F, 0.50), _percentile_month(F, 0.10), _percentile_month(F, 0.90)
+
+def log_sobrevivencia(h: np.ndarray) -> np.ndarray:
+    """
+    log S_t = Σ_{s≤t} log(1 - h_s), com log1p/cumsum. Não acumula erro de
+    arredondamento como o produtório em grupos grandes; h = 1 dá -inf (S = 0).
+    Com ela, F_t = -expm1(log S_t) fica exata também quando F é pequeno.
+    """
+    with np.errstate(divide='ignore'):
+        return np.cumsum(np.log1p(-h), axis=-1)
+
 def curvas_from_hazard(h):
     """Calcula curvas de probabilidade a partir de hazards."""
-    h = _as_float_array(h)
-    h = np.clip(h, 0.0, 1.0)
+    return curvas_from_hazard_lote(_as_float_array(h)[np.newaxis, :])[0]
+
+def curvas_from_hazard_lote(H, comprimentos=None, pontos=None, escala: float = 1.0) -> List[Dict]:
+    """
+    curvas_from_hazard de cada linha de uma matriz grupos × meses, numa única
+    passada vetorizada (sobrevivência, acumulada, f_t, esperança e percentis de
+    todas as linhas juntas).
+    
+    Args:
+        H: hazards, uma linha por grupo
+        comprimentos: meses de cada linha; o resto é preenchimento com h = 0, que
+            não altera S nem F (None = todas com todas as colunas)
+        pontos: até quantos meses cada curva devolve (ver indices_amostrados), um
+            valor para todas ou um por linha; esperança e percentis usam todos
+        escala: multiplica hazard, acumulada e probabilidade do mês (100 = em %)
+    """
+    H = np.clip(np.atleast_2d(np.asarray(H, dtype=float)), 0.0, 1.0)
+    grupos, total = H.shape
+    comprimentos = [total] * grupos if comprimentos is None else [int(n) for n in comprimentos]
+    if not isinstance(pontos, (list, tuple)):
+        pontos = [pontos] * grupos
 
-    # Sobrevivência e acumulada
-    S = np.cumprod(1.0 - h)
-    F = 1.0 - S
+    # Sobrevivência e acumulada (em espaço log)
+    log_S = log_sobrevivencia(H)
+    S = np.exp(log_S)
+    F = -np.expm1(log_S)
 
     # f_t = h_t * S_{t-1}
-    S_prev = np.r_[1.0, S[:-1]]
-    f = h * S_prev
+    S_prev = np.concatenate((np.ones((grupos, 1)), S[:, :-1]), axis=1)
+    f = H * S_prev
 
-    # Métricas de distribuição do mês de contemplação
-    meses = np.arange(1, len(h) + 1, dtype=int)
-    esperanca = float(np.sum(meses * f))
-    p50 = _percentile_month(F, 0.50)
-    p10 = _percentile_month(F, 0.10)
-    p90 = _percentile_month(F, 0.90)
+    # Métricas de distribuição do mês de contemplação (F não decrescente em cada linha)
+    meses = np.arange(1, total + 1, dtype=int)
+    esperancas = np.sum(meses * f, axis=1)
+    linhas = np.arange(grupos)
+    percentis = {}
+    for campo, p in (("mediana_mes", 0.50), ("p10_mes", 0.10), ("p90_mes", 0.90)):
+        atingiu = F >= p - TOLERANCIA_PERCENTIL
+        indice = np.argmax(atingiu, axis=1)
+        percentis[campo] = np.where(atingiu[linhas, indice], indice + 1, 0)
 
-    return {
-        "meses": meses.tolist(),
-        "hazard": h.tolist(),
-        "probabilidade_acumulada": F.tolist(),
-        "probabilidade_mes": f.tolist(),
-        "esperanca_meses": esperanca,
-        "mediana_mes": p50,
-        "p10_mes": p10,
-        "p90_mes": p90
-    }
+    curvas = []
+    for linha, n in enumerate(comprimentos):
+        indices = indices_amostrados(n, pontos[linha])
+        curvas.append({
+            "meses": meses[indices].tolist(),
+            "hazard": (H[linha, indices] * escala).tolist(),
+            "probabilidade_acumulada": (F[linha, indices] * escala).tolist(),
+            "probabilidade_mes": (f[linha, indices] * escala).tolist(),
+            "esperanca_meses": float(esperancas[linha]),
+            **{campo: int(mes[linha]) if 0 < mes[linha] <= n else None for campo, mes in percentis.items()}
+        })
+    return curvas
+
+def participantes_restantes_cronograma(participantes_iniciais, sorteio, lance=None, desistencias=None,
+                                       reativacoes=None) -> np.ndarray:
+    """
+    Participantes ativos no início de cada assembleia (meses no último eixo):
+    R_t = N - Σ_{s<t} (sorteio + lance + desistências - reativações).
+    Como as contemplações, saídas e reativações do mês t valem a partir da assembleia t+1.
+    """
+    saidas = np.array(sorteio, dtype=float)
+    for contagem, sinal in ((lance, 1.0), (desistencias, 1.0), (reativacoes, -1.0)):
+        if contagem is not None:
+            saidas += sinal * np.asarray(contagem, dtype=float)
+    
+    acumuladas = np.cumsum(saidas, axis=-1)
+    anteriores = np.concatenate((np.zeros(acumuladas.shape[:-1] + (1,)), acumuladas[..., :-1]), axis=-1)
+    return np.asarray(participantes_iniciais, dtype=float)[..., np.newaxis] - anteriores
+
+def validar_cronograma(cronograma: CronogramaAssembleias) -> Optional[str]:
+    """Validações do cronograma de assembleias. Retorna a mensagem de erro ou None se válido."""
+    meses = len(cronograma.sorteios)
+    if meses == 0:
+        return "Informe os sorteios de pelo menos uma assembleia"
+    
+    if meses > LIMITE_MESES_CRONOGRAMA:
+        return f"Cronograma deve ter no máximo {LIMITE_MESES_CRONOGRAMA} assembleias"
+    
+    if cronograma.participantes_restantes is None and cronograma.participantes_iniciais is None:
+        return "Informe participantes_iniciais ou participantes_restantes"
+    
+    if cronograma.participantes_restantes is not None and (
+            cronograma.participantes_iniciais is not None or cronograma.desistencias is not None
+            or cronograma.reativacoes is not None):
+        return "participantes_restantes já inclui desistências e reativações; não combine com participantes_iniciais"
+    
+    for campo in ('sorteios', 'lances', 'participantes_restantes', 'desistencias', 'reativacoes'):
+        valores = getattr(cronograma, campo)
+        if valores is None:
+            continue
+        if len(valores) != meses:
+            return f"'{campo}' deve ter {meses} meses, como 'sorteios'"
+        if any(valor < 0 for valor in valores):
+            return f"'{campo}' não pode ter valores negativos"
+    
+    if cronograma.pontos_curva is not None and cronograma.pontos_curva < 2:
+        return "Pontos da curva deve ser >= 2"
+    
+    return None
+
+def calcular_probabilidades_cronogramas(cronogramas: List[CronogramaAssembleias]) -> List[Dict]:
+    """
+    Curvas sem/com lance de vários cronogramas de assembleias numa única passada
+    vetorizada: as contagens vão para matrizes cronogramas × meses (meses além do
+    fim de cada grupo ficam sem contemplações), os hazards saem de
+    hazards_from_counts e as curvas de curvas_from_hazard_lote, em %.
+    
+    Retorna, na ordem recebida, dicts no formato de RespostaProbabilidadesCronograma;
+    cronogramas inválidos vêm com erro=True e a mensagem, sem interromper os demais.
+    """
+    respostas = [{'erro': True, 'mensagem': erro, 'nome': cronograma.nome}
+                 for cronograma, erro in zip(cronogramas, map(validar_cronograma, cronogramas))]
+    validos = [i for i, resposta in enumerate(respostas) if resposta['mensagem'] is None]
+    if not validos:
+        return respostas
+    
+    comprimentos = np.array([len(cronogramas[i].sorteios) for i in validos])
+    total = int(comprimentos.max())
+    
+    def matriz(campo: str) -> Optional[np.ndarray]:
+        """Contagens de 'campo' dos cronogramas válidos (None se nenhum informou)."""
+        if all(getattr(cronogramas[i], campo) is None for i in validos):
+            return None
+        contagens = np.zeros((len(validos), total))
+        for linha, i in enumerate(validos):
+            valores = getattr(cronogramas[i], campo)
+            if valores is not None:
+                contagens[linha, :len(valores)] = valores
+        return contagens
+    
+    sorteio, lance = matriz('sorteios'), matriz('lances')
+    iniciais = [cronogramas[i].participantes_iniciais or 0 for i in validos]
+    restantes = participantes_restantes_cronograma(iniciais, sorteio, lance, matriz('desistencias'), matriz('reativacoes'))
+    informados = matriz('participantes_restantes')
+    if informados is not None:
+        linhas = [linha for linha, i in enumerate(validos) if cronogramas[i].participantes_restantes is not None]
+        restantes[linhas] = informados[linhas]
+    
+    # Preenchimento após o fim de cada grupo: 1 participante e nenhuma contemplação (h = 0)
+    no_grupo = np.arange(total) < comprimentos[:, np.newaxis]
+    restantes = np.where(no_grupo, restantes, 1.0)
+    sem_participantes = np.any(restantes <= 0, axis=1)
+    mes_sem_participantes = np.argmax(restantes <= 0, axis=1) + 1
+    restantes[sem_participantes] = 1.0
+    
+    hazards = hazards_from_counts(restantes.ravel(), sorteio.ravel(), None if lance is None else lance.ravel())
+    pontos = [cronogramas[i].pontos_curva for i in validos]
+    curvas_sem = curvas_from_hazard_lote(hazards['h_sem'].reshape(restantes.shape), comprimentos, pontos, escala=100)
+    curvas_com = curvas_from_hazard_lote(hazards['h_com'].reshape(restantes.shape), comprimentos, pontos, escala=100)
+    
+    for linha, i in enumerate(validos):
+        cronograma = cronogramas[i]
+        if sem_participantes[linha]:
+            respostas[i]['mensagem'] = f"Participantes restantes devem ser positivos (mês {mes_sem_participantes[linha]})"
+            continue
+        
+        n = int(comprimentos[linha])
+        respostas[i] = {
+            'erro': False,
+            'nome': cronograma.nome,
+            'sem_lance': curvas_sem[linha],
+            'com_lance': curvas_com[linha] if cronograma.lances is not None else None,
+            'parametros': {
+                'meses_total': n,
+                'participantes_iniciais': float(restantes[linha, 0]),
+                'participantes_finais': float(restantes[linha, n - 1]),
+                'contemplados_total': float(sorteio[linha, :n].sum() + (0.0 if lance is None else lance[linha, :n].sum()))
+            }
+        }
+    
+    return respostas
 
 def calcular_probabilidades_contemplacao(num_participantes=430, contemplados_por_mes=2, lance_livre_perc=0.10):
     """
@@ -2083,81 +4883,24 @@ def calcular_probabilidades_contemplacao(num_participantes=430, contemplados_por
     try:
         # Calcular quantos meses até contemplar todos
         meses_total = int(np.ceil(num_participantes / contemplados_por_mes))
+        meses = list(range(1, meses_total + 1))
         
-        # Listas para armazenar dados
-        meses = []
-        participantes_restantes = []
-        prob_sem_lance = []  # Col5 da planilha
-        prob_com_lance = []  # Col6 da planilha
-        prob_acumulada_sem = []
-        prob_acumulada_com = []
-        
-        # Inicializar
-        participantes_atual = num_participantes
-        acum_sem = 0.0
-        acum_com = 0.0
-        
-        for mes in range(1, meses_total + 1):
-            meses.append(mes)
-            participantes_restantes.append(participantes_atual)
-            
-            # Lógica da planilha:
-            # - 1 contemplado por sorteio (sempre)
-            # - 1 contemplado por lance (col4 = 1)
-            # - Probabilidade sem lance = 1 / participantes_restantes
-            # - Probabilidade com lance = 2 / participantes_restantes
-            
-            if participantes_atual > 0:
-                prob_mes_sem = 1.0 / participantes_atual  # Col5: probabilidade apenas sorteio
-                prob_mes_com = 2.0 / participantes_atual  # Col6: probabilidade sorteio + lance
-            else:
-                prob_mes_sem = 0.0
-                prob_mes_com = 0.0
-            
-            prob_sem_lance.append(prob_mes_sem)
-            prob_com_lance.append(prob_mes_com)
-            
-            # Probabilidades acumuladas (aproximação simples)
-            acum_sem += prob_mes_sem
-            acum_com += prob_mes_com
-            
-            # Garantir que não passe de 1.0
-            acum_sem = min(acum_sem, 1.0)
-            acum_com = min(acum_com, 1.0)
-            
-            prob_acumulada_sem.append(acum_sem)
-            prob_acumulada_com.append(acum_com)
-            
-            # Reduzir participantes para próximo mês
-            participantes_atual = max(0, participantes_atual - contemplados_por_mes)
-        
-        # Calcular métricas estatísticas
-        def calcular_metricas(probabilidades):
-            total_prob = sum(probabilidades)
-            if total_prob > 0:
-                # Normalizar para que some 1
-                probs_norm = [p/total_prob for p in probabilidades]
-                esperanca = sum((i+1) * p for i, p in enumerate(probs_norm))
-                
-                # Mediana e percentis
-                acum = 0.0
-                p50 = p10 = p90 = None
-                for i, p in enumerate(probs_norm):
-                    acum += p
-                    if p10 is None and acum >= 0.10:
-                        p10 = i + 1
-                    if p50 is None and acum >= 0.50:
-                        p50 = i + 1
-                    if p90 is None and acum >= 0.90:
-                        p90 = i + 1
-                        break
-                
-                return esperanca, p50, p10, p90
-            else:
-                return 0, None, None, None
+        # Lógica da planilha:
+        # - 1 contemplado por sorteio (sempre)
+        # - 1 contemplado por lance (col4 = 1)
+        # - Probabilidade sem lance = 1 / participantes_restantes (Col5)
+        # - Probabilidade com lance = 2 / participantes_restantes (Col6)
+        hazards = hazards_planilha(num_participantes, contemplados_por_mes, meses_total)
+        prob_sem_lance = hazards['h_sem'].tolist()
+        prob_com_lance = hazards['h_com'].tolist()
+        
+        # Probabilidades acumuladas (aproximação simples), sem passar de 1.0
+        prob_acumulada_sem = np.minimum(np.cumsum(hazards['h_sem']), 1.0).tolist()
+        prob_acumulada_com = np.minimum(np.cumsum(hazards['h_com']), 1.0).tolist()
         
-        esp_sem, med_sem, p10_sem, p90_sem = calcular_metricas(prob_sem_lance)
-        esp_com, med_com, p10_com, p90_com = calcular_metricas(prob_com_lance)
+        # Métricas estatísticas (hazards normalizados como distribuição)
+        esp_sem, med_sem, p10_sem, p90_sem = metricas_pesos_normalizados(hazards['h_sem'])
+        esp_com, med_com, p10_com, p90_com = metricas_pesos_normalizados(hazards['h_com'])
         
         return {
             "sem_lance": {
@@ -2192,7 +4935,17 @@ def calcular_probabilidades_contemplacao(num_participantes=430, contemplados_por
         logger.error(f"Erro no cálculo de probabilidades: {e}")
         return None
 
-def calcular_probabilidades_contemplacao_corrigido(num_participantes=430, lance_livre_perc=0.10):
+# Maior grupo aceito por /calcular-probabilidades
+LIMITE_PARTICIPANTES_PROBABILIDADE = 100_000
+
+def indices_amostrados(total: int, pontos: Optional[int] = None) -> np.ndarray:
+    """Índices de até 'pontos' meses igualmente espaçados, com o primeiro e o último; todos se None."""
+    if pontos is None or pontos >= total:
+        return np.arange(total)
+    return np.unique(np.linspace(0, total - 1, pontos).round().astype(int))
+
+def calcular_probabilidades_contemplacao_corrigido(num_participantes=430, lance_livre_perc=0.10, hazards=None,
+                                                    pontos=None):
     """
     Versão corrigida do cálculo de probabilidades de contemplação.
     
@@ -2206,6 +4959,13 @@ def calcular_probabilidades_contemplacao_corrigido(num_participantes=430, lance_
     Args:
         num_participantes: Número total de participantes do grupo
         lance_livre_perc: Percentual do lance livre (mantido para compatibilidade)
+        hazards: TABELAS_SOBREVIVENCIA.obter(N, N/2), se já obtidos (ex.: /simular-completo)
+        pontos: se dado, as curvas saem reduzidas a até 'pontos' meses igualmente
+            espaçados (sempre com o primeiro e o último); esperança e percentis
+            continuam calculados com todos os meses
+    
+    Tudo em arrays float64 e com a sobrevivência em espaço log (ver
+    log_sobrevivencia), para grupos de até LIMITE_PARTICIPANTES_PROBABILIDADE.
     """
     try:
         # 🎯 CORREÇÃO FUNDAMENTAL: Lógica correta baseada na documentação
@@ -2222,92 +4982,37 @@ def calcular_probabilidades_contemplacao_corrigido(num_participantes=430, lance_
         
         logger.info(f"🎯 CORREÇÃO APLICADA: N={N} participantes, duração={meses_total} meses")
         
-        # Listas para armazenar dados
-        meses = []
-        
-        # Ambas as curvas usam a mesma redução de participantes (2 por mês)
-        # A diferença está na fórmula de probabilidade individual
-        prob_sem_lance = []
-        prob_acumulada_sem = []
-        prob_com_lance = []
-        prob_acumulada_com = []
-        
-        # Inicializar
-        participantes_atual = num_participantes
-        prob_nao_contemplado_sem = 1.0
-        prob_nao_contemplado_com = 1.0
-        
-        for mes in range(1, meses_total + 1):
-            meses.append(mes)
-            
-            # 🎯 FÓRMULAS CORRIGIDAS baseadas na documentação matemática
-            
-            # SEM LANCE: h_t = 1/(N - 2*t + 1)
-            # Risk set = N - 2*t + 1 (você + outros restantes após lance do mês)
-            S_t = N - 2*mes + 1
-            if S_t > 0:
-                prob_mes_sem = 1.0 / S_t
-            else:
-                prob_mes_sem = 1.0  # Último participante, 100% chance
-            
-            # COM LANCE: h_t = 2/(N - 2*(t-1))  
-            # Participantes totais no início do mês t
-            N_t = N - 2*(mes - 1)
-            if N_t > 0:
-                prob_mes_com = min(2.0 / N_t, 1.0)
-            else:
-                prob_mes_com = 1.0  # Garantir não exceder 100%
-            
-            prob_sem_lance.append(prob_mes_sem)
-            prob_com_lance.append(prob_mes_com)
-            
-            # 🎯 PRODUTÓRIO DA SOBREVIVÊNCIA (já estava correto)
-            prob_nao_contemplado_sem *= (1.0 - prob_mes_sem)
-            prob_nao_contemplado_com *= (1.0 - prob_mes_com)
-            
-            prob_acumulada_sem.append(1.0 - prob_nao_contemplado_sem)
-            prob_acumulada_com.append(1.0 - prob_nao_contemplado_com)
-            
-            # Log para debug (primeiros 3 meses)
-            if mes <= 3:
-                logger.info(f"Mês {mes}: S_t={S_t}, N_t={N_t}, h_sem={prob_mes_sem:.6f}, h_com={prob_mes_com:.6f}")
-                logger.info(f"  P_acum_sem={prob_acumulada_sem[-1]:.4f}, P_acum_com={prob_acumulada_com[-1]:.4f}")
-        
-        # Calcular métricas estatísticas corrigidas
-        def calcular_metricas_corrigidas(probabilidades_mensais, probabilidades_acumuladas):
-            # Usar as probabilidades mensais para calcular a esperança
-            total_prob = sum(probabilidades_mensais)
-            if total_prob > 0:
-                # Normalizar para que some 1
-                probs_norm = [p/total_prob for p in probabilidades_mensais]
-                esperanca = sum((i+1) * p for i, p in enumerate(probs_norm))
-                
-                # Usar probabilidades acumuladas para percentis
-                p50 = p10 = p90 = None
-                for i, prob_acum in enumerate(probabilidades_acumuladas):
-                    if p10 is None and prob_acum >= 0.10:
-                        p10 = i + 1
-                    if p50 is None and prob_acum >= 0.50:
-                        p50 = i + 1
-                    if p90 is None and prob_acum >= 0.90:
-                        p90 = i + 1
-                    if p90 is not None:
-                        break
-                
-                return esperanca, p50, p10, p90
-            else:
-                return 0, None, None, None
-        
-        esp_sem, med_sem, p10_sem, p90_sem = calcular_metricas_corrigidas(prob_sem_lance, prob_acumulada_sem)
-        esp_com, med_com, p10_com, p90_com = calcular_metricas_corrigidas(prob_com_lance, prob_acumulada_com)
-        
-        # Convert hazard values to percentages and probabilities to percentages
-        hazard_sem_percent = [h * 100 for h in prob_sem_lance]
-        hazard_com_percent = [h * 100 for h in prob_com_lance]
-        prob_acum_sem_percent = [p * 100 for p in prob_acumulada_sem]
-        prob_acum_com_percent = [p * 100 for p in prob_acumulada_com]
-        prob_mes_sem_percent = [p * 100 for p in prob_sem_lance]
-        prob_mes_com_percent = [p * 100 for p in prob_com_lance]
+        # 🎯 FÓRMULAS CORRIGIDAS baseadas na documentação matemática (ver hazards_contemplacao)
+        # SEM LANCE: h_t = 1/(N - 2*t + 1) - risk set = você + outros restantes após lance do mês
+        # COM LANCE: h_t = 2/(N - 2*(t-1)) - participantes totais no início do mês t
+        if hazards is None:
+            hazards = TABELAS_SOBREVIVENCIA.obter(N, meses_total)
+        
+        h_sem, h_com = hazards['h_sem'], hazards['h_com']
+        
+        # 🎯 SOBREVIVÊNCIA em espaço log (F_t já vem da tabela) e percentis pela acumulada F_t
+        F_sem, F_com = hazards['F_sem'], hazards['F_com']
+        
+        # Log para debug (primeiros 3 meses)
+        for mes in range(1, min(meses_total, 3) + 1):
+            logger.info(f"Mês {mes}: S_t={N - 2*mes + 1}, N_t={N - 2*(mes - 1)}, h_sem={h_sem[mes - 1]:.6f}, h_com={h_com[mes - 1]:.6f}")
+            logger.info(f"  P_acum_sem={F_sem[mes - 1]:.4f}, P_acum_com={F_com[mes - 1]:.4f}")
+        
+        # Esperança com os hazards normalizados como distribuição; percentis de F_t (todos os meses)
+        esp_sem = metricas_pesos_normalizados(h_sem)[0]
+        esp_com = metricas_pesos_normalizados(h_com)[0]
+        med_sem, p10_sem, p90_sem = (_percentile_month(F_sem, p) for p in (0.50, 0.10, 0.90))
+        med_com, p10_com, p90_com = (_percentile_month(F_com, p) for p in (0.50, 0.10, 0.90))
+        
+        # Meses das curvas (todos ou amostrados) e valores em %
+        indices = indices_amostrados(meses_total, pontos)
+        meses = (indices + 1).tolist()
+        hazard_sem_percent = (h_sem[indices] * 100).tolist()
+        hazard_com_percent = (h_com[indices] * 100).tolist()
+        prob_acum_sem_percent = (F_sem[indices] * 100).tolist()
+        prob_acum_com_percent = (F_com[indices] * 100).tolist()
+        prob_mes_sem_percent = hazard_sem_percent
+        prob_mes_com_percent = hazard_com_percent
         
         return {
             "sem_lance": {
@@ -2342,6 +5047,221 @@ def calcular_probabilidades_contemplacao_corrigido(num_participantes=430, lance_
         logger.error(f"Erro no cálculo de probabilidades corrigido: {e}")
         return None
 
+# Monte Carlo da disputa de lance: rodadas por padrão dentro deste tempo e memória por bloco
+ORCAMENTO_MONTE_CARLO_MS = float(os.environ.get('ORCAMENTO_MONTE_CARLO_MS', '250'))
+LIMITE_BYTES_BLOCO_MONTE_CARLO = 16 * 1024 * 1024
+LIMITE_PRAZO_DISPUTA_LANCE = 480  # O grupo tem 2 × prazo participantes: memória e tempo crescem com prazo²
+LIMITE_SIMULACOES_MONTE_CARLO = 100_000
+DISTRIBUICOES_LANCE = ('beta', 'uniforme', 'triangular')
+
+def validar_disputa_lance(parametros: ParametrosDisputaLance) -> Optional[str]:
+    """Validações da disputa de lance. Retorna a mensagem de erro ou None se válido."""
+    if parametros.prazo_meses <= 0:
+        return "Prazo deve ser positivo"
+    
+    if parametros.prazo_meses > LIMITE_PRAZO_DISPUTA_LANCE:
+        return f"Prazo deve ser no máximo {LIMITE_PRAZO_DISPUTA_LANCE} meses"
+    
+    if parametros.distribuicao not in DISTRIBUICOES_LANCE:
+        return f"Distribuição deve ser uma de: {', '.join(DISTRIBUICOES_LANCE)}"
+    
+    if not 0 <= parametros.fracao_ofertantes <= 1:
+        return "Fração de ofertantes deve estar entre 0 e 1"
+    
+    if parametros.lance_livre_perc < 0:
+        return "Lance livre deve ser >= 0"
+    
+    if not 0 < parametros.lance_medio < parametros.lance_maximo:
+        return "Lance médio deve estar entre 0 e o lance máximo"
+    
+    if parametros.distribuicao == 'beta':
+        media = parametros.lance_medio / parametros.lance_maximo
+        desvio = parametros.lance_desvio / parametros.lance_maximo
+        if not 0 < desvio ** 2 < media * (1 - media):
+            return "Desvio do lance incompatível com a média e o máximo (distribuição beta)"
+    
+    if parametros.lances_por_mes < 1:
+        return "Lances por mês deve ser >= 1"
+    
+    if not 1 <= parametros.simulacoes <= LIMITE_SIMULACOES_MONTE_CARLO:
+        return f"Simulações deve estar entre 1 e {LIMITE_SIMULACOES_MONTE_CARLO}"
+    
+    if parametros.pontos_curva is not None and parametros.pontos_curva < 2:
+        return "Pontos da curva deve ser >= 2"
+    
+    return None
+
+def distribuicao_lances(parametros: ParametrosDisputaLance):
+    """Distribuição (scipy.stats, congelada) dos lances concorrentes, em fração da carta, em [0, lance_maximo]."""
+    maximo = parametros.lance_maximo
+    if parametros.distribuicao == 'uniforme':
+        return stats.uniform(0.0, maximo)
+    if parametros.distribuicao == 'triangular':
+        return stats.triang(parametros.lance_medio / maximo, 0.0, maximo)
+    
+    # Beta com a média e o desvio pedidos (método dos momentos) escalada para [0, máximo]
+    media = parametros.lance_medio / maximo
+    concentracao = media * (1 - media) / (parametros.lance_desvio / maximo) ** 2 - 1
+    return stats.beta(media * concentracao, (1 - media) * concentracao, 0.0, maximo)
+
+def simular_disputa_lance(parametros: ParametrosDisputaLance) -> Dict:
+    """
+    Probabilidade, mês a mês, de lance_livre_perc vencer a disputa de lance, por
+    Monte Carlo vetorizado.
+    
+    Cada bloco de rodadas é um array rodadas × meses × ofertantes: o número de
+    ofertantes de cada mês sai de uma binomial sobre os demais participantes
+    restantes (N - 2(t-1) - 1) e os lances deles da distribuição configurada. O
+    cliente vence se menos de lances_por_mes concorrentes ofertarem pelo menos o
+    lance dele. Os lances são sorteados por transformada inversa e comparados já
+    na escala de quantis (U ≥ F(lance do cliente) ⟺ F⁻¹(U) ≥ lance do cliente),
+    o que dispensa avaliar F⁻¹ em cada amostra; U em float32.
+    
+    Os blocos são limitados a LIMITE_BYTES_BLOCO_MONTE_CARLO: se nem uma rodada
+    com todos os meses cabe, os meses (independentes entre si) são percorridos em
+    fatias. As rodadas param em 'simulacoes' ou ao estourar o orçamento de tempo
+    (sempre pelo menos um bloco).
+    
+    Returns:
+        dict com 'vitorias' (fração por mês), 'erro_padrao' e 'simulacoes' feitas
+    """
+    inicio = time.perf_counter()
+    orcamento = (ORCAMENTO_MONTE_CARLO_MS if parametros.orcamento_ms is None else parametros.orcamento_ms) / 1000
+    gerador = np.random.default_rng(parametros.semente)
+    
+    meses = parametros.prazo_meses
+    t = np.arange(1, meses + 1)
+    demais = np.maximum(2 * meses - 2 * (t - 1) - 1, 0)
+    
+    # Pior caso de ofertantes num mês (para dimensionar o bloco): média + 6 desvios
+    media_ofertantes = demais[0] * parametros.fracao_ofertantes
+    ofertantes_max = int(min(demais[0], np.ceil(media_ofertantes + 6 * np.sqrt(media_ofertantes + 1)))) or 1
+    
+    # Bytes por posição: U float32 + máscara de presentes + duas máscaras intermediárias
+    bytes_por_mes = ofertantes_max * 7
+    meses_fatia = int(min(meses, max(1, LIMITE_BYTES_BLOCO_MONTE_CARLO // bytes_por_mes)))
+    bloco = max(1, LIMITE_BYTES_BLOCO_MONTE_CARLO // (meses_fatia * bytes_por_mes))
+    
+    # Quantil do lance do cliente: um concorrente oferta pelo menos isso com probabilidade 1 - F
+    quantil_cliente = np.float32(distribuicao_lances(parametros).cdf(parametros.lance_livre_perc))
+    
+    vitorias = np.zeros(meses)
+    feitas = 0
+    while feitas < parametros.simulacoes:
+        rodadas = min(bloco, parametros.simulacoes - feitas)
+        for inicio_fatia in range(0, meses, meses_fatia):
+            fatia = slice(inicio_fatia, inicio_fatia + meses_fatia)
+            ofertantes = gerador.binomial(demais[fatia], parametros.fracao_ofertantes, (rodadas, len(demais[fatia])))
+            
+            # rodadas × meses × ofertantes; posições além dos ofertantes de cada mês não contam
+            quantis = gerador.random(ofertantes.shape + (int(ofertantes.max(initial=0)) or 1,), dtype=np.float32)
+            presentes = np.arange(quantis.shape[2]) < ofertantes[..., np.newaxis]
+            acima = np.count_nonzero((quantis >= quantil_cliente) & presentes, axis=2)
+            
+            vitorias[fatia] += np.count_nonzero(acima < parametros.lances_por_mes, axis=0)
+        feitas += rodadas
+        if time.perf_counter() - inicio > orcamento:
+            break
+    
+    vitorias /= feitas
+    return {
+        'vitorias': vitorias,
+        'erro_padrao': np.sqrt(vitorias * (1 - vitorias) / feitas),
+        'simulacoes': feitas
+    }
+
+class CacheDisputaLance:
+    """
+    Cache LRU (em número de entradas) das estimativas de simular_disputa_lance
+    por parâmetros. A semente é parte da chave; pontos_curva não, porque a redução
+    das curvas é feita depois. Uma estimativa cortada pelo orçamento de tempo fica
+    guardada como veio, com o número de simulações feitas.
+    """
+    
+    def __init__(self, limite: int = 256):
+        self.limite = limite
+        self.itens = OrderedDict()  # chave -> resultado de simular_disputa_lance
+        self.trava = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+    
+    @staticmethod
+    def chave(parametros: ParametrosDisputaLance) -> tuple:
+        """Parâmetros em ordem fixa, sem pontos_curva (floats normalizados, -0.0 vira 0.0)."""
+        return tuple(
+            (campo, float(valor) + 0.0 if isinstance(valor, float) else valor)
+            for campo, valor in sorted(parametros.dict(exclude={'pontos_curva'}).items())
+        )
+    
+    def obter(self, parametros: ParametrosDisputaLance) -> Dict:
+        """Estimativa em cache ou recém-simulada (os arrays são somente leitura)."""
+        chave = self.chave(parametros)
+        with self.trava:
+            resultado = self.itens.get(chave)
+            if resultado is not None:
+                self.acertos += 1
+                self.itens.move_to_end(chave)
+                return resultado
+            self.faltas += 1
+        
+        # Fora da trava: rodadas longas não bloqueiam consultas de outros parâmetros
+        resultado = simular_disputa_lance(parametros)
+        resultado['vitorias'].flags.writeable = False
+        resultado['erro_padrao'].flags.writeable = False
+        
+        with self.trava:
+            self.itens[chave] = resultado
+            self.itens.move_to_end(chave)
+            while len(self.itens) > self.limite:
+                self.itens.popitem(last=False)
+        return resultado
+    
+    def estatisticas(self) -> Dict:
+        consultas = self.acertos + self.faltas
+        return {
+            'itens': len(self.itens),
+            'limite': self.limite,
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0
+        }
+
+# Global (por processo)
+CACHE_DISPUTA_LANCE = CacheDisputaLance()
+
+def calcular_probabilidades_disputa_lance(parametros: ParametrosDisputaLance) -> Dict:
+    """
+    Resposta de /probabilidade-lance (formato de RespostaDisputaLance) como dicts.
+    
+    Com p_t a probabilidade simulada de vencer no lance, quem perde a disputa ainda
+    concorre ao sorteio entre os demais: h_t = p_t + (1 - p_t) · h_sem_t, com h_sem
+    de hazards_contemplacao. Com lances aleatórios (p_t = 1/R_t) isso é exatamente
+    o h_com da versão corrigida.
+    
+    Como em /calcular-probabilidades, lance_livre_perc = 0 é não ofertar: não há
+    disputa a simular e só a curva sem lance é retornada.
+    """
+    meses = parametros.prazo_meses
+    h_sem = TABELAS_SOBREVIVENCIA.obter(meses * 2, meses)['h_sem']
+    if parametros.lance_livre_perc == 0:
+        disputa = {'vitorias': np.zeros(meses), 'erro_padrao': np.zeros(meses), 'simulacoes': 0}
+    else:
+        disputa = CACHE_DISPUTA_LANCE.obter(parametros)
+    h_com = disputa['vitorias'] + (1.0 - disputa['vitorias']) * h_sem
+    
+    curvas_sem, curvas_com = curvas_from_hazard_lote(np.vstack((h_sem, h_com)), pontos=parametros.pontos_curva, escala=100)
+    indices = indices_amostrados(meses, parametros.pontos_curva)
+    return {
+        'erro': False,
+        'meses': curvas_sem['meses'],
+        'probabilidade_lance': (disputa['vitorias'][indices] * 100).tolist(),
+        'erro_padrao_lance': (disputa['erro_padrao'][indices] * 100).tolist(),
+        'sem_lance': curvas_sem,
+        'com_lance': curvas_com if parametros.lance_livre_perc > 0 else None,
+        'simulacoes': disputa['simulacoes'],
+        'parametros': parametros.dict()
+    }
+
 def calcular_probabilidade_mes_especifico(mes_contemplacao: int, lance_livre_perc: float, num_participantes: int, contemplados_por_mes: int = 2):
     """
     Calcula as probabilidades específicas para um mês de contemplação escolhido.
@@ -2382,30 +5302,14 @@ def calcular_probabilidade_mes_especifico(mes_contemplacao: int, lance_livre_per
             }
         
         # 🎯 CORREÇÃO: Usar fórmulas matemáticas corretas baseadas na documentação
-        # Determinar cenário baseado em contemplados_por_mes ajustado anteriormente
-        if contemplados_por_mes == 1:
-            # SEM LANCE: h_t = 1/(N - 2*t + 1)
-            S_t = num_participantes - 2*mes_contemplacao + 1
-            prob_no_mes = 1.0 / S_t if S_t > 0 else 1.0
-        else:
-            # COM LANCE: h_t = 2/(N - 2*(t-1))  
-            N_t = num_participantes - 2*(mes_contemplacao - 1)
-            prob_no_mes = min(2.0 / N_t, 1.0) if N_t > 0 else 1.0
-        
-        # Probabilidade acumulada: Usar o método da sobrevivência correto
-        # Simular até o mês desejado usando as fórmulas corretas
-        surv = 1.0
-        for t in range(1, mes_contemplacao + 1):
-            if contemplados_por_mes == 1:
-                S_t_iter = num_participantes - 2*t + 1
-                h_t = 1.0 / S_t_iter if S_t_iter > 0 else 1.0
-            else:
-                N_t_iter = num_participantes - 2*(t - 1)
-                h_t = min(2.0 / N_t_iter, 1.0) if N_t_iter > 0 else 1.0
-            
-            surv *= (1 - h_t)
-        
-        prob_ate_mes = 1.0 - surv
+        # Determinar cenário baseado em contemplados_por_mes ajustado anteriormente:
+        # 1 → SEM LANCE h_t = 1/(N - 2*t + 1); senão COM LANCE h_t = 2/(N - 2*(t-1))
+        # Consulta direta às tabelas de sobrevivência (sem refazer o produtório até o mês)
+        tabela = TABELAS_SOBREVIVENCIA.obter(num_participantes, mes_contemplacao)
+        cenario = 'sem' if contemplados_por_mes == 1 else 'com'
+        
+        prob_no_mes = tabela[f'h_{cenario}'][mes_contemplacao - 1]
+        prob_ate_mes = tabela[f'F_{cenario}'][mes_contemplacao - 1]
         
         return {
             "prob_no_mes": float(prob_no_mes),
@@ -425,19 +425,28 @@ function App() {
       
       console.log('📡 Headers da requisição:', headers);
       
-      const response = await axios.post(`${API}/simular`, parametros, { headers });
+      // Simulação, gráfico de probabilidade e curvas numa única chamada
+      const response = await axios.post(`${API}/simular-completo`, parametros, { headers });
       
       if (response.data.erro) {
         setErro(response.data.mensagem);
         setResultados(null);
+        setProbabilidades(null);
       } else {
         setResultados(response.data);
+        // Curvas do grupo da simulação (participantes = 2 × prazo), já calculadas pelo /simular-completo
+        setProbabilidades(response.data.probabilidades || null);
+        setParametrosProb(prev => ({
+          ...prev,
+          num_participantes: parametros.prazo_meses * 2,
+          lance_livre_perc: parametros.lance_livre_perc
+        }));
         console.log('✅ Simulação realizada com sucesso');
         
         // Buscar dados dos gráficos após simulação bem-sucedida
         try {
-          // 1. Gráfico de Probabilidade
-          const graficoProbResponse = await axios.get(`${API}/grafico-probabilidades/${parametros.prazo_meses}?lance_livre_perc=${parametros.lance_livre_perc}`);
+          // 1. Gráfico de Probabilidade (já veio com a simulação)
+          const graficoProbData = response.data.grafico_probabilidade;
           
           // 2. Gráfico de Fluxo de Caixa (usar detalhamento da simulação)
           const graficoFluxoData = response.data.detalhamento ? {
@@ -480,7 +489,7 @@ function App() {
           // Adicionar todos os dados dos gráficos aos resultados
           setResultados(prevResultados => ({
             ...prevResultados,
-            grafico_probabilidade: graficoProbResponse.data,
+            grafico_probabilidade: graficoProbData,
             grafico_fluxo: graficoFluxoData,
             grafico_saldo: graficoSaldoData
           }));
@@ -654,6 +663,14 @@ function App() {
   };
 
   const calcularProbabilidades = async () => {
+    // Mesmo grupo da última simulação: as curvas já vieram do /simular-completo
+    if (resultados?.probabilidades &&
+        parametrosProb.num_participantes === resultados.parametros?.prazo_meses * 2 &&
+        parametrosProb.lance_livre_perc === resultados.parametros?.lance_livre_perc) {
+      setProbabilidades(resultados.probabilidades);
+      return;
+    }
+    
     setLoadingProb(true);
     setErro(null);
     
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py importa "prompts.prompt_consorcio" relativo a backend/ e lê a conexão do Mongo do ambiente
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
@@ -0,0 +1,648 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+class ColecaoFalsa:
+    """Coleção em memória com o subconjunto da API do Motor usado pelos endpoints de simulação."""
+
+    def __init__(self):
+        self.documentos = []
+
+    async def find_one(self, filtro, *args, **kwargs):
+        for documento in self.documentos:
+            if all(documento.get(k) == v for k, v in filtro.items()):
+                return documento
+        return None
+
+    async def insert_one(self, documento):
+        self.documentos.append(documento)
+
+    async def insert_many(self, documentos):
+        self.documentos.extend(documentos)
+
+    async def replace_one(self, filtro, documento, upsert=False):
+        self.documentos = [d for d in self.documentos if not all(d.get(k) == v for k, v in filtro.items())]
+        self.documentos.append(documento)
+
+
+class BancoFalso:
+    def __init__(self):
+        self.colecoes = {}
+
+    def __getattr__(self, nome):
+        return self.colecoes.setdefault(nome, ColecaoFalsa())
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    banco = BancoFalso()
+    monkeypatch.setattr(server, "db", banco)
+    return banco
+
+
+@pytest.fixture
+def cliente(banco):
+    return TestClient(server.app)
+
+
+def test_simular_lote_igual_a_simular_individual(cliente, banco):
+    cenarios = [
+        {},
+        {"mes_contemplacao": 17, "lance_livre_perc": 0.0},
+        {"prazo_meses": 200, "mes_contemplacao": 150, "taxa_reajuste_anual": 0.07},
+        {"prazo_meses": 60, "mes_contemplacao": 61},  # inválido
+    ]
+
+    resposta = cliente.post("/api/simular-lote", json=cenarios)
+    assert resposta.status_code == 200
+    lote = resposta.json()
+
+    assert lote["total"] == 4
+    assert lote["total_erros"] == 1
+    assert not lote["erro"]
+    assert lote["resultados"][3]["erro"]
+    assert lote["resultados"][3]["mensagem"] == "Mês de contemplação não pode ser maior que o prazo"
+    assert len(banco.simulation_inputs.documentos) == 3
+
+    for cenario, resultado_lote in zip(cenarios[:3], lote["resultados"]):
+        individual = cliente.post("/api/simular", json=cenario).json()
+        assert resultado_lote["resumo_financeiro"] == pytest.approx(individual["resumo_financeiro"])
+        assert resultado_lote["fluxos"] == pytest.approx(individual["fluxos"])
+        assert resultado_lote["resultados"]["convergiu"] == individual["resultados"]["convergiu"]
+        if individual["resultados"]["cet_anual"] is not None:
+            assert resultado_lote["resultados"]["cet_anual"] == pytest.approx(individual["resultados"]["cet_anual"], rel=1e-9)
+        assert resultado_lote["resultados"]["vpl"] == pytest.approx(individual["resultados"]["vpl"], rel=1e-9)
+
+
+def test_simular_lote_respeita_limite(cliente):
+    resposta = cliente.post("/api/simular-lote", json=[{}] * (server.LIMITE_SIMULACOES_LOTE + 1))
+    assert resposta.status_code == 400
+
+    longo = cliente.post("/api/simular-lote", json=[{}, {"prazo_meses": server.LIMITE_PRAZO_LOTE + 1}]).json()
+    assert not longo["resultados"][0]["erro"]
+    assert longo["resultados"][1]["mensagem"] == f"Prazo deve ser no máximo {server.LIMITE_PRAZO_LOTE} meses"
+
+
+def test_simular_inclui_cet_esperado(cliente):
+    resposta = cliente.post("/api/simular", json={"prazo_meses": 120, "lance_livre_perc": 0.2})
+    assert resposta.status_code == 200
+    cet_esperado = resposta.json()["cet_esperado"]
+
+    assert cet_esperado["sem_lance"]["mes_esperado"] > cet_esperado["com_lance"]["mes_esperado"]
+    assert 0 < cet_esperado["com_lance"]["prob_cet_valido"] <= 1
+
+
+def test_simular_incremental_igual_a_simular(cliente):
+    parametros = {"prazo_meses": 150, "mes_contemplacao": 10, "lance_livre_perc": 0.2}
+    resposta = cliente.post("/api/simular-incremental", json={"parametros": parametros}).json()
+    assert resposta["modo"] == "completo"
+    sessao_id = resposta["sessao_id"]
+
+    for alteracoes, modo in [
+        ({"mes_contemplacao": 80}, "incremental"),
+        ({"lance_livre_perc": 0.0}, "incremental"),
+        ({"taxa_reajuste_anual": 0.07}, "completo"),
+        ({"mes_contemplacao": 3, "lance_livre_perc": 0.35}, "incremental"),
+    ]:
+        incremental = cliente.post(
+            "/api/simular-incremental", json={"sessao_id": sessao_id, "alteracoes": alteracoes}
+        ).json()
+        parametros.update(alteracoes)
+        completa = cliente.post("/api/simular", json=parametros).json()
+
+        assert incremental["modo"] == modo
+        assert incremental["sessao_id"] == sessao_id
+        for campo in ["parametros", "fluxos", "detalhamento", "resumo_financeiro", "cet_esperado"]:
+            assert incremental[campo] == completa[campo]
+        for campo in ["cet_anual", "cet_mensal", "vpl"]:
+            assert incremental["resultados"][campo] == pytest.approx(completa["resultados"][campo], rel=1e-9)
+
+
+def test_simular_incremental_sessao_desconhecida(cliente):
+    resposta = cliente.post("/api/simular-incremental", json={"sessao_id": "inexistente", "alteracoes": {"mes_contemplacao": 5}})
+    assert resposta.status_code == 404
+
+
+def test_simular_incremental_sessao_de_outro_worker(cliente, banco, monkeypatch):
+    monkeypatch.setattr(server, "SESSOES_SIMULACAO", {})
+    aberta = cliente.post("/api/simular-incremental", json={"parametros": {"prazo_meses": 100, "mes_contemplacao": 10}}).json()
+    sessao_id = aberta["sessao_id"]
+    assert banco.simulation_sessions.documentos[0]["parametros"]["mes_contemplacao"] == 10
+
+    # Outro worker (ou processo reiniciado): sem a sessão em memória, reabre pelo Mongo
+    server.SESSOES_SIMULACAO.clear()
+    seguinte = cliente.post("/api/simular-incremental", json={"sessao_id": sessao_id, "alteracoes": {"mes_contemplacao": 40}}).json()
+    assert seguinte["sessao_id"] == sessao_id and seguinte["modo"] == "incremental"
+    assert seguinte["fluxos"] == cliente.post("/api/simular", json={"prazo_meses": 100, "mes_contemplacao": 40}).json()["fluxos"]
+    assert banco.simulation_sessions.documentos[0]["parametros"]["mes_contemplacao"] == 40
+
+
+def test_simular_incremental_grava_sessao_so_quando_parametros_mudam(cliente, banco, monkeypatch):
+    gravacoes = []
+    salvar = server.salvar_sessao_simulacao_mongo
+
+    async def salvar_contando(sessao_id, parametros, atualizado_em):
+        gravacoes.append(parametros.mes_contemplacao)
+        await salvar(sessao_id, parametros, atualizado_em)
+
+    monkeypatch.setattr(server, "salvar_sessao_simulacao_mongo", salvar_contando)
+    sessao_id = cliente.post("/api/simular-incremental", json={"parametros": {"prazo_meses": 100, "mes_contemplacao": 10}}).json()["sessao_id"]
+
+    for mes in [10, 30, 30]:
+        resposta = cliente.post("/api/simular-incremental", json={"sessao_id": sessao_id, "alteracoes": {"mes_contemplacao": mes}})
+        assert resposta.status_code == 200
+
+    assert gravacoes == [10, 30]
+    assert banco.simulation_sessions.documentos[-1]["parametros"]["mes_contemplacao"] == 30
+
+
+def test_simular_incremental_alteracoes_com_tipos_dos_parametros(cliente):
+    sessao_id = cliente.post("/api/simular-incremental", json={"parametros": {"prazo_meses": 100}}).json()["sessao_id"]
+
+    def alterar(alteracoes):
+        return cliente.post("/api/simular-incremental", json={"sessao_id": sessao_id, "alteracoes": alteracoes})
+
+    assert alterar({"prazo_meses": 90, "mes_contemplacao": 5}).json()["parametros"]["prazo_meses"] == 90
+    assert alterar({"prazo_meses": 90.5}).status_code == 422
+    assert alterar({"prazo": 90}).status_code == 400
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    memoria, mongo = server.CacheResultadosSimulacao(), server.CacheSimulacaoMongo()
+    monkeypatch.setattr(server, "CACHE_RESULTADOS_SIMULACAO", memoria)
+    monkeypatch.setattr(server, "CACHE_SIMULACAO_MONGO", mongo)
+    return memoria, mongo
+
+
+def test_cache_compartilhado_entre_simular_e_pdf(cliente, caches):
+    parametros = {"prazo_meses": 100, "mes_contemplacao": 20}
+
+    primeira = cliente.post("/api/simular", json=parametros).json()
+    segunda = cliente.post("/api/simular", json=parametros).json()
+    assert primeira == segunda
+    assert cliente.post("/api/gerar-relatorio-pdf", json=parametros).status_code == 200
+
+    estatisticas = cliente.get("/api/admin/cache-simulacao").json()
+    assert estatisticas["faltas"] == 1
+    assert estatisticas["acertos"] == 2  # 1 consulta por /simular e 1 do PDF, menos a 1ª falta
+    assert estatisticas["entradas"] == 1
+
+
+def test_cache_respeita_limite_de_memoria():
+    cache = server.CacheResultadosSimulacao()
+
+    def guardar(mes):
+        parametros = server.ParametrosConsorcio(mes_contemplacao=mes)
+        cache.guardar(parametros, server.SimuladorConsorcio(parametros).simular_cenario_completo())
+
+    guardar(1)
+    cache.limite_bytes = int(cache.bytes * 2.5)
+    for mes in range(2, 6):
+        guardar(mes)
+
+    assert len(cache.itens) == 2
+    assert cache.remocoes == 3
+    assert cache.bytes <= cache.limite_bytes
+    assert cache.chave(server.ParametrosConsorcio(mes_contemplacao=5)) in cache.itens
+
+
+def test_cache_mongo_sobrevive_a_reinicio(cliente, banco, caches):
+    memoria, mongo = caches
+    parametros = {"prazo_meses": 90, "mes_contemplacao": 30, "lance_livre_perc": 0.25}
+
+    original = cliente.post("/api/simular", json=parametros).json()
+    assert mongo.gravacoes == 2  # resultado e, depois, com o CET esperado
+    assert len(banco.simulation_cache.documentos) == 1
+
+    # Colunas monetárias gravadas em centavos inteiros; fluxos da resposta arredondados como o detalhamento
+    colunas = banco.simulation_cache.documentos[0]["cronograma"]["colunas"]
+    parcelas = np.frombuffer(colunas["parcela_corrigida"], dtype=np.int64)
+    assert (parcelas / 100).tolist() == [linha["parcela_corrigida"] for linha in original["detalhamento"]]
+    assert original["fluxos"] == [round(fluxo, 2) for fluxo in original["fluxos"]]
+
+    # Novo processo: memória vazia, resultado vem do Mongo sem recalcular
+    memoria.itens.clear()
+    memoria.bytes = 0
+    recuperada = cliente.post("/api/simular", json=parametros).json()
+
+    assert recuperada == original
+    assert mongo.acertos == 1
+    assert mongo.gravacoes == 2
+
+
+def test_graficos_e_pdfs_em_paralelo(cliente, tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    assert server.EXECUTOR_PDF._max_workers == min(4, server.os.cpu_count() or 1)
+
+    def grafico(i):
+        pasta = tmp_path / str(i)
+        pasta.mkdir()
+        return server.criar_grafico_probabilidades(100 + 20 * i, 0.1, str(pasta))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        caminhos = list(executor.map(grafico, range(4)))
+        pdfs = list(executor.map(
+            lambda prazo: cliente.post("/api/gerar-relatorio-pdf", json={"prazo_meses": prazo, "mes_contemplacao": 10}),
+            [60, 90, 120, 150]
+        ))
+
+    assert all(caminho and (tmp_path / str(i) / "grafico_probabilidades.png").stat().st_size > 0
+               for i, caminho in enumerate(caminhos))
+    assert all(pdf.status_code == 200 and pdf.content.startswith(b"%PDF") for pdf in pdfs)
+
+
+def test_simular_formato_colunar_igual_ao_de_linhas(cliente):
+    parametros = {"prazo_meses": 150, "mes_contemplacao": 40}
+    linhas = cliente.post("/api/simular", json=parametros).json()
+    colunar = cliente.post("/api/simular?formato=colunar", json=parametros).json()
+
+    assert colunar["detalhamento"] == []
+    assert linhas["detalhamento_colunar"] is None
+    colunas = colunar["detalhamento_colunar"]
+    assert colunas["mes_contemplacao"] == 40
+    for i, linha in enumerate(linhas["detalhamento"]):
+        for campo in ["data", "ano", "fator_correcao", "valor_carta_corrigido", "parcela_corrigida",
+                      "lance_livre", "fluxo_liquido", "saldo_devedor"]:
+            assert colunas[campo][i] == linha[campo]
+
+    assert cliente.post("/api/simular?formato=xml", json=parametros).status_code == 400
+
+
+def test_simular_niveis_de_detalhe_e_paginas(cliente):
+    parametros = {"prazo_meses": 130, "mes_contemplacao": 17}
+    completa = cliente.post("/api/simular", json=parametros).json()
+
+    resumo = cliente.post("/api/simular?detalhe=resumo", json=parametros).json()
+    assert resumo["fluxos"] == [] and resumo["detalhamento"] == []
+    assert resumo["resultados"] == completa["resultados"]
+    assert resumo["resumo_financeiro"] == completa["resumo_financeiro"]
+
+    anual = cliente.post("/api/simular?detalhe=anual", json=parametros).json()
+    assert [l["mes"] for l in anual["detalhamento"]] == [12, 17] + list(range(24, 121, 12)) + [130]
+
+    paginas = []
+    for meses in ["1-50", "51-100", "101-200"]:
+        pagina = cliente.post(f"/api/simular?meses={meses}", json=parametros).json()
+        assert pagina["fluxos"] == []
+        paginas += pagina["detalhamento"]
+    assert paginas == completa["detalhamento"]
+
+    colunar = cliente.post("/api/simular?formato=colunar&detalhe=anual&meses=10-30", json=parametros).json()
+    assert colunar["detalhamento_colunar"]["mes"] == [12, 17, 24]
+
+    assert cliente.post("/api/simular?meses=5-2", json=parametros).status_code == 400
+    assert cliente.post("/api/simular?detalhe=tudo", json=parametros).status_code == 400
+
+
+@pytest.mark.parametrize("consulta,parametros", [
+    ("", {}),
+    ("?formato=colunar&detalhe=anual", {"prazo_meses": 150, "mes_contemplacao": 40}),
+    ("?meses=10-20", {"mes_contemplacao": 17, "lance_livre_perc": 0.0}),
+    ("?detalhe=resumo", {"prazo_meses": 200, "taxa_reajuste_anual": 0.07}),
+])
+def test_simular_caminho_rapido_no_esquema_do_modelo(cliente, consulta, parametros):
+    dados = cliente.post(f"/api/simular{consulta}", json=parametros).json()
+    assert dados == server.RespostaSimulacao.model_validate(dados).model_dump(mode="json")
+
+
+@pytest.mark.parametrize("lance", [0.0, 0.2])
+def test_probabilidades_caminho_rapido_no_esquema_do_modelo(cliente, lance):
+    dados = cliente.post("/api/calcular-probabilidades", json={"lance_livre_perc": lance}).json()
+    assert dados == server.RespostaProbabilidades.model_validate(dados).model_dump(mode="json")
+    assert (dados["com_lance"] is None) == (lance == 0)
+
+
+def test_resposta_rapida_troca_nao_finitos_por_null():
+    import numpy as np
+
+    corpo = server.RespostaJSONRapida({"a": float("nan"), "b": np.array([1.5, np.inf]), "c": np.int64(3)}).body
+    assert corpo == b'{"a":null,"b":[1.5,null],"c":3}'
+
+
+def test_compressao_negociada_com_limite_e_metricas(cliente):
+    def contagens():
+        estatisticas = cliente.get("/api/admin/compressao", headers={"Accept-Encoding": "identity"}).json()
+        gzip = estatisticas["codificacoes"].get("gzip", {"respostas": 0})
+        return gzip["respostas"], estatisticas["abaixo_do_minimo"]
+
+    parametros = {"prazo_meses": 200, "mes_contemplacao": 40}
+    respostas_antes, pequenas_antes = contagens()
+
+    comprimida = cliente.post("/api/simular", json=parametros, headers={"Accept-Encoding": "gzip"})
+    assert comprimida.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in comprimida.headers["vary"].lower()
+    assert int(comprimida.headers["content-length"]) < len(comprimida.content) / 3
+
+    pura = cliente.post("/api/simular", json=parametros, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in pura.headers
+    assert pura.json() == comprimida.json()
+
+    pequena = cliente.get("/api/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in pequena.headers
+
+    assert contagens() == (respostas_antes + 1, pequenas_antes + 1)
+    assert 0 < server.ESTATISTICAS_COMPRESSAO.estatisticas()["codificacoes"]["gzip"]["razao"] < 1
+
+
+def test_compressao_de_corpos_grandes_fora_do_loop(cliente):
+    def em_thread():
+        return cliente.get("/api/admin/compressao", headers={"Accept-Encoding": "identity"}).json()["em_thread"]
+
+    antes = em_thread()
+    pequena = cliente.post("/api/simular?detalhe=resumo", json={"prazo_meses": 60}, headers={"Accept-Encoding": "gzip"})
+    assert pequena.headers["content-encoding"] == "gzip"
+    assert em_thread() == antes
+
+    grande = cliente.post("/api/simular", json={"prazo_meses": 600}, headers={"Accept-Encoding": "gzip"})
+    assert grande.headers["content-encoding"] == "gzip"
+    assert grande.json()["parametros"]["prazo_meses"] == 600
+    assert em_thread() == antes + 1
+
+
+def test_escolher_codificacao(monkeypatch):
+    monkeypatch.setattr(server, "brotli", None)
+    assert server.escolher_codificacao("gzip, deflate, br") == "gzip"
+    assert server.escolher_codificacao("br;q=1.0, gzip;q=0") is None
+    assert server.escolher_codificacao("*") == "gzip"
+    assert server.escolher_codificacao("identity") is None
+
+    monkeypatch.setattr(server, "brotli", object())
+    assert server.escolher_codificacao("gzip, br") == "br"
+
+
+def test_simular_get_cacheavel_com_etag(cliente, banco):
+    parametros = {"prazo_meses": 150, "mes_contemplacao": 40, "lance_livre_perc": 0.2}
+    post = cliente.post("/api/simular?detalhe=anual", json=parametros)
+    url = post.headers["content-location"]
+    assert url.startswith("/api/simular?valor_carta=100000.0&prazo_meses=150")
+
+    get = cliente.get(url)
+    assert get.status_code == 200
+    assert get.json() == post.json()
+    assert get.headers["cache-control"] == server.CACHE_CONTROL_SIMULACAO
+    assert "authorization" in get.headers["vary"].lower()
+    etag = get.headers["etag"]
+    assert etag.startswith('"')
+
+    # Mesmos parâmetros em outra ordem e formato: mesma representação
+    outra = cliente.get("/api/simular?detalhe=anual&lance_livre_perc=.2&mes_contemplacao=40&prazo_meses=150")
+    assert outra.headers["etag"] == etag
+    assert cliente.get("/api/simular?prazo_meses=150").headers["etag"] != etag
+
+    nao_modificada = cliente.get(url, headers={"If-None-Match": etag})
+    assert nao_modificada.status_code == 304 and nao_modificada.content == b""
+    assert nao_modificada.headers["etag"] == server.etag_simulacao(server.ParametrosConsorcio(**parametros), detalhe="anual")
+
+    # Registro do input em segundo plano, também na revalidação
+    assert len(banco.simulation_inputs.documentos) == 5
+
+    # Com token a rota registra o lead: nada de cache compartilhado
+    com_token = cliente.get(url, headers={"Authorization": "Bearer abc"})
+    assert com_token.headers["cache-control"] == "private, no-cache"
+    assert com_token.headers["etag"] == etag
+
+    assert cliente.get("/api/simular?formato=xml").status_code == 400
+
+
+def test_simular_get_etag_forte_por_codificacao(cliente):
+    url = "/api/simular?prazo_meses=200&mes_contemplacao=40"
+    comprimida = cliente.get(url, headers={"Accept-Encoding": "gzip"})
+    assert comprimida.headers["content-encoding"] == "gzip"
+    etag_gzip = comprimida.headers["etag"]
+    assert etag_gzip.endswith('-gzip"') and not etag_gzip.startswith("W/")
+
+    nao_modificada = cliente.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag_gzip})
+    assert nao_modificada.status_code == 304
+
+
+def test_simular_get_corpo_identico_com_indice_frio_ou_quente(cliente, banco, monkeypatch):
+    url = "/api/simular?prazo_meses=240&mes_contemplacao=60&lance_livre_perc=0.15"
+
+    def corpo_recalculado():
+        monkeypatch.setattr(server, "CACHE_RESULTADOS_SIMULACAO", server.CacheResultadosSimulacao())
+        banco.simulation_cache.documentos.clear()
+        return cliente.get(url, headers={"Accept-Encoding": "identity"}).content
+
+    monkeypatch.setattr(server, "INDICE_RAIZES_CET", server.IndiceRaizesCET())
+    frio = corpo_recalculado()
+    cliente.get("/api/simular?prazo_meses=240&mes_contemplacao=61&lance_livre_perc=0.15")
+    assert corpo_recalculado() == frio
+
+
+def test_etag_corresponde():
+    assert server.etag_corresponde('"abc-gzip"', '"abc"')
+    assert server.etag_corresponde('"abc-br"', '"abc"')
+    assert server.etag_corresponde('W/"x", "abc"', '"abc"')
+    assert server.etag_corresponde('*', '"abc"')
+    assert not server.etag_corresponde('"abcd"', '"abc"')
+    assert not server.etag_corresponde(None, '"abc"')
+
+
+def test_coalescedor_compartilha_calculo_e_erro():
+    import asyncio
+
+    coalescedor = server.CoalescedorChamadas()
+    chamadas = []
+
+    async def lenta(valor):
+        chamadas.append(valor)
+        await asyncio.sleep(0.01)
+        if valor < 0:
+            raise ValueError("negativo")
+        return valor * 2
+
+    async def cenario():
+        resultados = await asyncio.gather(*[coalescedor.executar(("dobro", 3), lenta, 3) for _ in range(5)])
+        erros = await asyncio.gather(*[coalescedor.executar(("dobro", -1), lenta, -1) for _ in range(3)],
+                                     return_exceptions=True)
+        depois = await coalescedor.executar(("dobro", 3), lenta, 3)  # Terminou: calcula de novo
+        return resultados, erros, depois
+
+    resultados, erros, depois = asyncio.run(cenario())
+    assert resultados == [6] * 5 and depois == 6
+    assert all(isinstance(e, ValueError) for e in erros)
+    assert chamadas == [3, -1, 3]
+    assert coalescedor.estatisticas() == {
+        "em_andamento": 0,
+        "calculos_economizados": 6,
+        "grupos": {"dobro": {"execucoes": 3, "coalescidas": 6, "erros": 1}},
+    }
+
+
+def test_simulacoes_simultaneas_calculam_uma_vez(banco, caches, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(server, "COALESCEDOR_CHAMADAS", server.CoalescedorChamadas())
+    parametros = server.ParametrosConsorcio(prazo_meses=90, mes_contemplacao=12)
+
+    async def rajada():
+        return await asyncio.gather(*[server.obter_resultado_simulacao(parametros, True) for _ in range(8)])
+
+    respostas = asyncio.run(rajada())
+    assert all(r[0]["resultados"] == respostas[0][0]["resultados"] for r in respostas)
+    assert all(r[1] == respostas[0][1] for r in respostas)
+
+    grupos = server.COALESCEDOR_CHAMADAS.estatisticas()["grupos"]
+    assert grupos["simulacao"] == {"execucoes": 1, "coalescidas": 7, "erros": 0}
+    assert grupos["cet_esperado"]["execucoes"] == 1
+
+
+@pytest.mark.parametrize("lance", [0.0, 0.15])
+def test_simular_completo_igual_as_tres_chamadas(cliente, lance):
+    parametros = {"prazo_meses": 90, "mes_contemplacao": 30, "lance_livre_perc": lance}
+    completo = cliente.post("/api/simular-completo", json=parametros).json()
+
+    simulacao = cliente.post("/api/simular", json=parametros).json()
+    grafico = cliente.get(f"/api/grafico-probabilidades/90?lance_livre_perc={lance}").json()
+    probabilidades = cliente.post("/api/calcular-probabilidades",
+                                  json={"num_participantes": 180, "lance_livre_perc": lance}).json()
+
+    assert completo.pop("grafico_probabilidade") == grafico
+    assert completo.pop("probabilidades") == probabilidades
+    assert completo == simulacao
+
+    limite = server.LIMITE_PARTICIPANTES_PROBABILIDADE // 2
+    assert cliente.post("/api/simular-completo", json={"prazo_meses": limite + 1, "mes_contemplacao": 1}).status_code == 400
+
+
+def test_canal_ao_vivo_calcula_so_os_parametros_mais_recentes(cliente, banco, monkeypatch):
+    monkeypatch.setattr(server, "ESPERA_CANAL_SIMULACAO", 0.2)
+    antes = dict(server.ESTATISTICAS_CANAL_SIMULACAO)
+
+    with cliente.websocket_connect("/api/ws/simular") as canal:
+        for mes in range(1, 6):  # Rajada de um slider: só a última interessa
+            canal.send_json({"id": mes, "parametros": {"prazo_meses": 100, "mes_contemplacao": mes}, "detalhe": "resumo"})
+        resposta = canal.receive_json()
+        assert resposta["id"] == 5 and resposta["tipo"] == "resultado"
+        esperado = cliente.post("/api/simular?detalhe=resumo", json={"prazo_meses": 100, "mes_contemplacao": 5}).json()
+        assert resposta["dados"] == esperado
+
+        canal.send_json({"id": 6, "parametros": {"prazo_meses": 60, "mes_contemplacao": 61}})
+        assert canal.receive_json() == {"id": 6, "tipo": "erro",
+                                        "detail": "Mês de contemplação não pode ser maior que o prazo"}
+
+        canal.send_text("{")
+        assert canal.receive_json()["tipo"] == "erro"
+
+    depois = server.ESTATISTICAS_CANAL_SIMULACAO
+    assert depois["mensagens"] - antes["mensagens"] == 7
+    assert depois["descartadas"] - antes["descartadas"] == 4
+    assert depois["calculadas"] - antes["calculadas"] == 1
+    # Um input salvo pelo canal (só o enviado) e outro pelo POST de comparação
+    assert len(banco.simulation_inputs.documentos) == 2
+
+
+def test_canal_ao_vivo_envia_resultado_terminado_durante_arraste(cliente, monkeypatch):
+    import asyncio
+    import time
+
+    monkeypatch.setattr(server, "ESPERA_CANAL_SIMULACAO", 0)
+    responder = server.responder_mensagem_canal
+
+    async def responder_devagar(texto):
+        resposta = await responder(texto)
+        await asyncio.sleep(0.3)
+        return resposta
+
+    monkeypatch.setattr(server, "responder_mensagem_canal", responder_devagar)
+
+    with cliente.websocket_connect("/api/ws/simular") as canal:
+        canal.send_json({"id": 1, "parametros": {"prazo_meses": 100, "mes_contemplacao": 1}, "detalhe": "resumo"})
+        time.sleep(0.1)  # Chega durante o cálculo da primeira
+        canal.send_json({"id": 2, "parametros": {"prazo_meses": 100, "mes_contemplacao": 2}, "detalhe": "resumo"})
+        assert [canal.receive_json()["id"], canal.receive_json()["id"]] == [1, 2]
+
+
+def test_canal_ao_vivo_fecha_com_frame_binario(cliente):
+    from starlette.websockets import WebSocketDisconnect
+
+    with cliente.websocket_connect("/api/ws/simular") as canal:
+        canal.send_bytes(b"{}")
+        with pytest.raises(WebSocketDisconnect) as fechamento:
+            canal.receive_text()
+    assert fechamento.value.code == 1003
+
+
+def test_probabilidades_limites_e_pontos(cliente):
+    resposta = cliente.post("/api/calcular-probabilidades", json={"num_participantes": 100_000, "pontos_curva": 50})
+    assert resposta.status_code == 200
+    assert len(resposta.json()["com_lance"]["meses"]) == 50
+
+    assert cliente.post("/api/calcular-probabilidades", json={"num_participantes": 100_001}).status_code == 400
+    assert cliente.post("/api/calcular-probabilidades", json={"pontos_curva": 1}).status_code == 400
+
+
+def test_probabilidades_por_cronograma_e_lote(cliente):
+    cronograma = {"nome": "A", "participantes_iniciais": 20, "sorteios": [1] * 10, "lances": [1] * 10, "pontos_curva": 4}
+    resposta = cliente.post("/api/probabilidades-cronograma", json=cronograma)
+    assert resposta.status_code == 200
+    dados = resposta.json()
+    assert dados["com_lance"]["meses"] == [1, 4, 7, 10] and dados["com_lance"]["probabilidade_acumulada"][-1] == 100.0
+
+    sem_lances = {"participantes_iniciais": 20, "sorteios": [1] * 10}
+    assert cliente.post("/api/probabilidades-cronograma", json=sem_lances).json()["com_lance"] is None
+    assert cliente.post("/api/probabilidades-cronograma", json={"sorteios": [1]}).status_code == 400
+
+    lote = cliente.post("/api/probabilidades-cronograma-lote", json=[cronograma, {"participantes_restantes": [1, 0], "sorteios": [1, 0]}]).json()
+    assert (lote["total"], lote["total_erros"]) == (2, 1)
+    assert lote["resultados"][0] == dados
+    assert lote["resultados"][1]["mensagem"] == "Participantes restantes devem ser positivos (mês 2)"
+    assert cliente.post("/api/probabilidades-cronograma-lote", json=[]).status_code == 400
+
+
+def test_probabilidade_de_lance_monte_carlo(cliente):
+    resposta = cliente.post("/api/probabilidade-lance", json={"prazo_meses": 24, "lance_livre_perc": 0.3, "simulacoes": 300})
+    assert resposta.status_code == 200
+    dados = resposta.json()
+    assert dados["simulacoes"] == 300 and len(dados["probabilidade_lance"]) == 24
+    # Perder a disputa ainda deixa o sorteio: com lance nunca abaixo de sem lance
+    assert all(c >= s for c, s in zip(dados["com_lance"]["hazard"], dados["sem_lance"]["hazard"]))
+
+    sem_lance = cliente.post("/api/probabilidade-lance", json={"prazo_meses": 24, "lance_livre_perc": 0.0}).json()
+    assert sem_lance["com_lance"] is None and sem_lance["simulacoes"] == 0
+
+    assert cliente.post("/api/probabilidade-lance", json={"distribuicao": "normal"}).status_code == 400
+    assert cliente.post("/api/probabilidade-lance", json={"lance_desvio": 0.5}).status_code == 400
+    assert cliente.post("/api/probabilidade-lance", json={"prazo_meses": server.LIMITE_PRAZO_DISPUTA_LANCE + 1}).status_code == 400
+
+
+def test_token_na_query_so_vale_no_websocket(cliente, banco):
+    banco.leads.documentos.append({"id": "lead-1", "access_token": "segredo"})
+
+    cliente.post("/api/simular?token=segredo", json={"prazo_meses": 60})
+    assert banco.simulation_inputs.documentos[-1]["lead_id"] is None
+
+    cliente.post("/api/simular", json={"prazo_meses": 60}, headers={"Authorization": "Bearer segredo"})
+    assert banco.simulation_inputs.documentos[-1]["lead_id"] == "lead-1"
+
+    with cliente.websocket_connect("/api/ws/simular?token=segredo") as canal:
+        canal.send_json({"id": 1, "parametros": {"prazo_meses": 60}, "detalhe": "resumo"})
+        assert canal.receive_json()["tipo"] == "resultado"
+    assert banco.simulation_inputs.documentos[-1]["lead_id"] == "lead-1"
+
+
+def test_varredura_de_meses_ignora_mes_de_contemplacao(cliente):
+    fora_do_prazo = cliente.post("/api/simular-meses-contemplacao", json={"prazo_meses": 60, "mes_contemplacao": 100})
+    assert fora_do_prazo.status_code == 200
+    dados = fora_do_prazo.json()
+    assert dados["erro"] is False
+    assert [ponto["mes_contemplacao"] for ponto in dados["pontos"]] == list(range(1, 61))
+    assert dados["parametros"]["mes_contemplacao"] == 100
+
+    # Mesmos pontos para qualquer mes_contemplacao
+    padrao = cliente.post("/api/simular-meses-contemplacao", json={"prazo_meses": 60}).json()
+    assert padrao["pontos"] == dados["pontos"]
+
+    # O mês 30 da varredura é o mesmo de /simular com mes_contemplacao=30
+    simulacao = cliente.post("/api/simular", json={"prazo_meses": 60, "mes_contemplacao": 30}).json()
+    assert dados["pontos"][29]["cet_anual"] == pytest.approx(simulacao["resultados"]["cet_anual"], rel=1e-9)
+
+    longo = {"prazo_meses": server.LIMITE_PRAZO_VARREDURA + 1}
+    assert cliente.post("/api/simular-meses-contemplacao", json=longo).status_code == 400
+
+    assert cliente.post("/api/simular-meses-contemplacao", json={"prazo_meses": 0}).status_code == 400
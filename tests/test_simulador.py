@@ -0,0 +1,361 @@
+import numpy as np
+import pytest
+
+import server
+from server import (
+    IndiceRaizesCET,
+    ParametrosConsorcio,
+    SimuladorConsorcio,
+    calcular_cet_lote,
+    curvas_from_hazard,
+    formatar_resultado_cet,
+    funcoes_vpv,
+    hazards_contemplacao,
+    resolver_tir,
+)
+
+CENARIOS = [
+    {},
+    {"mes_contemplacao": 17},
+    {"prazo_meses": 200, "mes_contemplacao": 200, "taxa_reajuste_anual": 0.0},
+    {"prazo_meses": 60, "mes_contemplacao": 30, "lance_livre_perc": 0.0},
+    {"prazo_meses": 245, "mes_contemplacao": 100, "taxa_reajuste_anual": 0.08, "lance_livre_perc": 0.3},
+    {"prazo_meses": 7, "mes_contemplacao": 3},
+]
+
+
+def vpv_mes_a_mes(fluxos, taxa_mensal):
+    return sum(cf / (1 + taxa_mensal) ** i for i, cf in enumerate(fluxos))
+
+
+@pytest.mark.parametrize("cenario", CENARIOS)
+@pytest.mark.parametrize("taxa_mensal", [-0.005, 0.0, 1e-9, 0.004, 0.0079741, 0.02, 0.15])
+def test_vpv_blocos_anuais_igual_soma_mes_a_mes(cenario, taxa_mensal):
+    simulador = SimuladorConsorcio(ParametrosConsorcio(**cenario))
+    fluxos = simulador.gerar_fluxos_lance_livre()["fluxos"]
+    blocos = simulador.gerar_blocos_anuais()
+
+    esperado = vpv_mes_a_mes(fluxos, taxa_mensal)
+    assert blocos.vpv(taxa_mensal) == pytest.approx(esperado, rel=1e-9, abs=1e-6)
+
+
+@pytest.mark.parametrize("cenario", CENARIOS)
+def test_vpl_e_cet_analiticos_iguais_ao_modo_mes_a_mes(cenario):
+    simulador = SimuladorConsorcio(ParametrosConsorcio(**cenario))
+    fluxos = simulador.gerar_fluxos_lance_livre()["fluxos"]
+    blocos = simulador.gerar_blocos_anuais()
+
+    assert simulador.calcular_vpl(fluxos, 0.10, blocos) == pytest.approx(simulador.calcular_vpl(fluxos, 0.10), rel=1e-9)
+
+    cet_mes_a_mes = SimuladorConsorcio(ParametrosConsorcio(**cenario)).calcular_cet(fluxos)
+    cet_analitico = simulador.calcular_cet(fluxos, blocos)
+    if np.isnan(cet_mes_a_mes):
+        assert np.isnan(cet_analitico)
+    else:
+        assert cet_analitico == pytest.approx(cet_mes_a_mes, rel=1e-8)
+
+
+@pytest.mark.parametrize("cenario", CENARIOS)
+@pytest.mark.parametrize("taxa_mensal", [-0.005, 0.0, 0.004, 0.02])
+def test_derivada_analitica_igual_diferenca_finita(cenario, taxa_mensal):
+    simulador = SimuladorConsorcio(ParametrosConsorcio(**cenario))
+    fluxos = simulador.gerar_fluxos_lance_livre()["fluxos"]
+    blocos = simulador.gerar_blocos_anuais()
+    vpv, derivada = funcoes_vpv(fluxos)
+
+    h = 1e-7
+    diferenca_finita = (vpv(taxa_mensal + h) - vpv(taxa_mensal - h)) / (2 * h)
+    assert derivada(taxa_mensal) == pytest.approx(diferenca_finita, rel=1e-5)
+    assert blocos.derivada(taxa_mensal) == pytest.approx(derivada(taxa_mensal), rel=1e-9)
+
+
+def test_resolver_tir_reporta_iteracoes_e_motivo():
+    simulador = SimuladorConsorcio(ParametrosConsorcio())
+    resultado = simulador.simular_cenario_completo(incluir_detalhamento=False)["resultados"]
+
+    assert resultado["convergiu"]
+    assert resultado["cet_anual"] == pytest.approx(0.1258168223834, rel=1e-10)
+    # Diagnósticos do solver ficam no simulador, fora da resposta
+    assert 0 < simulador.iteracoes_cet <= 60
+    assert simulador.motivo_convergencia
+    assert "iteracoes_cet" not in resultado
+
+    # Fluxo sem raiz no intervalo válido: falha rápida e com motivo explícito
+    sem_raiz = resolver_tir(*funcoes_vpv([0.0, 100.0, -1.0, -1.0]))
+    assert not sem_raiz["convergiu"]
+    assert np.isnan(sem_raiz["taxa_mensal"])
+    assert "sinal" in sem_raiz["motivo"]
+
+
+def test_cet_lote_igual_ao_solver_individual():
+    rng = np.random.default_rng(42)
+    cenarios = [ParametrosConsorcio(**c) for c in CENARIOS]
+    for _ in range(60):
+        prazo = int(rng.integers(6, 400))
+        cenarios.append(ParametrosConsorcio(
+            valor_carta=float(rng.uniform(1e4, 1e6)),
+            prazo_meses=prazo,
+            taxa_admin=float(rng.uniform(0, 0.3)),
+            mes_contemplacao=int(rng.integers(1, prazo + 1)),
+            lance_livre_perc=float(rng.uniform(0, 0.5)),
+            taxa_reajuste_anual=float(rng.uniform(0, 0.1)),
+        ))
+
+    fluxos = [SimuladorConsorcio(p).gerar_fluxos_lance_livre()["fluxos"] for p in cenarios]
+    fluxos.append([0.0, -10.0, -10.0])  # sem mudança de sinal
+    lote = calcular_cet_lote(fluxos)
+
+    assert len(lote) == len(fluxos)
+    for parametros, f, resultado in zip(cenarios, fluxos, lote):
+        simulador = SimuladorConsorcio(parametros)
+        esperado = formatar_resultado_cet(simulador.calcular_cet(f), simulador.convergiu, simulador.motivo_erro)
+        assert resultado["convergiu"] == esperado["convergiu"]
+        assert resultado["motivo_erro"] == esperado["motivo_erro"]
+        if esperado["cet_anual"] is None:
+            assert resultado["cet_anual"] is None
+        else:
+            assert resultado["cet_anual"] == pytest.approx(esperado["cet_anual"], rel=1e-9)
+            assert resultado["cet_mensal"] == pytest.approx(esperado["cet_mensal"], rel=1e-9)
+
+    assert lote[-1]["motivo_erro"] == "Sem mudança de sinal nos fluxos"
+
+
+@pytest.mark.parametrize("cenario", [{"prazo_meses": 120}, {"prazo_meses": 245, "lance_livre_perc": 0.3, "taxa_reajuste_anual": 0.08}])
+def test_varredura_meses_contemplacao_igual_simulacao_individual(cenario):
+    parametros = ParametrosConsorcio(**cenario)
+    varredura = SimuladorConsorcio(parametros).varrer_meses_contemplacao()
+
+    assert [p["mes_contemplacao"] for p in varredura["pontos"]] == list(range(1, parametros.prazo_meses + 1))
+    for ponto in varredura["pontos"]:
+        individual = SimuladorConsorcio(
+            parametros.model_copy(update={"mes_contemplacao": ponto["mes_contemplacao"]})
+        ).simular_cenario_completo(incluir_detalhamento=False)
+
+        assert ponto["convergiu"] == individual["resultados"]["convergiu"]
+        assert ponto["motivo_erro"] == individual["resultados"]["motivo_erro"]
+        assert ponto["vpl"] == pytest.approx(individual["resultados"]["vpl"], rel=1e-9)
+        assert ponto["fluxo_contemplacao"] == pytest.approx(individual["resumo_financeiro"]["fluxo_contemplacao"])
+        if individual["resultados"]["cet_anual"] is None:
+            assert ponto["cet_anual"] is None
+        else:
+            assert ponto["cet_anual"] == pytest.approx(individual["resultados"]["cet_anual"], rel=1e-9)
+
+
+@pytest.mark.parametrize("cenario", [{"prazo_meses": 120, "lance_livre_perc": 0.2}, {"prazo_meses": 60, "lance_livre_perc": 0.0}])
+def test_cet_esperado_igual_media_ponderada_da_varredura(cenario):
+    parametros = ParametrosConsorcio(**cenario)
+    esperado = SimuladorConsorcio(parametros).calcular_cet_esperado()
+    hazards = hazards_contemplacao(2 * parametros.prazo_meses, parametros.prazo_meses)
+
+    if parametros.lance_livre_perc == 0:
+        assert esperado["com_lance"] is None
+
+    for nome, h, lance in [("sem_lance", hazards["h_sem"], 0.0), ("com_lance", hazards["h_com"], parametros.lance_livre_perc)]:
+        if esperado[nome] is None:
+            continue
+        pontos = SimuladorConsorcio(
+            parametros.model_copy(update={"lance_livre_perc": lance})
+        ).varrer_meses_contemplacao()["pontos"]
+        f = np.array(curvas_from_hazard(h)["probabilidade_mes"])
+        cets = np.array([np.nan if p["cet_anual"] is None else p["cet_anual"] for p in pontos])
+        validos = ~np.isnan(cets)
+
+        assert esperado[nome]["prob_cet_valido"] == pytest.approx(f[validos].sum())
+        assert esperado[nome]["cet_anual_esperado"] == pytest.approx(np.dot(f[validos], cets[validos]) / f[validos].sum(), rel=1e-9)
+        assert esperado[nome]["vpl_esperado"] == pytest.approx(np.dot(f, [p["vpl"] for p in pontos]), rel=1e-9)
+        assert esperado[nome]["cet_anual_p10"] <= esperado[nome]["cet_anual_mediana"] <= esperado[nome]["cet_anual_p90"]
+
+        # Total pago: todas as parcelas (inclusive a do mês de contemplação) mais o lance
+        resultado_cronograma = SimuladorConsorcio(parametros.model_copy(update={"lance_livre_perc": lance})).gerar_cronograma()
+        parcelas = server.para_centavos(resultado_cronograma["cronograma"].parcela_corrigida).sum() / 100
+        total_pago = parcelas + resultado_cronograma["resumo"]["valor_lance_livre"]
+        assert esperado[nome]["total_pago_esperado"] == pytest.approx(total_pago * f.sum(), rel=1e-9)
+
+
+def test_indice_raizes_cet_semeia_e_respeita_capacidade(monkeypatch):
+    indice = IndiceRaizesCET(capacidade=2)
+    monkeypatch.setattr(server, "INDICE_RAIZES_CET", indice)
+    parametros = ParametrosConsorcio(mes_contemplacao=17, lance_livre_perc=0.2)
+
+    frio = SimuladorConsorcio(parametros)
+    cet_frio = frio.calcular_cet(frio.gerar_fluxos_lance_livre()["fluxos"], frio.gerar_blocos_anuais())
+
+    # Mesmos parâmetros com outra carta: mesma raiz, sem grade e em uma iteração
+    quente = SimuladorConsorcio(parametros.model_copy(update={"valor_carta": 350_000}))
+    cet_quente = quente.calcular_cet(quente.gerar_fluxos_lance_livre()["fluxos"], quente.gerar_blocos_anuais())
+    assert cet_quente == pytest.approx(cet_frio, rel=1e-12)
+    assert quente.iteracoes_cet == 1
+
+    for mes in [18, 19]:
+        vizinho = SimuladorConsorcio(parametros.model_copy(update={"mes_contemplacao": mes}))
+        vizinho.calcular_cet(vizinho.gerar_fluxos_lance_livre()["fluxos"], vizinho.gerar_blocos_anuais())
+
+    estatisticas = indice.estatisticas()
+    assert estatisticas["tamanho"] == 2
+    assert estatisticas["acertos_exatos"] == 1
+    assert estatisticas["acertos"] == 3
+
+
+@pytest.mark.parametrize("cenario", CENARIOS)
+def test_detalhamento_e_totais_em_centavos_exatos(cenario):
+    resultado = SimuladorConsorcio(ParametrosConsorcio(**cenario)).simular_cenario_completo()
+    detalhamento = resultado["detalhamento"]
+
+    for linha in detalhamento:
+        for campo in ["valor_carta_corrigido", "parcela_corrigida", "lance_livre", "fluxo_liquido", "saldo_devedor"]:
+            assert round(linha[campo] * 100) == pytest.approx(linha[campo] * 100, abs=1e-6)
+
+    assert detalhamento[-1]["saldo_devedor"] == 0
+    total_centavos = sum(round(l["parcela_corrigida"] * 100) for l in detalhamento if not l["eh_contemplacao"])
+    assert round(resultado["resumo_financeiro"]["total_parcelas"] * 100) == total_centavos
+
+
+@pytest.mark.parametrize("participantes", [1, 7, 180, 431])
+def test_motor_de_hazards_igual_aos_lacos_originais(participantes):
+    # Laço da planilha (calcular_probabilidades_contemplacao, 2 contemplados por mês)
+    restantes, h_sem, h_com, acumulada = participantes, [], [], 0.0
+    for _ in range(int(np.ceil(participantes / 2))):
+        h_sem.append(1.0 / restantes if restantes > 0 else 0.0)
+        h_com.append(2.0 / restantes if restantes > 0 else 0.0)
+        acumulada = min(acumulada + h_com[-1], 1.0)
+        restantes = max(0, restantes - 2)
+
+    planilha = server.calcular_probabilidades_contemplacao(participantes)
+    assert planilha["sem_lance"]["hazard"] == h_sem
+    assert planilha["com_lance"]["hazard"] == h_com
+    assert planilha["com_lance"]["probabilidade_acumulada"][-1] == acumulada
+
+    # Laço da versão corrigida: sobrevivência (hoje em espaço log, igual até o arredondamento) e percentis
+    corrigido = server.calcular_probabilidades_contemplacao_corrigido(participantes)["com_lance"]
+    sobrevivencia, p50 = 1.0, None
+    for mes, h in enumerate(corrigido["hazard"], start=1):
+        sobrevivencia *= 1.0 - min(2.0 / (participantes - 2 * (mes - 1)), 1.0)
+        assert corrigido["probabilidade_acumulada"][mes - 1] == pytest.approx((1.0 - sobrevivencia) * 100, rel=1e-12)
+        if p50 is None and 1.0 - sobrevivencia >= 0.5:
+            p50 = mes
+    assert corrigido["mediana_mes"] == p50
+
+
+def test_percentil_por_searchsorted():
+    F = np.array([0.05, 0.1, 0.1, 0.6, 1.0])
+    assert [server._percentile_month(F, p) for p in (0.0, 0.1, 0.5, 1.0, 1.01)] == [1, 2, 4, 5, None]
+    assert server._percentile_month(np.array([]), 0.5) is None
+
+
+def test_tabelas_de_sobrevivencia_em_lru_limitado(monkeypatch):
+    tabelas = server.TabelasSobrevivencia(limite_bytes=7000)
+    monkeypatch.setattr(server, "TABELAS_SOBREVIVENCIA", tabelas)
+
+    for mes in (1, 50, 120):
+        prob = server.calcular_probabilidade_mes_especifico(mes, 0.1, 240, 2)
+        h = hazards_contemplacao(240, mes)["h_com"]
+        assert prob["prob_no_mes"] == h[-1]
+        assert prob["prob_ate_mes"] == pytest.approx(1.0 - np.cumprod(1.0 - h)[-1], rel=1e-12)
+    assert (tabelas.faltas, tabelas.acertos) == (1, 2)
+
+    # Além da duração do grupo (só sorteio): a tabela é refeita mais longa
+    assert server.calcular_probabilidade_mes_especifico(200, 0.0, 240, 1)["prob_ate_mes"] > 0.99
+    assert tabelas.faltas == 2
+
+    # 240 (200 meses, 6400 bytes) sai para caber 100 e 102
+    server.calcular_probabilidade_mes_especifico(10, 0.1, 100, 2)
+    server.calcular_probabilidade_mes_especifico(10, 0.1, 102, 2)
+    assert list(tabelas.tabelas) == [100, 102]
+    assert tabelas.bytes == (50 + 51) * 4 * 8
+    with pytest.raises(ValueError):
+        tabelas.obter(100, 5)["F_com"][0] = 1.0  # Somente leitura
+
+
+def test_curvas_de_grupo_grande_em_espaco_log_e_amostradas():
+    h_inicial = 2.0 / 100_000
+    completo = server.calcular_probabilidades_contemplacao_corrigido(100_000)
+    assert len(completo["com_lance"]["meses"]) == 50_000
+    # 1 - (1 - h) perderia dígitos; em espaço log F_1 = h_1
+    assert completo["com_lance"]["probabilidade_acumulada"][0] == pytest.approx(h_inicial * 100, rel=1e-15)
+
+    reduzido = server.calcular_probabilidades_contemplacao_corrigido(100_000, pontos=200)
+    for nome in ("sem_lance", "com_lance"):
+        curva, inteira = reduzido[nome], completo[nome]
+        assert len(curva["meses"]) == 200 and curva["meses"][0] == 1 and curva["meses"][-1] == 50_000
+        assert curva["probabilidade_acumulada"][-1] == 100.0
+        assert curva["probabilidade_acumulada"][1] == inteira["probabilidade_acumulada"][curva["meses"][1] - 1]
+        for campo in ("esperanca_meses", "mediana_mes", "p10_mes", "p90_mes"):
+            assert curva[campo] == inteira[campo]
+
+
+def test_cronograma_de_assembleias_reproduz_grupo_padrao_e_lote():
+    cronograma = server.CronogramaAssembleias(participantes_iniciais=240, sorteios=[1] * 120, lances=[1] * 120)
+    irregular = server.CronogramaAssembleias(
+        nome="irregular", participantes_iniciais=30, sorteios=[1, 2, 1], lances=[0, 1, 3],
+        desistencias=[2, 0, 1], reativacoes=[0, 1, 0],
+    )
+    padrao, lote = server.calcular_probabilidades_cronogramas([cronograma, irregular])
+
+    # 2 contemplados por mês = curva com lance da versão corrigida
+    corrigido = server.calcular_probabilidades_contemplacao_corrigido(240)["com_lance"]
+    for campo in ("hazard", "probabilidade_acumulada", "mediana_mes", "p10_mes", "p90_mes"):
+        assert padrao["com_lance"][campo] == corrigido[campo]
+
+    # R = 30, 30 - 1 - 0 - 2, 27 - 2 - 1 + 1
+    restantes = np.array([30.0, 27.0, 25.0])
+    assert server.participantes_restantes_cronograma(30, [1, 2, 1], [0, 1, 3], [2, 0, 1], [0, 1, 0]).tolist() == restantes.tolist()
+    assert lote["sem_lance"]["hazard"] == (np.array([1, 2, 1]) / restantes * 100).tolist()
+    assert lote["com_lance"]["hazard"] == (np.array([1, 3, 4]) / restantes * 100).tolist()
+
+    # Em lote (com preenchimento até 120 meses) igual ao cálculo isolado
+    assert server.calcular_probabilidades_cronogramas([irregular])[0] == lote
+
+
+def test_disputa_de_lance_monte_carlo_confere_com_a_formula_fechada(monkeypatch):
+    parametros = server.ParametrosDisputaLance(
+        prazo_meses=20, distribuicao="uniforme", lance_maximo=1.0, lance_medio=0.5,
+        lance_livre_perc=0.9, fracao_ofertantes=0.1, simulacoes=20_000, orcamento_ms=60_000,
+    )
+    disputa = server.simular_disputa_lance(parametros)
+    assert disputa["simulacoes"] == 20_000
+
+    # Vence se nenhum dos k demais ofertar >= 0,9: (1 - 0,1 · 0,1)^k, com k = N - 2(t-1) - 1
+    demais = 40 - 2 * np.arange(20) - 1
+    esperado = (1 - 0.1 * 0.1) ** demais
+    assert np.all(np.abs(disputa["vitorias"] - esperado) <= 4 * disputa["erro_padrao"] + 1e-12)
+
+    # Lance no teto da distribuição sempre vence; orçamento zerado faz um único bloco
+    teto = server.simular_disputa_lance(parametros.model_copy(update={"lance_livre_perc": 1.0, "simulacoes": 500}))
+    assert teto["vitorias"].tolist() == [1.0] * 20
+    monkeypatch.setattr(server, "LIMITE_BYTES_BLOCO_MONTE_CARLO", 64 * 1024)
+    assert 0 < server.simular_disputa_lance(parametros.model_copy(update={"orcamento_ms": 0.0}))["simulacoes"] < 1000
+
+    # Limite menor que uma rodada com todos os meses: meses em fatias, mesma estimativa
+    monkeypatch.setattr(server, "LIMITE_BYTES_BLOCO_MONTE_CARLO", 256)
+    fatiada = server.simular_disputa_lance(parametros.model_copy(update={"simulacoes": 4000}))
+    assert fatiada["simulacoes"] == 4000
+    assert np.all(np.abs(fatiada["vitorias"] - esperado) <= 4 * fatiada["erro_padrao"] + 1e-12)
+
+
+def test_cache_da_disputa_de_lance_por_parametros(monkeypatch):
+    cache = server.CacheDisputaLance(limite=1)
+    monkeypatch.setattr(server, "CACHE_DISPUTA_LANCE", cache)
+    parametros = server.ParametrosDisputaLance(prazo_meses=12, simulacoes=200)
+
+    primeira = server.calcular_probabilidades_disputa_lance(parametros)
+    reduzida = server.calcular_probabilidades_disputa_lance(parametros.model_copy(update={"pontos_curva": 3}))
+    assert (cache.faltas, cache.acertos) == (1, 1)
+    assert reduzida["meses"] == [1, 7, 12]
+    assert reduzida["probabilidade_lance"] == [primeira["probabilidade_lance"][m - 1] for m in (1, 7, 12)]
+
+    server.calcular_probabilidades_disputa_lance(parametros.model_copy(update={"semente": 1}))
+    assert len(cache.itens) == 1 and cache.faltas == 2
+
+
+@pytest.mark.parametrize("prazo", [120, 240, 600])
+def test_resultado_igual_com_indice_de_raizes_frio_ou_quente(monkeypatch, prazo):
+    parametros = ParametrosConsorcio(prazo_meses=prazo, mes_contemplacao=30, lance_livre_perc=0.15)
+    monkeypatch.setattr(server, "INDICE_RAIZES_CET", IndiceRaizesCET())
+    frio = SimuladorConsorcio(parametros).simular_cenario_completo(incluir_detalhamento=False)
+
+    # Vizinho aquece o índice: a semente muda as iterações, não o resultado
+    SimuladorConsorcio(parametros.model_copy(update={"mes_contemplacao": 31})).simular_cenario_completo(incluir_detalhamento=False)
+    quente = SimuladorConsorcio(parametros).simular_cenario_completo(incluir_detalhamento=False)
+    assert server.INDICE_RAIZES_CET.estatisticas()["acertos"] >= 1
+    assert quente["resultados"] == frio["resultados"]
+    assert quente["fluxos"] == frio["fluxos"]